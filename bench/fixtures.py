@@ -0,0 +1,89 @@
+'''
+File: fixtures.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Synthetic trace and url files for the benchmarks.
+'''
+
+import os
+import gzip
+import random
+
+
+# first timestamp and requests per second of the synthetic traces
+START = 1194892100
+RATE = 1000
+
+URLS = ["http://en.wikipedia.org/wiki/Page_%d",
+        "http://en.wikipedia.org/w/index.php?title=Page_%d",
+        "http://en.wikipedia.org/skins-1.5/common/%d.css",
+        "http://upload.wikimedia.org/wikipedia/commons/%d.jpg",
+        "http://upload.wikimedia.org/wikipedia/en/thumb/%d.png",
+        "http://de.wikipedia.org/wiki/Seite_%d",
+        "http://ja.wikipedia.org/wiki/%d",
+        "http://upload.wikimedia.org/wikipedia/de/%d.jpg",
+        "http://commons.wikimedia.org/wiki/File:%d"]
+
+# path of the objects requested from the stand-in server
+PATH = "/wikipedia/commons/%x/%02x/Image_%d.jpg"
+
+
+def get_interval(lines):
+    """Return the time interval (start, end) of a synthetic trace."""
+    return (START, START + lines // RATE + 1)
+
+
+def generate(lines, seed=0):
+    """Yield the lines of a synthetic trace in the wikibench format."""
+    rand = random.Random(seed)
+    for nbr in xrange(lines):
+        url = rand.choice(URLS) % rand.randint(0, 100000)
+        method = rand.choice(["-", "-", "-", "save"])
+        yield "%d %.3f %s %s" % (nbr, START + float(nbr) / RATE, url, method)
+
+
+def get_paths(requests):
+    """Return the paths of requests to the stand-in server."""
+    return [PATH % (nbr % 16, nbr % 256, nbr) for nbr in xrange(requests)]
+
+
+def write(filename, lines, compress=False):
+    """Write lines to a plain or gzip file."""
+    if compress:
+        output = gzip.open(filename, "w")
+    else:
+        output = open(filename, "w")
+    try:
+        for line in lines:
+            output.write(line + "\n")
+    finally:
+        output.close()
+
+
+def get_trace(directory, lines, compress=False, seed=0):
+    """
+    Return the filename of a synthetic trace, which is created if it does
+    not exist yet.
+
+    directory   : directory of the fixtures
+    lines       : number of lines of the trace
+    compress    : create a gzip trace
+    seed        : seed of the random generator
+
+    """
+    filename = os.path.join(directory, "trace-%d-%d.log" % (lines, seed))
+    if compress:
+        filename += ".gz"
+    if not os.path.isfile(filename):
+        write(filename + ".tmp", generate(lines, seed), compress)
+        os.rename(filename + ".tmp", filename)
+    return filename
+
+
+def get_urls(directory, host, requests):
+    """Return the filename of a url list for the stand-in server."""
+    filename = os.path.join(directory, "urls-%d.log" % requests)
+    if not os.path.isfile(filename):
+        write(filename, ["http://%s%s" % (host, path)
+            for path in get_paths(requests)])
+    return filename
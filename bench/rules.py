@@ -0,0 +1,111 @@
+#!/usr/bin/env python2.6
+'''
+File: rules.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Benchmark of the url filter and rewrite rules of WikiFilter.
+
+Usage:
+    python2.6 bench/rules.py [TRACE_FILE] [LINES]
+'''
+
+import os
+import sys
+import re
+import gzip
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from ppr.rules import UrlRules
+from ppr.trace import WikiFilter
+import fixtures
+
+
+HOST = "http://ib1"
+
+def load(filename, lines):
+    """Return the first lines of a trace file."""
+    if filename.endswith(".gz"):
+        finput = gzip.open(filename, "r")
+    else:
+        finput = open(filename, "r")
+    try:
+        result = []
+        for line in finput:
+            result.append(line.strip())
+            if len(result) == lines:
+                break
+        return result
+    finally:
+        finput.close()
+
+
+def legacy(lines):
+    """Filter and rewrite lines like WikiFilter without compiled rules."""
+    regex = re.compile(WikiFilter.DEFAULT_REGEX)
+    output = []
+    for line in lines:
+        (nbr, timestamp, url, method) = line.split(" ")
+        timestamp = float(timestamp)
+        if not regex.match(url):
+            continue
+        (nbr, timestamp, url, method) = line.split(" ")
+        if method != "-":
+            continue
+        url = re.sub("^http://en.wikipedia.org/wiki/", HOST + "/wiki/", url)
+        url = re.sub("^http://en.wikipedia.org/w/", HOST + "/w/", url)
+        url = re.sub("^http://en.wikipedia.org/", HOST + "/w/", url)
+        url = re.sub("^http://upload.wikimedia.org/wikipedia/[a-z]+/",
+                HOST + "/w/images/", url)
+        output.append(" ".join([nbr, timestamp, url, method]))
+    return output
+
+
+def compiled(lines):
+    """Filter and rewrite lines like WikiFilter with compiled rules."""
+    rules = UrlRules(WikiFilter.DEFAULT_REGEX, [(pattern, HOST + path)
+        for pattern, path in WikiFilter.DEFAULT_REWRITE])
+    output = []
+    for line in lines:
+        fields = line.split(" ")
+        timestamp = float(fields[1])
+        if not rules.accept(fields[2]):
+            continue
+        (nbr, timestamp, url, method) = fields
+        if method != "-":
+            continue
+        url = rules.rewrite(url)
+        output.append(" ".join([nbr, timestamp, url, method]))
+    return output
+
+
+def measure(func, lines):
+    """Return output and lines per second of a filter function."""
+    start = time.time()
+    output = func(lines)
+    return output, len(lines) / (time.time() - start)
+
+
+def main():
+    """Run the benchmark."""
+    lines = 500000
+    if len(sys.argv) > 2:
+        lines = int(sys.argv[2])
+    if len(sys.argv) > 1:
+        lines = load(sys.argv[1], lines)
+    else:
+        lines = list(fixtures.generate(lines))
+
+    (expected, before) = measure(legacy, lines)
+    (output, after) = measure(compiled, lines)
+    if output != expected:
+        print >> sys.stderr, "ERROR: rewritten lines differ"
+        sys.exit(1)
+    print "lines:   %d (%d accepted)" % (len(lines), len(output))
+    print "before:  %.0f lines/sec" % before
+    print "after:   %.0f lines/sec" % after
+    print "speedup: %.2f" % (after / before)
+
+
+if __name__ == "__main__":
+    main()
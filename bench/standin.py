@@ -0,0 +1,135 @@
+'''
+File: standin.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Local HTTP server, which stands in for a wiki in the crawler
+             benchmarks.
+'''
+
+import time
+import zlib
+import multiprocessing
+import SocketServer
+import BaseHTTPServer
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handler, which answers every GET request with a generated object."""
+
+    protocol_version = "HTTP/1.1"
+
+    # buffer the header lines, they are flushed after every request
+    wbufsize = -1
+
+    # send the last segment of a response without waiting for an ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        """Send an object of the configured size after the latency."""
+        server = self.server
+        if server.latency > 0:
+            time.sleep(server.latency)
+        body = "x" * server.get_size(self.path)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        if server.chunk:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for start in xrange(0, len(body), server.chunk):
+                chunk = body[start:start + server.chunk]
+                self.wfile.write("%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write("0\r\n\r\n")
+        else:
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Do not log requests."""
+        pass
+
+
+class StandInHTTPServer(SocketServer.ThreadingMixIn,
+        BaseHTTPServer.HTTPServer):
+    """Threaded HTTP server with the object sizes and the latency."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, port, size, max_size, latency, chunk=0,
+            handler=StandInHandler):
+        """
+        Create a new server.
+
+        port        : local port (0 = any free port)
+        size        : size of the objects (bytes)
+        max_size    : maximal size of the objects, the size of an object is
+                      chosen by its path between size and max_size
+        latency     : seconds to wait before a response is sent
+        chunk       : size of the chunks of a chunked response (0 = send
+                      the Content-Length)
+        handler     : request handler class
+
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", port),
+                handler)
+        self.size = size
+        self.max_size = max(size, max_size)
+        self.latency = latency
+        self.chunk = chunk
+
+    def get_size(self, path):
+        """Return the size of the object of a path."""
+        return StandInServer.get_object_size(path, self.size, self.max_size)
+
+
+class StandInServer(multiprocessing.Process):
+    """
+    Process, which runs a StandInHTTPServer. The socket is bound when the
+    server is created, so the port is known before the process starts.
+
+    """
+
+    def __init__(self, port=0, size=16384, max_size=None, latency=0.0,
+            chunk=0, handler=StandInHandler):
+        """
+        Create a new server.
+
+        port        : local port (0 = any free port)
+        size        : size of the objects (bytes)
+        max_size    : maximal size of the objects (None = size)
+        latency     : seconds to wait before a response is sent
+        chunk       : size of the chunks of a chunked response (0 = send
+                      the Content-Length)
+        handler     : request handler class
+
+        """
+        multiprocessing.Process.__init__(self)
+        self.daemon = True
+        if max_size is None:
+            max_size = size
+        self._server = StandInHTTPServer(port, size, max_size, latency,
+                chunk, handler)
+        self.port = self._server.server_address[1]
+
+    @staticmethod
+    def get_object_size(path, size, max_size):
+        """Return the size of an object chosen by its path."""
+        if max_size <= size:
+            return size
+        return size + (zlib.crc32(path) & 0xffffffff) % (max_size - size + 1)
+
+    def get_size(self, path):
+        """Return the size of the object of a path."""
+        return self._server.get_size(path)
+
+    def run(self):
+        """Process run method."""
+        self._server.serve_forever()
+
+    def stop(self):
+        """Stop the server process."""
+        self.terminate()
+        self.join()
+        self._server.server_close()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python2.6
+'''
+File: suite.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Benchmark suite of the trace pipeline and the crawler.
+
+Usage:
+    python2.6 bench/suite.py [OPTIONS] [BENCHMARK ...]
+    python2.6 bench/suite.py --compare OLD_RESULTS NEW_RESULTS
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import resource
+import optparse
+import tempfile
+import subprocess
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from ppr.basic import Process, PipeReader, BatchPipe, FileReader, FileWriter
+from ppr.http import FileCrawler
+from ppr.eventloop import EventLoop
+from ppr.trace import WikiAnalyser, WikiFilter, FileCollector
+import fixtures
+from standin import StandInServer
+
+
+# rates reported for the counters of a benchmark
+RATES = [("lines", "lines_per_sec", 1.0),
+        ("bytes", "mb_per_sec", 1024.0 * 1024.0),
+        ("requests", "requests_per_sec", 1.0)]
+
+
+def get_openfunc(compress):
+    """Return the function to open a plain or gzip file."""
+    if compress:
+        import gzip
+        return gzip.open
+    return open
+
+
+def bench_analyse(options, directory, compress):
+    """FileReader -> WikiAnalyser."""
+    trace = fixtures.get_trace(options.fixtures, options.lines, compress,
+            options.seed)
+    plain = fixtures.get_trace(options.fixtures, options.lines, False,
+            options.seed)
+    # the analyser writes its files next to the trace
+    filename = os.path.join(directory, os.path.basename(trace))
+    os.symlink(trace, filename)
+    openfunc = get_openfunc(compress)
+    start = time.time()
+    analyser = WikiAnalyser(filename, openfunc, plot=False)
+    analyser.start()
+    reader = FileReader(filename, openfunc, [analyser.pipe])
+    reader.start()
+    reader.join()
+    analyser.join()
+    return dict(seconds=time.time() - start, lines=options.lines,
+            bytes=os.path.getsize(plain))
+
+
+def bench_filter(options, directory, compress):
+    """FileReader -> WikiFilter -> FileWriter (filter and rewrite trace)."""
+    trace = fixtures.get_trace(options.fixtures, options.lines, compress,
+            options.seed)
+    plain = fixtures.get_trace(options.fixtures, options.lines, False,
+            options.seed)
+    filename = os.path.join(directory, os.path.basename(trace))
+    os.symlink(trace, filename)
+    openfunc = get_openfunc(compress)
+    start = time.time()
+    wfilter = WikiFilter(filename, "localhost",
+            fixtures.get_interval(options.lines), openfunc=openfunc,
+            slack=-1)
+    wfilter.start()
+    reader = FileReader(filename, openfunc, [wfilter.pipe])
+    reader.start()
+    reader.join()
+    wfilter.join()
+    return dict(seconds=time.time() - start, lines=options.lines,
+            bytes=os.path.getsize(plain))
+
+
+def bench_writer(options, directory, compress):
+    """Lines sent to a FileWriter."""
+    lines = list(fixtures.generate(options.lines, options.seed))
+    filename = os.path.join(directory, "output.log")
+    start = time.time()
+    writer = FileWriter(filename, get_openfunc(compress))
+    writer.start()
+    pipe = writer.pipe
+    for line in lines:
+        pipe.send(line)
+    pipe.send(None)
+    pipe.close()
+    writer.join()
+    return dict(seconds=time.time() - start, lines=len(lines),
+            bytes=sum([len(line) + 1 for line in lines]))
+
+
+def bench_crawler(options, directory, server):
+    """Paths sent to a FileCrawler, which downloads from the server."""
+    paths = fixtures.get_paths(options.requests)
+    start = time.time()
+    crawler = FileCrawler("127.0.0.1", directory, server.port,
+            options.async, pipeline=options.pipeline)
+    crawler.start()
+    pipe = crawler.pipe
+    for path in paths:
+        pipe.send(path)
+    pipe.send(None)
+    pipe.close()
+    crawler.join()
+    return dict(seconds=time.time() - start, requests=len(paths),
+            bytes=sum([server.get_size(path) for path in paths]))
+
+
+def bench_collector(options, directory, server):
+    """FileReader -> FileCollector, which downloads and copies the files."""
+    urls = fixtures.get_urls(options.fixtures, "127.0.0.1", options.requests)
+    paths = fixtures.get_paths(options.requests)
+    start = time.time()
+    collector = FileCollector(os.path.join(directory, "download"),
+            os.path.join(directory, "copy"), r"^http://127.0.0.1/[\w-]+/"
+            r"[\w-]+/", server.port, options.async,
+            pipeline=options.pipeline, workers=options.workers)
+    collector.start()
+    reader = FileReader(urls, open, [collector.pipe])
+    reader.start()
+    reader.join()
+    collector.join()
+    return dict(seconds=time.time() - start, requests=len(paths),
+            bytes=sum([server.get_size(path) for path in paths]))
+
+
+# name, function and argument of all benchmarks
+BENCHMARKS = [("analyse-plain", bench_analyse, False),
+        ("analyse-gzip", bench_analyse, True),
+        ("filter-plain", bench_filter, False),
+        ("filter-gzip", bench_filter, True),
+        ("writer-plain", bench_writer, False),
+        ("writer-gzip", bench_writer, True),
+        ("crawler", bench_crawler, "server"),
+        ("collector", bench_collector, "server")]
+
+
+def measure(func, *args):
+    """
+    Run a benchmark in a new process and return its counters with the
+    peak resident size of the process and all processes started by it.
+    A benchmark measures the seconds itself, without its setup.
+
+    """
+    (receiver, sender) = multiprocessing.Pipe(duplex=False)
+
+    def target():
+        """Run the benchmark and send the counters."""
+        result = func(*args)
+        result["peak_rss_kb"] = max(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        sender.send(result)
+
+    process = multiprocessing.Process(target=target)
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    return result
+
+
+def add_rates(result):
+    """Add the rates of the counters of a result."""
+    for (counter, rate, unit) in RATES:
+        if counter in result:
+            result[rate] = result[counter] / unit / result["seconds"]
+    return result
+
+
+def get_commit():
+    """Return the current commit of the repository or None."""
+    try:
+        process = subprocess.Popen(["git", "describe", "--always",
+            "--dirty"], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        (output, errors) = process.communicate()
+    except OSError:
+        return None
+    if process.returncode != 0:
+        return None
+    return output.strip()
+
+
+def run(options, names):
+    """Run the benchmarks and return the results."""
+    directory = tempfile.mkdtemp(prefix="ppr-bench-")
+    if options.fixtures is None:
+        options.fixtures = os.path.join(directory, "fixtures")
+    if not os.path.isdir(options.fixtures):
+        os.makedirs(options.fixtures)
+    server = None
+    results = dict()
+    try:
+        for (name, func, arg) in BENCHMARKS:
+            if names and name not in names:
+                continue
+            if arg == "server":
+                if server is None:
+                    server = StandInServer(size=options.size,
+                            max_size=options.max_size,
+                            latency=options.latency, chunk=options.chunk)
+                    server.start()
+                arg = server
+            best = None
+            for repeat in xrange(options.repeat):
+                workdir = os.path.join(directory, "%s.%d" % (name, repeat))
+                os.makedirs(workdir)
+                result = measure(func, options, workdir, arg)
+                shutil.rmtree(workdir, ignore_errors=True)
+                if result is None:
+                    print >> sys.stderr, "ERROR: %s failed" % name
+                    break
+                if best is None or result["seconds"] < best["seconds"]:
+                    best = result
+            if best is not None:
+                results[name] = add_rates(best)
+                print_result(name, results[name])
+    finally:
+        if server is not None:
+            server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def print_result(name, result):
+    """Print the rates of a result."""
+    parts = ["%8.2f s" % result["seconds"]]
+    for (counter, rate, unit) in RATES:
+        if rate in result:
+            parts.append("%10.1f %s" % (result[rate], rate))
+    parts.append("%8d KB peak rss" % result["peak_rss_kb"])
+    print "%-14s %s" % (name, "  ".join(parts))
+    sys.stdout.flush()
+
+
+def compare(old_file, new_file):
+    """Print the rates of two result files and their ratio."""
+    with open(old_file, "r") as finput:
+        old = json.load(finput)
+    with open(new_file, "r") as finput:
+        new = json.load(finput)
+    print "old: %s (%s)" % (old["meta"].get("commit"), old["meta"]["time"])
+    print "new: %s (%s)" % (new["meta"].get("commit"), new["meta"]["time"])
+    print "%-14s %-17s %12s %12s %7s" % ("benchmark", "metric", "old", "new",
+            "ratio")
+    metrics = [rate for (counter, rate, unit) in RATES] + ["peak_rss_kb"]
+    for (name, func, arg) in BENCHMARKS:
+        if name not in old["results"] or name not in new["results"]:
+            continue
+        for metric in metrics:
+            if metric not in old["results"][name]:
+                continue
+            before = old["results"][name][metric]
+            after = new["results"][name][metric]
+            print "%-14s %-17s %12.1f %12.1f %7.2f" % (name, metric, before,
+                    after, float(after) / max(before, 1e-9))
+
+
+def main():
+    """Run the benchmark suite."""
+    parser = optparse.OptionParser(usage="%prog [options] [benchmark ...]",
+            description="Benchmarks: " + ", ".join([name
+                for (name, func, arg) in BENCHMARKS]))
+    parser.add_option("-o", "--output", help="save the results as JSON")
+    parser.add_option("--compare", nargs=2, metavar="OLD NEW",
+            help="compare two saved results")
+    parser.add_option("--lines", type="int", default=200000,
+            help="lines of the synthetic trace [%default]")
+    parser.add_option("--seed", type="int", default=0,
+            help="seed of the synthetic trace [%default]")
+    parser.add_option("--fixtures", help="directory to keep the fixtures "
+            "between runs [temporary]")
+    parser.add_option("--repeat", type="int", default=3,
+            help="runs of every benchmark, the fastest is reported "
+            "[%default]")
+    parser.add_option("--batch", type="int", default=1024,
+            help="lines per batch sent to a pipe [%default]")
+    parser.add_option("--requests", type="int", default=2000,
+            help="requests of the crawler benchmarks [%default]")
+    parser.add_option("--async", type="int", default=25,
+            help="asynchronous connections of the crawler [%default]")
+    parser.add_option("--pipeline", type="int", default=1,
+            help="requests sent ahead on a connection of the crawler "
+            "[%default]")
+    parser.add_option("--workers", type="int", default=1,
+            help="crawler processes of the collector per host [%default]")
+    parser.add_option("--engine", default=EventLoop.DEFAULT_ENGINE,
+            choices=EventLoop.get_engines(), help="system call to wait for "
+            "the connections of the crawler [%default]")
+    parser.add_option("--size", type="int", default=16384,
+            help="object size of the stand-in server (bytes) [%default]")
+    parser.add_option("--max-size", type="int", default=None,
+            help="maximal object size, the size of an object is chosen by "
+            "its path between size and max-size [size]")
+    parser.add_option("--latency", type="float", default=0.0,
+            help="response latency of the stand-in server (seconds) "
+            "[%default]")
+    parser.add_option("--chunk", type="int", default=0,
+            help="chunk size of chunked responses of the stand-in server, "
+            "0 sends the Content-Length (bytes) [%default]")
+    (options, names) = parser.parse_args()
+
+    if options.compare:
+        compare(*options.compare)
+        return
+    unknown = set(names) - set([name for (name, func, arg) in BENCHMARKS])
+    if unknown:
+        parser.error("unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+
+    Process.DEFAULT_LOGLEVEL = logging.WARNING
+    BatchPipe.DEFAULT_BATCH = options.batch
+    PipeReader.DEFAULT_TIMEOUT = 60
+    EventLoop.DEFAULT_ENGINE = options.engine
+    meta = dict(commit=get_commit(), time=time.strftime("%Y-%m-%d %H:%M:%S"),
+            python=platform.python_version(), platform=platform.platform(),
+            cpus=multiprocessing.cpu_count(), options=options.__dict__)
+    results = run(options, names)
+    if options.output:
+        with open(options.output, "w") as output:
+            json.dump(dict(meta=meta, results=results), output, indent=1,
+                    sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,16 +6,26 @@ Description: Basic classes for project.
 '''
 
 import sys
+import time
 import logging
 import multiprocessing
 import os.path
 from server import scp_files
+from index import TimestampIndex
+from checkpoint import Checkpoint
+from metrics import MeteredPipe, current_metrics
+from profiling import StageProfiler
 
 
 class Process(multiprocessing.Process):
     """Basic process class."""
 
     DEFAULT_LOGLEVEL = logging.DEBUG
+    DEFAULT_METRICS = None
+
+    # class names of the profiled processes and directory of the profiles
+    DEFAULT_PROFILE = []
+    DEFAULT_PROFILE_DIR = "profile"
 
     def __init__(self, output=sys.stdout, loglevel=None):
         """
@@ -31,8 +41,31 @@ class Process(multiprocessing.Process):
         self._log = multiprocessing.get_logger()
         if not self._log.handlers:
             self.create_log_handler(output, loglevel)
+        self._metrics = None
+        if Process.DEFAULT_METRICS is not None:
+            self._metrics = Process.DEFAULT_METRICS.register()
         self._log.debug("Process created %s", self.name)
 
+    def get_label(self):
+        """Return a readable name of the process for metrics and profiles."""
+        return self.name
+
+    def start(self):
+        """Start the process."""
+        if self._metrics is not None:
+            self._metrics.start(self.get_label())
+        if StageProfiler.is_profiled(type(self), Process.DEFAULT_PROFILE):
+            # the child process calls the instance attribute
+            self.run = self.profile
+        multiprocessing.Process.start(self)
+
+    def profile(self):
+        """Run the process with cProfile and save its profiles."""
+        profiler = StageProfiler(Process.DEFAULT_PROFILE_DIR,
+                self.get_label())
+        self._log.info("Profile %s", self.get_label())
+        profiler.runcall(type(self).run, self)
+
     def create_log_handler(self, output, loglevel):
         """Create a new handler for logger."""
         formatter = logging.Formatter(
@@ -51,41 +84,251 @@ class Process(multiprocessing.Process):
             self._log.debug("Set log level to: %d", loglevel)
 
 
+class BatchPipe(object):
+    """Sending end of a pipe, which transfers data in batches."""
+
+    DEFAULT_BATCH = 1
+    DEFAULT_BATCH_SIZE = 0
+
+    def __init__(self, pipe, batch=None, batch_size=None, done=None):
+        """
+        Create a new batch pipe.
+
+        pipe        : pipe to send batches
+        batch       : maximal number of items per batch (1 = no batching)
+        batch_size  : maximal number of bytes per batch (0 = unlimited)
+        done        : list of events set by the consumers of the pipe, if
+                      they need no more data
+
+        """
+        if batch is None:
+            batch = BatchPipe.DEFAULT_BATCH
+        if batch_size is None:
+            batch_size = BatchPipe.DEFAULT_BATCH_SIZE
+        if done is None:
+            done = []
+        self._pipe = pipe
+        self._batch = max(batch, 1)
+        self._batch_size = batch_size
+        self._done = done
+        self._buffer = []
+        self._size = 0
+        # MetricsSlots of the consumers
+        self._metrics = []
+
+    def add_metrics(self, metrics):
+        """Count the sent items for the MetricsSlot of a consumer."""
+        self._metrics.append(metrics)
+
+    def transfer(self, data, items):
+        """Send data and count the items and the time to send them."""
+        for metrics in self._metrics:
+            metrics.queue(items)
+        start = time.time()
+        self._pipe.send(data)
+        producer = current_metrics()
+        if producer is not None:
+            producer.sent(time.time() - start)
+
+    def is_done(self):
+        """Check if all consumers of the pipe need no more data."""
+        return bool(self._done) and all([event.is_set()
+            for event in self._done])
+
+    def send(self, data):
+        """Send data, None flushes the current batch and ends the stream."""
+        if data is None:
+            self.flush()
+            self._pipe.send(None)
+        elif self._batch == 1:
+            if self._metrics:
+                self.transfer(data, 1)
+            else:
+                self._pipe.send(data)
+        else:
+            self._buffer.append(data)
+            self._size += len(data)
+            if len(self._buffer) >= self._batch or (self._batch_size and
+                    self._size >= self._batch_size):
+                self.flush()
+
+    def mark(self, marker):
+        """Send the current batch followed by a marker (e.g. Checkpoint)."""
+        self.flush()
+        self._pipe.send(marker)
+
+    def flush(self):
+        """Send the current batch."""
+        if self._buffer:
+            if self._metrics:
+                self.transfer(self._buffer, len(self._buffer))
+            else:
+                self._pipe.send(self._buffer)
+            self._buffer = []
+            self._size = 0
+
+    def close(self):
+        """Flush the current batch and close the pipe."""
+        self.flush()
+        self._pipe.close()
+
+
 class FileReader(Process):
     """Basic file reader process."""
 
-    def __init__(self, filename, openfunc=open, pipes=[]):
+    # number of lines between two checks for finished consumers
+    CHECK_DONE = 4096
+
+    # name of the reader in a CheckpointStore
+    CHECKPOINT_NAME = "FileReader"
+
+    def __init__(self, filename, openfunc=open, pipes=[], start=0, end=None,
+            index=None, interval=None, checkpoints=None):
         """
         Create a new reader.
 
         filename    : file to read
         openfunc    : function to open file
         pipes       : list of pipes to send lines
+        start       : read lines beginning at or after this offset (bytes)
+        end         : stop reading at lines beginning at or after this offset
+                      (bytes, None = end of file)
+        index       : GzipIndex to start decompression near start offset,
+                      the data file of the index is read instead of file
+        interval    : time interval (start, end) of the lines required by
+                      the consumers, used to read only the matching part of
+                      a trace with timestamp index
+        checkpoints : CheckpointStore to send checkpoints to the pipes and
+                      to resume reading at the checkpoint to resume from
 
         """
         Process.__init__(self)
         self._filename = filename
         self._openfunc = openfunc
         self._pipes = pipes
+        self._start = start
+        self._end = end
+        self._index = index
+        self._interval = interval
+        self._checkpoints = checkpoints
+        self._number = 0
+        self._lines = 0
         self._log.debug("FileReader for %s created with %d pipes", filename,
                 len(pipes))
 
-    def read(self, line):
-        """Read line and send to all pipes."""
+    def get_label(self):
+        """Return a readable name of the reader with its file."""
+        return "%s:%s" % (self.name, os.path.basename(self._filename))
+
+    @staticmethod
+    def split(filename, parts):
+        """Split a file in byte ranges, which can be read in parallel."""
+        size = os.path.getsize(filename)
+        offsets = [size * part // parts for part in xrange(parts)]
+        return zip(offsets, offsets[1:] + [None])
+
+    def limit(self):
+        """Restrict the byte range to the lines of the time interval."""
+        if not TimestampIndex.exists(self._filename):
+            self._log.warning("No timestamp index found for %s",
+                    self._filename)
+            return
+        (start, end) = TimestampIndex(self._filename).lookup(self._interval)
+        self._start = max(self._start, start)
+        if self._end is None or end < self._end:
+            self._end = end
+        self._log.info("Read bytes %d-%d of %s for interval %s", self._start,
+                self._end, self._filename, self._interval)
+
+    def open(self):
+        """Open file, return it and the offset of its current position."""
+        if self._index is not None:
+            return self._index.open(self._start)
+        return self._openfunc(self._filename, "r"), 0
+
+    def seek(self, finput, offset):
+        """Move to the first line at or after start and return its offset."""
+        if self._start <= offset:
+            return offset
+        finput.seek(self._start - 1 - offset)
+        return self._start - 1 + len(finput.readline())
+
+    def resume(self):
+        """Continue reading after the checkpoint to resume from."""
+        checkpoints = self._checkpoints
+        state = checkpoints.load(checkpoints.resume,
+                FileReader.CHECKPOINT_NAME)
+        self._number = checkpoints.resume
+        self._start = state["offset"]
+        self._lines = state["lines"]
+        self._log.info("Resume %s at checkpoint %d (line %d, offset %d)",
+                self._filename, self._number, self._lines, self._start)
+
+    def checkpoint(self, offset, lines):
+        """Save a checkpoint and send its marker to all pipes."""
+        checkpoints = self._checkpoints
+        self._number += 1
+        checkpoints.save(self._number, FileReader.CHECKPOINT_NAME,
+                dict(offset=offset, lines=lines))
+        # finished consumers have to save their state too
+        marker = Checkpoint(self._number, offset, lines)
         for pipe in self._pipes:
+            pipe.mark(marker)
+        checkpoints.clean()
+        self._log.debug("Checkpoint %d at line %d", self._number, lines)
+
+    def read(self, line):
+        """Read line and send to all active pipes."""
+        for pipe in self._active:
             pipe.send(line)
 
+    def update(self):
+        """Stop sending to finished consumers, return if any is active."""
+        active = [pipe for pipe in self._active if not pipe.is_done()]
+        if len(active) < len(self._active):
+            self._log.debug("%d consumers finished",
+                    len(self._active) - len(active))
+            self._active = active
+        return bool(active)
+
     def run(self):
         """Process run method."""
         self._log.info("FileReader for %s started", self._filename)
 
         if self._pipes:
-            finput = self._openfunc(self._filename, "r")
+            checkpoints = self._checkpoints
+            if checkpoints is not None and checkpoints.resume is not None:
+                self.resume()
+            if self._interval is not None:
+                self.limit()
+            (finput, offset) = self.open()
+            self._active = list(self._pipes)
+            lines = self._lines
             try:
+                offset = self.seek(finput, offset)
+                end = self._end
                 for line in finput:
+                    if end is not None and offset >= end:
+                        break
+                    offset += len(line)
                     self.read(line.strip())
+                    lines += 1
+                    if checkpoints is not None and (
+                            lines % checkpoints.lines == 0):
+                        self.checkpoint(offset, lines)
+                    if lines % FileReader.CHECK_DONE == 0:
+                        if self._metrics is not None:
+                            self._metrics.set_progress(lines, offset)
+                            self._metrics.update_cpu()
+                        if not self.update():
+                            self._log.info("All consumers finished, stop "
+                                    "reading %s", self._filename)
+                            break
             finally:
                 finput.close()
+                if self._metrics is not None:
+                    self._metrics.set_progress(lines, offset)
+                    self._metrics.finish()
                 self._log.debug("Send done message to all pipes")
                 for pipe in self._pipes:
                     pipe.send(None)
@@ -99,24 +342,111 @@ class PipeReader(Process):
     """Process that consumes data from a pipe."""
 
     DEFAULT_TIMEOUT = 1800
+    DEFAULT_CHECKPOINTS = None
 
-    def __init__(self, timeout=None):
+    def __init__(self, timeout=None, batch=None, batch_size=None,
+            channel=None, checkpoints=None):
         """
         Create new reader.
 
         timeout     : pipe poll timeout
+        batch       : maximal number of items per batch send to the pipe
+        batch_size  : maximal number of bytes per batch send to the pipe
+        channel     : shared channel (e.g. RingBuffer) used instead of a pipe
+        checkpoints : CheckpointStore to save the state at checkpoints
 
         """
         Process.__init__(self)
         if timeout is None:
             timeout = PipeReader.DEFAULT_TIMEOUT
-        (self._pipe, self.pipe) = multiprocessing.Pipe(duplex=False)
+        if checkpoints is None:
+            checkpoints = PipeReader.DEFAULT_CHECKPOINTS
+        self.done = multiprocessing.Event()
+        # reader of the shared channel, which needs the consumer process
+        self._reader = None
+        if channel is None:
+            (self._pipe, pipe) = multiprocessing.Pipe(duplex=False)
+            self.pipe = BatchPipe(pipe, batch, batch_size, [self.done])
+        else:
+            self._reader = channel.reader(self.done)
+            self._pipe = self._reader
+            self.pipe = channel.sender()
+        if self._metrics is not None:
+            self._pipe = MeteredPipe(self._pipe, self._metrics)
+            self.pipe.add_metrics(self._metrics)
         self._timeout = timeout
+        self._finished = False
+        self._checkpoints = checkpoints
+        # consumers started by this process, which receive checkpoints
+        self._consumers = []
+
+    def start(self):
+        """Start the process and attach it to the reader of a channel."""
+        Process.start(self)
+        if self._reader is not None:
+            self._reader.attach(self.pid)
+
+    def finish(self):
+        """
+        Signal the producers that no more data is required. Following data
+        is received until the done message, but no longer consumed.
+
+        """
+        if not self._finished:
+            self._log.debug("Need no more data")
+            self._finished = True
+            self.done.set()
 
     def consume(self, data):
         """Consume received data."""
         pass
 
+    def consume_batch(self, batch):
+        """Consume a received batch of data."""
+        consume = self.consume
+        for data in batch:
+            consume(data)
+
+    def get_checkpoint_name(self):
+        """Return the unique name of the process in a CheckpointStore."""
+        return self.__class__.__name__
+
+    def get_state(self):
+        """Return the state to save at a checkpoint."""
+        return None
+
+    def set_state(self, state):
+        """Set the state saved at a checkpoint."""
+        pass
+
+    def checkpoint(self, marker):
+        """Save the state and forward the marker to all consumers."""
+        checkpoints = self._checkpoints
+        for consumer in self._consumers:
+            checkpoints.register(consumer.get_checkpoint_name())
+            consumer.pipe.mark(marker)
+        checkpoints.save(marker.number, self.get_checkpoint_name(),
+                dict(finished=self._finished, state=self.get_state()))
+
+    def restore(self):
+        """
+        Restore the state of the checkpoint to resume from, return if a
+        state was restored.
+
+        """
+        checkpoints = self._checkpoints
+        name = self.get_checkpoint_name()
+        if checkpoints is None or checkpoints.resume is None or (
+                not checkpoints.is_registered(name)):
+            return False
+        record = checkpoints.load(checkpoints.resume, name)
+        self.set_state(record["state"])
+        if record["finished"]:
+            self.finish()
+        self._log.info("Restored %s from checkpoint %d", name,
+                checkpoints.resume)
+        return True
+
     def run(self):
         """Process run method."""
         while True:
@@ -125,12 +455,20 @@ class PipeReader(Process):
                 if data is None:
                     self._log.debug("Received done message")
                     break
+                elif type(data) is Checkpoint:
+                    self.checkpoint(data)
+                elif self._finished:
+                    continue
+                elif type(data) is list:
+                    self.consume_batch(data)
                 else:
                     self.consume(data)
             else:
                 self._log.error("Timeout expired (Closing pipe)")
                 break
         self._pipe.close()
+        if self._metrics is not None:
+            self._metrics.finish()
 
 
 class FileWriter(PipeReader):
@@ -149,16 +487,59 @@ class FileWriter(PipeReader):
         self._filename = filename
         self._openfunc = openfunc
         self._output = None
+        self._size = None
         self._log.debug("FileWriter for %s created", filename)
 
+    def get_checkpoint_name(self):
+        """Return the unique name of the writer in a CheckpointStore."""
+        return "FileWriter:" + os.path.basename(self._filename)
+
+    def get_label(self):
+        """Return a readable name of the writer with its file."""
+        return "%s:%s" % (self.name, os.path.basename(self._filename))
+
+    def get_state(self):
+        """
+        Close the file and reopen it to append, return the size of the
+        file. A compressed file continues with a new gzip member, so the
+        file can be truncated to the size at the checkpoint.
+
+        """
+        self._output.close()
+        with open(self._filename, "rb") as finput:
+            os.fsync(finput.fileno())
+            size = os.fstat(finput.fileno()).st_size
+        self._output = self._openfunc(self._filename, "a")
+        return size
+
+    def set_state(self, size):
+        """Set the size of the file at the checkpoint."""
+        self._size = size
+
+    def open(self):
+        """Open the file, truncate it to the size of a restored state."""
+        if not self.restore():
+            return self._openfunc(self._filename, "w")
+        if os.path.getsize(self._filename) < self._size:
+            self._log.critical("ERROR: File %s is smaller than at the "
+                    "checkpoint", self._filename)
+            sys.exit(3)
+        with open(self._filename, "r+b") as output:
+            output.truncate(self._size)
+        return self._openfunc(self._filename, "a")
+
     def consume(self, line):
         """Write received line to file."""
         self._output.write(line + "\n")
 
+    def consume_batch(self, lines):
+        """Write received lines to file."""
+        self._output.write("\n".join(lines) + "\n")
+
     def run(self):
         """Process run method."""
         self._log.info("FileWriter for %s started", self._filename)
-        self._output = self._openfunc(self._filename, "w")
+        self._output = self.open()
         self._log.debug("Write file %s", self._filename)
         try:
             PipeReader.run(self)
@@ -0,0 +1,132 @@
+'''
+File: cache.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: LRU stack distances to simulate caches of all sizes.
+'''
+
+from array import array
+
+
+def bit_length(number):
+    """Return the number of bits of a positive number."""
+    if number <= 0:
+        return 0
+    return len(bin(number)) - 2
+
+
+class FenwickTree(object):
+    """Prefix sums of an array with updates in logarithmic time."""
+
+    def __init__(self, size):
+        """
+        Create a tree of zeros.
+
+        size        : number of values
+
+        """
+        self._tree = array("l", [0]) * (size + 1)
+
+    def __len__(self):
+        """Return the number of values."""
+        return len(self._tree) - 1
+
+    def add(self, pos, value):
+        """Add a value at a position."""
+        tree = self._tree
+        pos += 1
+        while pos < len(tree):
+            tree[pos] += value
+            pos += pos & -pos
+
+    def prefix(self, pos):
+        """Return the sum of the values at positions 0 to pos."""
+        tree = self._tree
+        pos += 1
+        total = 0
+        while pos > 0:
+            total += tree[pos]
+            pos -= pos & -pos
+        return total
+
+    @staticmethod
+    def build(values):
+        """Create a tree of a list of values in linear time."""
+        tree = FenwickTree(len(values))
+        data = tree._tree
+        for (pos, value) in enumerate(values):
+            data[pos + 1] += value
+            parent = pos + 1 + ((pos + 1) & -(pos + 1))
+            if parent < len(data):
+                data[parent] += data[pos + 1]
+        return tree
+
+
+class StackDistance(object):
+    """
+    LRU stack distances of a stream of accesses with the algorithm of
+    Mattson. The last access of every object is marked with the object
+    size in a Fenwick tree over the access times, so the stack distance is
+    the sum of the marks after the last access plus the object size. An
+    LRU cache hits, if it is at least as large as the stack distance. The
+    distances are counted in buckets of powers of two.
+
+    """
+
+    INITIAL = 1024
+
+    def __init__(self):
+        """Create a new stack."""
+        # key -> (time of last access, size)
+        self._last = dict()
+        self._tree = FenwickTree(StackDistance.INITIAL)
+        self._time = 0
+        self.buckets = []
+        self.requests = 0
+        self.cold = 0
+
+    def __len__(self):
+        """Return the number of distinct objects."""
+        return len(self._last)
+
+    def access(self, key, size=1):
+        """Access an object and count its stack distance."""
+        if self._time == len(self._tree):
+            self.compact()
+        self.requests += 1
+        now = self._time
+        self._time += 1
+        tree = self._tree
+        if key in self._last:
+            (last, old) = self._last[key]
+            distance = tree.prefix(now - 1) - tree.prefix(last) + size
+            tree.add(last, -old)
+            bucket = bit_length(distance - 1)
+            if bucket >= len(self.buckets):
+                self.buckets.extend([0] * (bucket + 1 - len(self.buckets)))
+            self.buckets[bucket] += 1
+        else:
+            self.cold += 1
+        tree.add(now, size)
+        self._last[key] = (now, size)
+
+    def compact(self):
+        """Renumber the last accesses and resize the tree."""
+        accesses = sorted([(last, key, size) for key, (last, size) in
+            self._last.iteritems()])
+        size = max(2 * len(accesses), StackDistance.INITIAL)
+        values = [0] * size
+        for (now, (last, key, weight)) in enumerate(accesses):
+            self._last[key] = (now, weight)
+            values[now] = weight
+        self._tree = FenwickTree.build(values)
+        self._time = len(accesses)
+
+    def hit_ratios(self):
+        """Return (cache size, hit ratio) for caches of powers of two."""
+        ratios = []
+        hits = 0
+        for (bucket, count) in enumerate(self.buckets):
+            hits += count
+            ratios.append((1 << bucket, float(hits) / self.requests))
+        return ratios
@@ -0,0 +1,286 @@
+'''
+File: channel.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Shared memory channel as alternative to multiprocessing pipes.
+'''
+
+import os
+import mmap
+import errno
+import struct
+import time
+import ctypes
+import cPickle
+import multiprocessing
+from basic import BatchPipe
+
+
+def is_alive(pid):
+    """
+    Check if a process exists and is no zombie. A dead consumer stays a
+    zombie until its parent joins it, which may wait for the producer.
+
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError, err:
+        return err.errno == errno.EPERM
+    try:
+        with open("/proc/%d/stat" % pid, "r") as finput:
+            state = finput.read().rsplit(")", 1)[1].split()[0]
+    except (IOError, IndexError):
+        return True
+    return state not in ("Z", "X")
+
+
+class RingBuffer(object):
+    """
+    Ring buffer in shared memory with a single producer and multiple
+    consumers. Every record is written once and read by all consumers.
+
+    """
+
+    DEFAULT_SIZE = 64 * 1024 * 1024
+
+    # record header: payload length and record kind
+    HEADER = struct.Struct("=IB")
+    KIND_STR = 0
+    KIND_LINES = 1
+    KIND_PICKLE = 2
+    KIND_DONE = 3
+    KIND_WRAP = 4
+
+    # maximal time to wait before shared cursors are checked again
+    WAIT = 0.1
+
+    def __init__(self, size=None, consumers=1):
+        """
+        Create a new ring buffer. Has to be created before the producer
+        and consumer processes are started.
+
+        size        : size of the buffer in bytes
+        consumers   : maximal number of consumers
+
+        """
+        if size is None:
+            size = RingBuffer.DEFAULT_SIZE
+        self._size = size
+        self._buffer = mmap.mmap(-1, size)
+        self._write = multiprocessing.Value(ctypes.c_longlong, 0, lock=False)
+        self._reads = multiprocessing.Array(ctypes.c_longlong,
+                [-1] * consumers, lock=False)
+        # process of every consumer (0 = not started)
+        self._pids = multiprocessing.Array(ctypes.c_int, consumers,
+                lock=False)
+        self._waiting = multiprocessing.Value(ctypes.c_int, 0, lock=False)
+        self._cond = multiprocessing.Condition()
+        self._consumers = 0
+        self._done = []
+        self._sender = None
+
+    def reader(self, done=None):
+        """
+        Return the receiving end for a new consumer.
+
+        done        : event set by the consumer, if it needs no more data
+
+        """
+        if self._consumers == len(self._reads):
+            raise ValueError("Ring buffer supports only %d consumers" %
+                    len(self._reads))
+        slot = self._consumers
+        self._consumers += 1
+        self._reads[slot] = self._write.value
+        if done is not None:
+            self._done.append(done)
+        return RingReader(self, slot)
+
+    def sender(self):
+        """Return the shared sending end of the ring buffer."""
+        if self._sender is None:
+            self._sender = BatchPipe(self, done=self._done)
+        return self._sender
+
+    def encode(self, data):
+        """Return record kind and payload for data."""
+        if data is None:
+            return RingBuffer.KIND_DONE, ""
+        if type(data) is str:
+            return RingBuffer.KIND_STR, data
+        if type(data) is list and data:
+            try:
+                payload = "\n".join(data)
+            except TypeError:
+                pass
+            else:
+                if payload.count("\n") == len(data) - 1:
+                    return RingBuffer.KIND_LINES, payload
+        return RingBuffer.KIND_PICKLE, cPickle.dumps(data, 2)
+
+    @staticmethod
+    def decode(kind, payload):
+        """Return data for record kind and payload."""
+        if kind == RingBuffer.KIND_STR:
+            return payload
+        if kind == RingBuffer.KIND_LINES:
+            return payload.split("\n")
+        if kind == RingBuffer.KIND_DONE:
+            return None
+        return cPickle.loads(payload)
+
+    def send(self, data):
+        """Write data to the buffer, wait if the buffer is full."""
+        kind, payload = self.encode(data)
+        header = RingBuffer.HEADER.size
+        size = header + len(payload)
+        if size > self._size:
+            raise ValueError("Record with %d bytes exceeds ring buffer size" %
+                    size)
+        write = self._write.value
+        pos = write % self._size
+        rest = self._size - pos
+        if rest < size:
+            # record does not fit at the end, continue at the beginning
+            self.wait_space(write + rest + size)
+            if rest >= header:
+                RingBuffer.HEADER.pack_into(self._buffer, pos, 0,
+                        RingBuffer.KIND_WRAP)
+            write += rest
+            pos = 0
+        else:
+            self.wait_space(write + size)
+        RingBuffer.HEADER.pack_into(self._buffer, pos, len(payload), kind)
+        self._buffer[pos + header:pos + size] = payload
+        self._write.value = write + size
+        self.notify()
+
+    def close(self):
+        """Close the sending end."""
+        pass
+
+    def min_read(self):
+        """Return the cursor of the slowest consumer."""
+        active = [read for read in self._reads if read >= 0]
+        if active:
+            return min(active)
+        return self._write.value
+
+    def wait_space(self, end):
+        """
+        Wait until all consumers have read the buffer up to end. Consumers,
+        whose process died without closing its reader, are closed.
+
+        """
+        while end - self.min_read() > self._size:
+            self.wait()
+            self.close_dead()
+
+    def close_dead(self):
+        """Close the slots of consumers, whose process died."""
+        for slot in xrange(len(self._reads)):
+            pid = self._pids[slot]
+            if self._reads[slot] >= 0 and pid and not is_alive(pid):
+                multiprocessing.get_logger().error("Consumer %d of ring "
+                        "buffer died (pid %d), stop waiting for it", slot,
+                        pid)
+                self._reads[slot] = -1
+
+    def pending(self, slot):
+        """Return the number of unread bytes of a consumer."""
+        return self._write.value - self._reads[slot]
+
+    def wait(self, timeout=None):
+        """Wait until another process moves a cursor."""
+        if timeout is None or timeout > RingBuffer.WAIT:
+            timeout = RingBuffer.WAIT
+        self._cond.acquire()
+        try:
+            self._waiting.value += 1
+            self._cond.wait(timeout)
+            self._waiting.value -= 1
+        finally:
+            self._cond.release()
+
+    def notify(self):
+        """Wake up waiting processes."""
+        if self._waiting.value:
+            self._cond.acquire()
+            try:
+                self._cond.notify_all()
+            finally:
+                self._cond.release()
+
+
+class RingReader(object):
+    """Receiving end of a ring buffer for a single consumer."""
+
+    def __init__(self, ring, slot):
+        """
+        Create a new reader.
+
+        ring        : ring buffer to read
+        slot        : consumer slot in the ring buffer
+
+        """
+        self._ring = ring
+        self._slot = slot
+
+    def skip_wrap(self):
+        """Skip the unused end of the buffer and return the read cursor."""
+        ring = self._ring
+        read = ring._reads[self._slot]
+        pos = read % ring._size
+        rest = ring._size - pos
+        if read < ring._write.value and (rest < RingBuffer.HEADER.size or
+                RingBuffer.HEADER.unpack_from(ring._buffer, pos)[1] ==
+                RingBuffer.KIND_WRAP):
+            read += rest
+            ring._reads[self._slot] = read
+        return read
+
+    def poll(self, timeout=0):
+        """Return whether data is available, wait at most timeout seconds."""
+        ring = self._ring
+        if self.skip_wrap() < ring._write.value:
+            return True
+        if timeout is not None and timeout <= 0:
+            return False
+        start = time.time()
+        while True:
+            if timeout is None:
+                ring.wait()
+            else:
+                remaining = timeout - (time.time() - start)
+                if remaining <= 0:
+                    return False
+                ring.wait(remaining)
+            if self.skip_wrap() < ring._write.value:
+                return True
+
+    def recv(self):
+        """Read the next record, wait until one is available."""
+        ring = self._ring
+        while not self.poll(None):
+            pass
+        read = ring._reads[self._slot]
+        pos = read % ring._size
+        header = RingBuffer.HEADER.size
+        (length, kind) = RingBuffer.HEADER.unpack_from(ring._buffer, pos)
+        payload = ring._buffer[pos + header:pos + header + length]
+        ring._reads[self._slot] = read + header + length
+        ring.notify()
+        return RingBuffer.decode(kind, payload)
+
+    def pending(self):
+        """Return the number of unread bytes."""
+        return self._ring.pending(self._slot)
+
+    def attach(self, pid):
+        """Set the process of the consumer, checked by a waiting producer."""
+        self._ring._pids[self._slot] = pid
+
+    def close(self):
+        """Detach the consumer, the producer no longer waits for it."""
+        self._ring._reads[self._slot] = -1
+        self._ring.notify()
@@ -0,0 +1,144 @@
+'''
+File: checkpoint.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Checkpoints to resume the processing of a trace.
+'''
+
+import os
+import shutil
+import cPickle
+
+
+class Checkpoint(object):
+    """
+    Marker sent by a FileReader in band with the lines of a trace. Every
+    consumer saves its state when it receives the marker and forwards the
+    marker to its own consumers, so the saved states belong to the same
+    line of the trace.
+
+    """
+
+    def __init__(self, number, offset, lines):
+        """
+        Create a new marker.
+
+        number      : number of the checkpoint
+        offset      : offset of the next line of the trace (bytes)
+        lines       : number of lines read before the checkpoint
+
+        """
+        self.number = number
+        self.offset = offset
+        self.lines = lines
+
+
+class CheckpointStore(object):
+    """
+    Directory with the saved states of all processes of a checkpoint. The
+    processes are registered before they can receive a marker, a
+    checkpoint is complete if every registered process saved its state.
+
+    """
+
+    SUFFIX = ".checkpoints"
+    NAMES = "names"
+
+    def __init__(self, directory, lines):
+        """
+        Create a new store.
+
+        directory   : directory to save the checkpoints
+        lines       : number of lines between two checkpoints
+
+        """
+        self._directory = directory
+        self.lines = lines
+        # checkpoint to resume from (None = start at the beginning)
+        self.resume = None
+
+    @staticmethod
+    def get_directory(filename):
+        """Return directory of the checkpoints of a trace."""
+        return filename + CheckpointStore.SUFFIX
+
+    @staticmethod
+    def makedirs(directory):
+        """Create a directory, which may be created by another process."""
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    def get_path(self, number, name):
+        """Return filename of the state of a process at a checkpoint."""
+        return os.path.join(self._directory, str(number), name)
+
+    def register(self, name):
+        """Register a process, which saves its state at every checkpoint."""
+        directory = os.path.join(self._directory, CheckpointStore.NAMES)
+        CheckpointStore.makedirs(directory)
+        open(os.path.join(directory, name), "w").close()
+
+    def is_registered(self, name):
+        """Check if a process is registered."""
+        return os.path.isfile(os.path.join(self._directory,
+            CheckpointStore.NAMES, name))
+
+    def names(self):
+        """Return the names of all registered processes."""
+        directory = os.path.join(self._directory, CheckpointStore.NAMES)
+        if not os.path.isdir(directory):
+            return []
+        return os.listdir(directory)
+
+    def numbers(self):
+        """Return the numbers of all checkpoints in ascending order."""
+        if not os.path.isdir(self._directory):
+            return []
+        return sorted([int(name) for name in os.listdir(self._directory)
+            if name.isdigit()])
+
+    def save(self, number, name, state):
+        """Save the state of a process at a checkpoint."""
+        path = self.get_path(number, name)
+        CheckpointStore.makedirs(os.path.dirname(path))
+        with open(path + ".tmp", "wb") as output:
+            cPickle.dump(state, output, cPickle.HIGHEST_PROTOCOL)
+            output.flush()
+            os.fsync(output.fileno())
+        os.rename(path + ".tmp", path)
+
+    def load(self, number, name):
+        """Load the state of a process at a checkpoint."""
+        with open(self.get_path(number, name), "rb") as finput:
+            return cPickle.load(finput)
+
+    def is_complete(self, number):
+        """Check if all registered processes saved their state."""
+        names = self.names()
+        return bool(names) and all([os.path.isfile(self.get_path(number,
+            name)) for name in names])
+
+    def latest(self):
+        """Return the number of the latest complete checkpoint or None."""
+        for number in reversed(self.numbers()):
+            if self.is_complete(number):
+                return number
+        return None
+
+    def clean(self):
+        """Remove all checkpoints before the latest complete checkpoint."""
+        latest = self.latest()
+        if latest is None:
+            return
+        for number in self.numbers():
+            if number < latest:
+                shutil.rmtree(os.path.join(self._directory, str(number)),
+                        ignore_errors=True)
+
+    def clear(self):
+        """Remove all checkpoints and registered processes."""
+        if os.path.isdir(self._directory):
+            shutil.rmtree(self._directory)
@@ -0,0 +1,275 @@
+'''
+File: columns.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Memory mapped column format for traces.
+'''
+
+import os
+import mmap
+import ctypes
+import shutil
+import urlparse
+from array import array
+
+
+class ColumnTrace(object):
+    """
+    Trace stored as memory mapped columns in a directory next to the trace.
+    Every line is saved as sequence number, timestamp, number of decimals
+    of the timestamp, url id and method code. The urls are saved once in a
+    string table together with the code of their host. The columns are
+    mapped read only, so all processes share the pages of the trace.
+
+    A line, which cannot be stored exactly, is saved as error row: the whole
+    line is saved in the string table without host, the timestamp is NaN
+    and the number of decimals ERROR_ROW.
+
+    """
+
+    VERSION = 1
+    SUFFIX = ".cols"
+    META = "meta"
+    CHUNK = 64 * 1024
+    ERROR_ROW = -1
+    NAN = float("nan")
+
+    # columns per line and per url as (name, array typecode)
+    LINE_COLUMNS = [("nbr", "l"), ("timestamp", "d"), ("decimals", "b"),
+            ("url", "i"), ("method", "B")]
+    URL_COLUMNS = [("host", "i")]
+    CTYPES = {"l": ctypes.c_long, "d": ctypes.c_double, "b": ctypes.c_byte,
+            "i": ctypes.c_int, "B": ctypes.c_ubyte}
+
+    def __init__(self, filename):
+        """
+        Open the columns of a trace.
+
+        filename    : trace file
+
+        """
+        self._filename = filename
+        self._directory = ColumnTrace.get_directory(filename)
+        meta = dict()
+        with open(os.path.join(self._directory, ColumnTrace.META),
+                "r") as finput:
+            for line in finput:
+                (key, value) = line.strip().split("=", 1)
+                meta[key] = value
+        if int(meta["version"]) != ColumnTrace.VERSION or (
+                meta["itemsizes"] != ColumnTrace.get_itemsizes()):
+            raise ValueError("Unsupported column format of %s" % filename)
+        self._lines = int(meta["lines"])
+        self._urls = int(meta["urls"])
+
+        for (name, typecode) in ColumnTrace.LINE_COLUMNS:
+            setattr(self, name, self.map_column(name, typecode, self._lines))
+        for (name, typecode) in ColumnTrace.URL_COLUMNS:
+            setattr(self, "url_" + name, self.map_column("url." + name,
+                typecode, self._urls))
+        self.url_offsets = self.map_column("urls.offsets", "l",
+                self._urls + 1)
+        self.url_data = self.map_file("urls.data") or ""
+        self.hosts = self.read_table("hosts")
+        self.methods = self.read_table("methods")
+
+    @staticmethod
+    def get_directory(filename):
+        """Return directory of the columns of a trace."""
+        return filename + ColumnTrace.SUFFIX
+
+    @staticmethod
+    def get_itemsizes():
+        """Return the item sizes of all column types."""
+        return ",".join(["%s%d" % (typecode, array(typecode).itemsize)
+            for typecode in sorted(ColumnTrace.CTYPES)])
+
+    @staticmethod
+    def exists(filename):
+        """Check if up to date columns exist for a trace."""
+        meta = os.path.join(ColumnTrace.get_directory(filename),
+                ColumnTrace.META)
+        return (os.path.isfile(meta) and
+                os.path.getmtime(meta) >= os.path.getmtime(filename))
+
+    @staticmethod
+    def convert(filename, openfunc=open, log=None):
+        """
+        Convert a trace to columns.
+
+        filename    : trace file
+        openfunc    : function to open file
+        log         : logger instance
+
+        """
+        directory = ColumnTrace.get_directory(filename)
+        tmpdir = directory + ".tmp"
+        if os.path.isdir(tmpdir):
+            shutil.rmtree(tmpdir)
+        os.mkdir(tmpdir)
+
+        columns = ColumnTrace.LINE_COLUMNS + [("url." + name, typecode)
+                for name, typecode in ColumnTrace.URL_COLUMNS] + [
+                ("urls.offsets", "l")]
+        outputs = dict()
+        buffers = dict()
+        for (name, typecode) in columns:
+            outputs[name] = open(os.path.join(tmpdir, name), "wb")
+            buffers[name] = array(typecode)
+        urldata = open(os.path.join(tmpdir, "urls.data"), "wb")
+
+        def flush():
+            """Write buffered values of all columns."""
+            for (name, values) in buffers.iteritems():
+                values.tofile(outputs[name])
+                del values[:]
+
+        # size of the string table in bytes and strings
+        table = [0, 0]
+        buffers["urls.offsets"].append(0)
+
+        def add_string(string, code):
+            """Add a string to the string table, return its id."""
+            urldata.write(string)
+            table[0] += len(string)
+            table[1] += 1
+            buffers["urls.offsets"].append(table[0])
+            buffers["url.host"].append(code)
+            return table[1] - 1
+
+        urls = dict()
+        hosts = dict()
+        methods = dict()
+        lines = 0
+        errors = 0
+        finput = openfunc(filename, "r")
+        try:
+            for line in finput:
+                line = line.strip()
+                try:
+                    (nbr, timestamp, url, method) = line.split(" ")
+                    value = float(timestamp)
+                    if "." in timestamp:
+                        decimals = len(timestamp) - timestamp.index(".") - 1
+                    else:
+                        decimals = 0
+                    if (str(int(nbr)) != nbr or
+                            "%.*f" % (decimals, value) != timestamp):
+                        raise ValueError("unable to store %s exactly" %
+                                line)
+                    if method not in methods and len(methods) == 256:
+                        raise ValueError("more than 256 methods")
+                except ValueError, err:
+                    if log is not None:
+                        log.debug("Save line %d of %s as error row (%s)",
+                                lines + 1, filename, err)
+                    buffers["nbr"].append(0)
+                    buffers["timestamp"].append(ColumnTrace.NAN)
+                    buffers["decimals"].append(ColumnTrace.ERROR_ROW)
+                    buffers["url"].append(add_string(line, -1))
+                    buffers["method"].append(0)
+                    errors += 1
+                else:
+                    if url not in urls:
+                        host = urlparse.urlsplit(url).hostname
+                        if not host:
+                            code = -1
+                        elif host in hosts:
+                            code = hosts[host]
+                        else:
+                            code = hosts[host] = len(hosts)
+                        urls[url] = add_string(url, code)
+                    if method not in methods:
+                        methods[method] = len(methods)
+                    buffers["nbr"].append(int(nbr))
+                    buffers["timestamp"].append(value)
+                    buffers["decimals"].append(decimals)
+                    buffers["url"].append(urls[url])
+                    buffers["method"].append(methods[method])
+                lines += 1
+                if lines % ColumnTrace.CHUNK == 0:
+                    flush()
+            flush()
+        finally:
+            finput.close()
+            urldata.close()
+            for output in outputs.itervalues():
+                output.close()
+
+        ColumnTrace.write_table(os.path.join(tmpdir, "hosts"), hosts)
+        ColumnTrace.write_table(os.path.join(tmpdir, "methods"), methods)
+        with open(os.path.join(tmpdir, ColumnTrace.META), "w") as output:
+            output.write("version=%d\n" % ColumnTrace.VERSION)
+            output.write("itemsizes=%s\n" % ColumnTrace.get_itemsizes())
+            output.write("lines=%d\n" % lines)
+            output.write("urls=%d\n" % table[1])
+
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.rename(tmpdir, directory)
+        if log is not None:
+            log.info("Converted %s to columns (%d lines, %d urls, %d error "
+                    "rows)", filename, lines, len(urls), errors)
+        return ColumnTrace(filename)
+
+    @staticmethod
+    def write_table(filename, table):
+        """Write a string table, one string per line ordered by code."""
+        with open(filename, "w") as output:
+            for (string, code) in sorted(table.items(),
+                    key=lambda item: item[1]):
+                output.write(string + "\n")
+
+    def read_table(self, name):
+        """Read a string table."""
+        with open(os.path.join(self._directory, name), "r") as finput:
+            return [line.rstrip("\n") for line in finput]
+
+    def map_file(self, name):
+        """Map a file of the columns, return None for empty files."""
+        with open(os.path.join(self._directory, name), "rb") as finput:
+            if os.fstat(finput.fileno()).st_size == 0:
+                return None
+            # private mapping, ctypes needs a writable buffer
+            return mmap.mmap(finput.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    def map_column(self, name, typecode, length):
+        """Map a column as ctypes array."""
+        ctype = ColumnTrace.CTYPES[typecode] * length
+        data = self.map_file(name)
+        if data is None:
+            return ctype()
+        return ctype.from_buffer(data)
+
+    def __len__(self):
+        """Return the number of lines."""
+        return self._lines
+
+    def urls(self):
+        """Return the number of urls."""
+        return self._urls
+
+    def get_url(self, url):
+        """Return the url of an url id."""
+        return self.url_data[self.url_offsets[url]:self.url_offsets[url + 1]]
+
+    def get_timestamp(self, pos):
+        """Return the timestamp of a line as in the trace."""
+        return "%.*f" % (self.decimals[pos], self.timestamp[pos])
+
+    def get_fields(self, pos):
+        """Return the fields of a line."""
+        if self.decimals[pos] == ColumnTrace.ERROR_ROW:
+            return self.get_url(self.url[pos]).split(" ")
+        return [str(self.nbr[pos]), self.get_timestamp(pos),
+                self.get_url(self.url[pos]), self.methods[self.method[pos]]]
+
+    def get_line(self, pos):
+        """Return a line of the trace."""
+        return " ".join(self.get_fields(pos))
+
+    def split(self, parts):
+        """Split the lines in ranges for parts."""
+        offsets = sorted(set([len(self) * part // parts
+            for part in xrange(parts)]))
+        return zip(offsets, offsets[1:] + [len(self)])
@@ -0,0 +1,388 @@
+'''
+File: counter.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Memory bounded counters for trace statistics.
+'''
+
+import math
+import heapq
+import struct
+import hashlib
+from array import array
+
+
+# hashes are stored as unsigned longs
+HASH_TYPECODE = "L"
+HASH_BITS = array(HASH_TYPECODE).itemsize * 8
+HASH_STRUCT = struct.Struct("<Q")
+
+
+def hash_key(key):
+    """Return the hash of a key, never zero."""
+    value = HASH_STRUCT.unpack(hashlib.md5(key).digest()[:8])[0]
+    return (value >> (64 - HASH_BITS)) or 1
+
+
+class CounterBudget(object):
+    """Memory budget shared by several counters."""
+
+    def __init__(self, size):
+        """
+        Create a new budget.
+
+        size        : available memory in bytes
+
+        """
+        self.size = size
+        self.used = 0
+
+    def reserve(self, size):
+        """Reserve memory, return if it is available."""
+        if self.used + size > self.size:
+            return False
+        self.used += size
+        return True
+
+    def use(self, size):
+        """Use memory even if the budget is exhausted."""
+        self.used += size
+
+    def release(self, size):
+        """Release reserved memory."""
+        self.used -= size
+
+
+class HashSet(object):
+    """Set of hashes in an array with open addressing."""
+
+    INITIAL = 64
+
+    def __init__(self, capacity=None):
+        """
+        Create an empty set.
+
+        capacity    : number of slots, a power of two
+
+        """
+        if capacity is None:
+            capacity = HashSet.INITIAL
+        self._table = array(HASH_TYPECODE, [0]) * capacity
+        self._mask = capacity - 1
+        self._count = 0
+
+    def __len__(self):
+        """Return the number of hashes."""
+        return self._count
+
+    def __iter__(self):
+        """Iterate over all hashes."""
+        for value in self._table:
+            if value:
+                yield value
+
+    def capacity(self):
+        """Return the number of slots."""
+        return len(self._table)
+
+    def memory(self):
+        """Return the size of the table in bytes."""
+        return len(self._table) * self._table.itemsize
+
+    def full(self):
+        """Check if the set has to grow before the next insert."""
+        return 2 * (self._count + 1) > len(self._table)
+
+    def add(self, value):
+        """Add a nonzero hash."""
+        table = self._table
+        mask = self._mask
+        pos = value & mask
+        while True:
+            item = table[pos]
+            if item == value:
+                return
+            if not item:
+                table[pos] = value
+                self._count += 1
+                return
+            pos = (pos + 1) & mask
+
+    def resize(self, capacity):
+        """
+        Move all hashes to a table with more slots. They are inserted from
+        the old table, so only the old and the new table are in memory.
+
+        """
+        old = self._table
+        self._table = array(HASH_TYPECODE, [0]) * capacity
+        self._mask = capacity - 1
+        self._count = 0
+        add = self.add
+        for value in old:
+            if value:
+                add(value)
+
+
+class HyperLogLog(object):
+    """Estimate the number of distinct hashes with HyperLogLog."""
+
+    def __init__(self, error):
+        """
+        Create an empty estimator.
+
+        error       : relative standard error of the estimation
+
+        """
+        bits = int(math.ceil(math.log((1.04 / error) ** 2, 2)))
+        self._bits = min(max(bits, 4), 18)
+        self._registers = bytearray(1 << self._bits)
+
+    def memory(self):
+        """Return the size of the registers in bytes."""
+        return len(self._registers)
+
+    def add(self, value):
+        """Add a hash."""
+        rest_bits = HASH_BITS - self._bits
+        index = value >> rest_bits
+        rest = value & ((1 << rest_bits) - 1)
+        if rest:
+            rank = rest_bits - (len(bin(rest)) - 2) + 1
+        else:
+            rank = rest_bits + 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def merge(self, other):
+        """Add the hashes of another estimator with the same error."""
+        if self._bits != other._bits:
+            raise ValueError("Unable to merge HyperLogLog with %d and %d "
+                    "bits" % (self._bits, other._bits))
+        registers = self._registers
+        for (index, rank) in enumerate(other._registers):
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def count(self):
+        """Return the estimated number of distinct hashes."""
+        size = len(self._registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(size,
+                0.7213 / (1 + 1.079 / size))
+        estimate = alpha * size * size / sum([2.0 ** -rank
+            for rank in self._registers])
+        zeros = self._registers.count("\x00")
+        if estimate <= 2.5 * size and zeros:
+            # linear counting for small cardinalities
+            estimate = size * math.log(float(size) / zeros)
+        return int(round(estimate))
+
+
+class DistinctCounter(object):
+    """
+    Count distinct keys by their 64 bit hashes. In exact mode the hashes
+    are kept in a HashSet until its table would exceed the memory budget,
+    then the counter continues with HyperLogLog.
+
+    """
+
+    DEFAULT_MODE = "exact"
+    DEFAULT_ERROR = 0.01
+    DEFAULT_MEMORY = 64 * 1024 * 1024
+
+    def __init__(self, budget=None, mode=None, error=None):
+        """
+        Create a new counter.
+
+        budget      : CounterBudget shared with other counters
+        mode        : exact or hll
+        error       : relative standard error of HyperLogLog
+
+        """
+        if budget is None:
+            budget = CounterBudget(DistinctCounter.DEFAULT_MEMORY)
+        if mode is None:
+            mode = DistinctCounter.DEFAULT_MODE
+        if error is None:
+            error = DistinctCounter.DEFAULT_ERROR
+        self._budget = budget
+        self._error = error
+        self._exact = None
+        self._hll = None
+        if mode == "exact":
+            self._exact = HashSet()
+            if not budget.reserve(self._exact.memory()):
+                self._exact = None
+        if self._exact is None:
+            self._hll = HyperLogLog(error)
+            budget.use(self._hll.memory())
+
+    def is_exact(self):
+        """Check if the count is exact."""
+        return self._exact is not None
+
+    def add(self, key):
+        """Add a key."""
+        self.add_hash(hash_key(key))
+
+    def update(self, keys):
+        """Add several keys."""
+        for key in keys:
+            self.add_hash(hash_key(key))
+
+    def add_hash(self, value):
+        """Add the hash of a key."""
+        exact = self._exact
+        if exact is not None:
+            if exact.full():
+                if self._budget.reserve(exact.memory()):
+                    exact.resize(2 * exact.capacity())
+                else:
+                    self.estimate()
+                    self._hll.add(value)
+                    return
+            exact.add(value)
+        else:
+            self._hll.add(value)
+
+    def estimate(self):
+        """Continue counting with HyperLogLog."""
+        self._hll = HyperLogLog(self._error)
+        self._budget.use(self._hll.memory())
+        for value in self._exact:
+            self._hll.add(value)
+        self._budget.release(self._exact.memory())
+        self._exact = None
+
+    def merge(self, other):
+        """Add the keys of another counter."""
+        if other._exact is not None:
+            for value in other._exact:
+                self.add_hash(value)
+        else:
+            if self._exact is not None:
+                self.estimate()
+            self._hll.merge(other._hll)
+
+    def count(self):
+        """Return the number of distinct keys."""
+        if self._exact is not None:
+            return len(self._exact)
+        return self._hll.count()
+
+
+class TopCounter(object):
+    """
+    Find the most frequent keys with the Space-Saving algorithm. At most
+    capacity keys are counted, a new key replaces the key with the smallest
+    count and inherits its count as error, so the counts are upper bounds
+    and the counts minus the errors are lower bounds.
+
+    """
+
+    DEFAULT_CAPACITY = 10000
+
+    def __init__(self, capacity=None):
+        """
+        Create a new counter.
+
+        capacity    : maximal number of counted keys
+
+        """
+        if capacity is None:
+            capacity = TopCounter.DEFAULT_CAPACITY
+        self._capacity = max(capacity, 1)
+        # key -> [count, error]
+        self._counts = dict()
+        # (count, key) for every key, the count may be outdated
+        self._heap = []
+        self.total = 0
+
+    def __len__(self):
+        """Return the number of counted keys."""
+        return len(self._counts)
+
+    def add(self, key, count=1):
+        """Count a key."""
+        self.total += count
+        entry = self._counts.get(key)
+        if entry is not None:
+            entry[0] += count
+            return
+        if len(self._counts) < self._capacity:
+            self._counts[key] = [count, 0]
+            heapq.heappush(self._heap, (count, key))
+            return
+
+        # replace the key with the smallest count
+        heap = self._heap
+        while True:
+            (smallest, old) = heapq.heappop(heap)
+            current = self._counts[old][0]
+            if current == smallest:
+                break
+            heapq.heappush(heap, (current, old))
+        del self._counts[old]
+        self._counts[key] = [smallest + count, smallest]
+        heapq.heappush(heap, (smallest + count, key))
+
+    def smallest(self):
+        """Return the smallest count, if all keys are counted."""
+        if len(self._counts) < self._capacity:
+            return 0
+        return min([entry[0] for entry in self._counts.itervalues()])
+
+    def merge(self, other):
+        """Add the keys of another counter."""
+        smallest = self.smallest()
+        other_smallest = other.smallest()
+        counts = dict()
+        for (key, (count, error)) in self._counts.iteritems():
+            counts[key] = [count + other_smallest, error + other_smallest]
+        for (key, (count, error)) in other._counts.iteritems():
+            if key in counts:
+                counts[key][0] += count - other_smallest
+                counts[key][1] += error - other_smallest
+            else:
+                counts[key] = [count + smallest, error + smallest]
+        self.total += other.total
+        self.rebuild(counts)
+
+    def rebuild(self, counts):
+        """Keep the keys with the largest counts."""
+        items = sorted(counts.iteritems(), key=lambda item: -item[1][0])
+        self._counts = dict(items[:self._capacity])
+        self._heap = [(entry[0], key) for key, entry in
+                self._counts.iteritems()]
+        heapq.heapify(self._heap)
+
+    def top(self, number):
+        """Return (key, count, error) of the most frequent keys."""
+        items = sorted(self._counts.iteritems(),
+                key=lambda item: (-item[1][0], item[0]))
+        return [(key, count, error) for key, (count, error) in
+                items[:number]]
+
+    def share(self, number):
+        """
+        Return a lower and an upper bound of the share of the number most
+        frequent keys in all counts. Every key, which is not counted, has
+        at most the smallest count, so the largest counts are an upper
+        bound and the largest counts minus their errors a lower bound.
+        Return None if more keys than counted are asked for and keys were
+        replaced, because the counts of the other keys are unknown.
+
+        """
+        if not self.total:
+            return (0.0, 0.0)
+        entries = self._counts.values()
+        lower = sorted([count - error for (count, error) in entries],
+                reverse=True)
+        # the lower bounds add up to all counts, if no key was replaced
+        if number > len(lower) and sum(lower) < self.total:
+            return None
+        upper = sorted([count for (count, error) in entries],
+                reverse=True)[:number]
+        total = float(self.total)
+        return (min(sum(lower[:number]) / total, 1.0),
+                min(sum(upper) / total, 1.0))
@@ -0,0 +1,167 @@
+'''
+File: eventloop.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Event loop of the asynchronous HTTP clients with epoll.
+'''
+
+import errno
+import select
+import asyncore
+import resource
+
+
+def raise_file_limit(files):
+    """
+    Raise the soft limit of open files of the process to files, but not
+    beyond the hard limit, and return the new soft limit.
+
+    """
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < files:
+        if hard != resource.RLIM_INFINITY:
+            files = min(files, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (files, hard))
+        soft = files
+    return soft
+
+
+class EventLoop(object):
+    """
+    Event loop over the asyncore dispatchers of a map. The epoll engine
+    keeps the sockets registered between two polls and only asks the
+    dispatchers with events, new dispatchers and changed dispatchers, if
+    they are readable or writable. So a poll costs no system call and no
+    method call per idle socket and the number of sockets is not limited
+    to 1024 like with select. The poll and select engines run one round
+    of asyncore.loop.
+
+    """
+
+    ENGINES = ["epoll", "poll", "select"]
+    DEFAULT_ENGINE = "epoll" if hasattr(select, "epoll") else "poll"
+
+    def __init__(self, channels, engine=None):
+        """
+        Create a new event loop, has to be created in the process, which
+        runs it.
+
+        channels    : map of file descriptors to dispatchers
+        engine      : system call to wait for events (epoll, poll or
+                      select)
+
+        """
+        if engine is None:
+            engine = EventLoop.DEFAULT_ENGINE
+        if engine not in EventLoop.get_engines():
+            raise ValueError("Engine %s is not available" % engine)
+        self._channels = channels
+        self._engine = engine
+        self._epoll = None
+        # registered dispatchers and their events by file descriptor
+        self._objects = dict()
+        self._flags = dict()
+        # file descriptors to check before the next poll
+        self._changed = set()
+        if engine == "epoll":
+            self._epoll = select.epoll()
+
+    @staticmethod
+    def get_engines():
+        """Return the engines available on this system."""
+        return [engine for engine in EventLoop.ENGINES
+                if hasattr(select, engine)]
+
+    @staticmethod
+    def get_flags(obj):
+        """Return the events a dispatcher waits for."""
+        flags = 0
+        if obj.readable():
+            flags |= select.EPOLLIN | select.EPOLLPRI
+        if obj.writable() and not obj.accepting:
+            flags |= select.EPOLLOUT
+        return flags
+
+    def get_engine(self):
+        """Return the engine of the loop."""
+        return self._engine
+
+    def changed(self, obj):
+        """
+        Check the events of a dispatcher before the next poll. Required for
+        a dispatcher, which sent data outside of its handlers (e.g. a
+        request on an idle connection), because only a full send buffer
+        makes it writable.
+
+        """
+        self._changed.add(obj._fileno)
+
+    def register(self, fd, obj):
+        """Register the socket of a new dispatcher."""
+        flags = EventLoop.get_flags(obj)
+        self._epoll.register(fd, flags)
+        self._objects[fd] = obj
+        self._flags[fd] = flags
+
+    def unregister(self, fd):
+        """Remove the socket of a closed dispatcher."""
+        del self._objects[fd]
+        del self._flags[fd]
+        try:
+            self._epoll.unregister(fd)
+        except (IOError, OSError):
+            # removed by the kernel when the socket was closed
+            pass
+
+    def update(self):
+        """Register new sockets and change the events of changed ones."""
+        channels = self._channels
+        objects = self._objects
+        # compared by identity, the dispatchers define no equality
+        if objects != channels:
+            for fd in objects.keys():
+                if channels.get(fd) is not objects[fd]:
+                    # closed or descriptor reused by a new dispatcher
+                    self.unregister(fd)
+            for (fd, obj) in channels.iteritems():
+                if fd not in objects:
+                    self.register(fd, obj)
+        flags = self._flags
+        for fd in self._changed:
+            obj = objects.get(fd)
+            if obj is not None:
+                events = EventLoop.get_flags(obj)
+                if events != flags[fd]:
+                    self._epoll.modify(fd, events)
+                    flags[fd] = events
+        self._changed.clear()
+
+    def poll(self, timeout):
+        """Wait at most timeout seconds for events and handle them once."""
+        if self._epoll is None:
+            self._changed.clear()
+            asyncore.loop(timeout, self._engine == "poll", self._channels, 1)
+            return
+        self.update()
+        try:
+            events = self._epoll.poll(timeout)
+        except IOError, err:
+            if err.errno != errno.EINTR:
+                raise
+            events = []
+        channels = self._channels
+        changed = self._changed
+        for (fd, flags) in events:
+            obj = channels.get(fd)
+            if obj is not None:
+                asyncore.readwrite(obj, flags)
+                changed.add(fd)
+
+    def close(self):
+        """Close the loop, but not the sockets of the dispatchers."""
+        if self._epoll is not None:
+            self._epoll.close()
+            self._epoll = None
+        self._objects.clear()
+        self._flags.clear()
+        self._changed.clear()
@@ -0,0 +1,115 @@
+'''
+File: histogram.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Mergeable histograms with logarithmic buckets for latencies and
+             sizes.
+'''
+
+import math
+
+
+class LogHistogram(object):
+    """
+    Histogram in the style of HdrHistogram. Values are scaled to integers
+    and counted in buckets, which double their width with every power of
+    two, so every bucket covers at most 1/64 of its values (below 1.6%
+    error). The buckets are kept in a dict, so a histogram is small, can
+    be pickled and histograms of several processes can be merged.
+
+    """
+
+    # sub buckets per power of two (bits)
+    SUB_BITS = 7
+    SUB_COUNT = 1 << SUB_BITS
+    SUB_HALF = SUB_COUNT >> 1
+
+    def __init__(self, scale=1.0):
+        """
+        Create an empty histogram.
+
+        scale       : factor to scale values to integers (1e6 = seconds are
+                      counted in microseconds)
+
+        """
+        self.scale = scale
+        self.buckets = dict()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def __len__(self):
+        """Return the number of values."""
+        return self.count
+
+    @staticmethod
+    def get_index(value):
+        """Return the bucket of a scaled value."""
+        shift = max(math.frexp(value)[1] - LogHistogram.SUB_BITS, 0)
+        return LogHistogram.SUB_HALF * shift + (value >> shift)
+
+    @staticmethod
+    def get_range(index):
+        """Return the lowest and the highest scaled value of a bucket."""
+        shift = max(index // LogHistogram.SUB_HALF - 1, 0)
+        low = (index - LogHistogram.SUB_HALF * shift) << shift
+        return (low, low + (1 << shift) - 1)
+
+    def add(self, value, count=1):
+        """Count a value."""
+        index = LogHistogram.get_index(max(int(value * self.scale), 0))
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Add the values of another histogram with the same scale."""
+        if other.scale != self.scale:
+            raise ValueError("Unable to merge histograms of scale %g and %g"
+                    % (self.scale, other.scale))
+        buckets = self.buckets
+        for (index, count) in other.buckets.iteritems():
+            buckets[index] = buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or
+                other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or
+                other.max > self.max):
+            self.max = other.max
+
+    def mean(self):
+        """Return the mean value or None."""
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, percent):
+        """
+        Return the value below or equal to which percent of all values are
+        or None, if the histogram is empty. The value is the highest value
+        of its bucket, but never beyond the smallest or the largest value.
+
+        percent     : percentile between 0 and 100
+
+        """
+        if not self.count:
+            return None
+        rank = max(int(math.ceil(percent / 100.0 * self.count)), 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                value = LogHistogram.get_range(index)[1] / self.scale
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def percentiles(self, percents):
+        """Return a list of percentiles."""
+        return [self.percentile(percent) for percent in percents]
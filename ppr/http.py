@@ -5,29 +5,61 @@ E-Mail: sebastian.menski@googlemail.com'
 Description: Basic http classes for http requests.
 '''
 from basic import PipeReader
+from histogram import LogHistogram
+from eventloop import EventLoop, raise_file_limit
+import sys
 import asynchat
-import asyncore
 import socket
 import re
 import time
 import os
 import urllib
+import urlparse
+import collections
 import multiprocessing
 
 
 class HTTPAsyncClient(asynchat.async_chat):
-    """Client to send HTTP1.1 requests."""
+    """
+    Client to send HTTP1.1 requests. The response is read with the
+    terminators of asynchat: the header up to the empty line, a body of
+    known length as a number of bytes, a chunked body chunk by chunk and
+    any other body until the connection is closed. Received parts are
+    collected in lists and joined once.
+
+    With pipelining, up to pipeline requests are sent ahead on the
+    connection and the responses are matched to them in order. Once a
+    response closes the connection, no further request is sent and the
+    pending paths are left to be requested again (see get_paths).
+
+    """
 
     TERMINATOR = "\r\n\r\n"
+    LINE_TERMINATOR = "\r\n"
     HTTP_COMMAND = "GET %s HTTP/1.1\r\nHost: %s\r\n\r\n"
     PATTERN_CONNECTION_CLOSE = re.compile(
-            r'^Connection:[ ]*(\w+).*$', re.MULTILINE)
+            r'^Connection:[ ]*close\b', re.MULTILINE | re.IGNORECASE)
+    PATTERN_CONNECTION_KEEP_ALIVE = re.compile(
+            r'^Connection:[ ]*keep-alive\b', re.MULTILINE | re.IGNORECASE)
     PATTERN_TRANSFER_ENCODING = re.compile(
-            r'^Transfer-Encoding:[ ]*(\w+).*$', re.MULTILINE)
+            r'^Transfer-Encoding:.*\bchunked\b', re.MULTILINE | re.IGNORECASE)
     PATTERN_CONTENT_LENGTH = re.compile(
-            r'^Content-Length:[ ]*([0-9]+).*$', re.MULTILINE)
+            r'^Content-Length:[ ]*([0-9]+)', re.MULTILINE | re.IGNORECASE)
+
+    # part of the response read next
+    STATE_HEADER = 0
+    STATE_BODY = 1
+    STATE_UNTIL_CLOSE = 2
+    STATE_CHUNK_SIZE = 3
+    STATE_CHUNK = 4
+    STATE_CHUNK_END = 5
+    STATE_TRAILER = 6
+
+    # bytes read from the socket at once
+    ac_in_buffer_size = 65536
 
-    def __init__(self, host, pipe, port=80, channels=None):
+    def __init__(self, host, pipe, port=80, channels=None, stats=None,
+            pool=None, pipeline=1):
         """
         Create a new client.
 
@@ -35,6 +67,11 @@ class HTTPAsyncClient(asynchat.async_chat):
         pipe        : pipe of paths
         port        : port to connect
         channels    : map of file descriptors 
+        stats       : HTTPStats to record the timings (None = no stats)
+        pool        : ConnectionPool, which keeps the connection idle if no
+                      path is available (None = close the connection)
+        pipeline    : maximal number of requests sent ahead on the
+                      connection (1 = no pipelining)
 
         """
         asynchat.async_chat.__init__(self, map=channels)
@@ -42,93 +79,200 @@ class HTTPAsyncClient(asynchat.async_chat):
         self._host = host
         self._pipe = pipe
         self._port = port
+        self._stats = stats
+        self._pool = pool
+        self._pipeline = max(pipeline, 1)
+        # pending requests as (path, time sent) in the order they were sent
+        self._requests = collections.deque()
+        self._exhausted = False
+        self._closed = False
         self._time = 0
         self._htime = 0
         self._path = ""
-        self._header = ""
-        self._body = ""
-        self._data = ""
-        self._protocol = ""
-        self._status = -1
-        self._status_msg = ""
-        self._close = False
-        self._chunked = True
-        self._content_length = -1
+        self.reset()
 
-        self.set_terminator(HTTPAsyncClient.TERMINATOR)
         self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._connect_time = time.time()
         self.connect((self._host, self._port))
         self._log.debug(self.logmsg("HTTPAsyncClient connected to %s:%d",
             self._host, self._port))
         self.send_request()
 
+    def handle_connect(self):
+        """Record the connect time."""
+        if self._stats is not None:
+            self._stats.add_connect(time.time() - self._connect_time)
+
     def logmsg(self, msg, *args):
         """Returns a log message with the filedescriptor id."""
         return "[FD: %3d] %s" % (self.fileno(), msg % args)
 
-    def get_request(self):
+    def get_request(self, path):
         """Returns a valid HTTP1.1 request command."""
-        return HTTPAsyncClient.HTTP_COMMAND % (self._path, self._host)
+        return HTTPAsyncClient.HTTP_COMMAND % (path, self._host)
 
-    def send_request(self):
-        """Sends a new request, if more paths are available."""
-        self._path = ""
+    def reset(self):
+        """Reset the state of the last response."""
+        if self._requests:
+            (self._path, self._time) = self._requests[0]
+        else:
+            self._path = ""
         self._header = ""
         self._body = ""
-        self._data = ""
+        self._data = []
+        self._parts = []
+        self._length = 0
         self._protocol = ""
         self._status = -1
         self._status_msg = ""
         self._close = False
-        self._chunked = True
+        self._chunked = False
         self._content_length = -1
+        self._state = HTTPAsyncClient.STATE_HEADER
+        self.set_terminator(HTTPAsyncClient.TERMINATOR)
+
+    def push_request(self, path):
+        """Send the request of a path."""
+        request = self.get_request(path)
+        self._log.debug(self.logmsg("Send request: %s",
+            request.replace("\r\n", "(CRLF)")))
+        self._requests.append((path, time.time()))
+        if len(self._requests) == 1:
+            (self._path, self._time) = self._requests[0]
+        self.push(request)
 
-        if self._pipe.poll():
-            self._path = self._pipe.recv()
-            if self._path is None:
+    def send_request(self):
+        """Sends new requests, if more paths are available."""
+        # a failed send closes the connection
+        while len(self._requests) < self._pipeline and not self._close and (
+                not self._closed) and not self._exhausted and (
+                self._pipe.poll()):
+            path = self._pipe.recv()
+            if path is None:
                 self._log.debug(self.logmsg("Done message found"))
-                self.close()
+                self._exhausted = True
             else:
-                request = self.get_request()
-                self.push(request)
-                self._time = time.time()
-                self._log.debug(self.logmsg("Send request: %s",
-                    request.replace("\r\n", "(CRLF)")))
+                self.push_request(path)
+        if self._requests or self._closed:
+            return
+        if self._pool is not None and not self._exhausted:
+            self._pool.set_idle(self)
         else:
             self._log.debug("Close connection (no requests found)")
             self.close()
 
+    def close(self):
+        """Close the connection and remove the client from its pool."""
+        self._closed = True
+        asynchat.async_chat.close(self)
+        if self._pool is not None:
+            self._pool.remove(self)
+
     def collect_incoming_data(self, data):
         """Collects the received data."""
-        self._data += data
-        if not self._chunked and len(self._data) >= self._content_length:
-            self.found_terminator()
+        if self._closed:
+            return
+        state = self._state
+        if state == HTTPAsyncClient.STATE_BODY or (
+                state == HTTPAsyncClient.STATE_CHUNK) or (
+                state == HTTPAsyncClient.STATE_UNTIL_CLOSE):
+            self._length += len(data)
+            self.collect_body(data)
+        elif state != HTTPAsyncClient.STATE_CHUNK_END:
+            self._data.append(data)
+
+    def collect_body(self, data):
+        """Collects a part of the response body."""
+        self._parts.append(data)
 
     def found_terminator(self):
         """Handles terminator appearance."""
-        if not self._header:
+        # asynchat passes the rest of a read on, after the client is closed
+        if self._closed:
+            return
+        state = self._state
+        if state == HTTPAsyncClient.STATE_HEADER:
             self._htime = time.time() - self._time
-            self._header = self._data
-            self._data = ""
+            self._header = "".join(self._data)
+            self._data = []
             self.analyse_header()
+            self.read_body()
+        elif state == HTTPAsyncClient.STATE_CHUNK_SIZE:
+            line = "".join(self._data)
+            self._data = []
+            try:
+                size = int(line.split(";", 1)[0].strip(), 16)
+            except ValueError:
+                self._log.error(self.logmsg("Invalid chunk size %r (%s)",
+                    line, self._path))
+                self.close()
+                return
+            if size == 0:
+                self._state = HTTPAsyncClient.STATE_TRAILER
+                self.set_terminator(HTTPAsyncClient.LINE_TERMINATOR)
+            else:
+                self._state = HTTPAsyncClient.STATE_CHUNK
+                self.set_terminator(size)
+        elif state == HTTPAsyncClient.STATE_CHUNK:
+            self._state = HTTPAsyncClient.STATE_CHUNK_END
+            self.set_terminator(HTTPAsyncClient.LINE_TERMINATOR)
+        elif state == HTTPAsyncClient.STATE_CHUNK_END:
+            self._state = HTTPAsyncClient.STATE_CHUNK_SIZE
+        elif state == HTTPAsyncClient.STATE_TRAILER:
+            # the trailer ends with an empty line, its fields are ignored
+            line = "".join(self._data)
+            self._data = []
+            if not line:
+                self.finish_response()
+        elif state == HTTPAsyncClient.STATE_BODY:
+            self.finish_response()
 
-            if self._content_length == 0:
-                self.found_terminator()
+    def read_body(self):
+        """Set the terminator to read the body announced by the header."""
+        if self._status < 200 or self._status in [204, 304] or (
+                self._content_length == 0):
+            self.finish_response()
+        elif self._chunked:
+            self._state = HTTPAsyncClient.STATE_CHUNK_SIZE
+            self.set_terminator(HTTPAsyncClient.LINE_TERMINATOR)
+        elif self._content_length > 0:
+            self._state = HTTPAsyncClient.STATE_BODY
+            self.set_terminator(self._content_length)
         else:
-            self._time = time.time() - self._time
-            self._body = self._data
-            self.process_response()
+            self._state = HTTPAsyncClient.STATE_UNTIL_CLOSE
+            self._close = True
+            self.set_terminator(None)
+
+    def finish_response(self):
+        """Process a complete response and send the next request."""
+        self._time = time.time() - self._time
+        self._body = "".join(self._parts)
+        self._parts = []
+        if self._stats is not None:
+            self._stats.add_response(self._path, self._status,
+                    self._htime, self._time, self._length)
+        self.process_response()
+        self._requests.popleft()
+        if self._close:
             self._path = ""
-            if self._close:
-                self.close()
-            else:
-                self.send_request()
+            self.close()
+        else:
+            self.reset()
+            self.send_request()
+
+    def handle_close(self):
+        """Finish a response, which ends with the connection, and close."""
+        if self._path and self._state == HTTPAsyncClient.STATE_UNTIL_CLOSE:
+            self.finish_response()
+        else:
+            self.close()
 
     def analyse_header(self):
         """Analyse the response header."""
-        self._protocol, self._status, self._status_msg = self._header.split(
-                "\r\n")[0].split(" ", 2)
-        self._status = int(self._status)
+        status = self._header.split("\r\n", 1)[0].split(" ", 2)
+        self._protocol = status[0]
+        self._status = int(status[1])
+        self._status_msg = len(status) > 2 and status[2] or ""
         self._close = self.get_close()
         self._chunked = self.get_chunked()
         self._content_length = self.get_content_length()
@@ -139,9 +283,17 @@ class HTTPAsyncClient(asynchat.async_chat):
             self._content_length, self._htime, self._path))
 
     def get_close(self):
-        """Checks if the response header require the connection to close."""
-        match = HTTPAsyncClient.PATTERN_CONNECTION_CLOSE.search(self._header)
-        return match is not None
+        """
+        Checks if the response header require the connection to close. A
+        HTTP1.0 connection is closed, unless it is kept alive.
+
+        """
+        if HTTPAsyncClient.PATTERN_CONNECTION_CLOSE.search(self._header):
+            return True
+        if self._protocol == "HTTP/1.0":
+            return HTTPAsyncClient.PATTERN_CONNECTION_KEEP_ALIVE.search(
+                    self._header) is None
+        return False
 
     def get_chunked(self):
         """Checks if the response header contains chunked encoding flag."""
@@ -157,25 +309,275 @@ class HTTPAsyncClient(asynchat.async_chat):
             return -1
 
     def get_path(self):
-        """Return last requested path."""
+        """Return the path of the current response."""
         return self._path
 
+    def get_paths(self):
+        """Return the paths of all requests without response."""
+        return [path for (path, sent) in self._requests]
+
     def process_response(self):
         """Process response body."""
         self._log.debug(self.logmsg(
             "Response received (Protocol: %s, Status: %d %s, Length: %d, "
             "Time: %f) %s", self._protocol, self._status, self._status_msg,
-            len(self._body), self._time, self._path))
+            self._length, self._time, self._path))
+
+
+class HTTPStats(object):
+    """
+    Connect times, header times, response times and response sizes of HTTP
+    requests in LogHistograms by status and request class. The statistics
+    of several crawlers can be merged.
+
+    """
+
+    # request classes
+    CLASSES = ["page", "image", "thumb"]
+
+    # histograms of a response, the scale of their values and the report
+    # title, unit and factor
+    METRICS = [("header", 1e6, "HEADER TIME", "ms", 1e3),
+            ("response", 1e6, "RESPONSE TIME", "ms", 1e3),
+            ("bytes", 1.0, "RESPONSE SIZE", "bytes", 1.0)]
+
+    # reported percentiles
+    PERCENTILES = [50, 90, 99, 99.9]
+
+    def __init__(self):
+        """Create new statistics."""
+        self.connect = LogHistogram(1e6)
+        # histograms of the responses by (status, class) and metric
+        self.responses = dict()
+        self.errors = 0
+        self.start = None
+        self.end = None
+
+    @staticmethod
+    def get_class(path):
+        """Return the request class of a path (page, image or thumb)."""
+        parts = path.split("?", 1)[0].split("/")
+        if "thumb" in parts:
+            return "thumb"
+        if parts[1:2] == ["wikipedia"] or "images" in parts[:3]:
+            return "image"
+        return "page"
+
+    def add_time(self, start, end):
+        """Extend the time range of the requests."""
+        if self.start is None or start < self.start:
+            self.start = start
+        if self.end is None or end > self.end:
+            self.end = end
+
+    def add_connect(self, seconds):
+        """Count a connection and its connect time."""
+        now = time.time()
+        self.connect.add(seconds)
+        self.add_time(now - seconds, now)
+
+    def add_response(self, path, status, header, seconds, size):
+        """
+        Count a response.
+
+        path        : requested path
+        status      : status code
+        header      : seconds until the header was received
+        seconds     : seconds until the response was received
+        size        : size of the response body (bytes)
+
+        """
+        key = (status, HTTPStats.get_class(path))
+        histograms = self.responses.get(key)
+        if histograms is None:
+            histograms = dict([(metric, LogHistogram(scale))
+                for (metric, scale, title, unit, factor)
+                in HTTPStats.METRICS])
+            self.responses[key] = histograms
+        histograms["header"].add(header)
+        histograms["response"].add(seconds)
+        histograms["bytes"].add(size)
+        now = time.time()
+        self.add_time(now - seconds, now)
+
+    def add_error(self):
+        """Count a request without response."""
+        self.errors += 1
+
+    def merge(self, other):
+        """Add the statistics of another crawler."""
+        self.connect.merge(other.connect)
+        for (key, histograms) in other.responses.iteritems():
+            if key not in self.responses:
+                self.responses[key] = dict([(metric, LogHistogram(
+                    histogram.scale)) for (metric, histogram)
+                    in histograms.iteritems()])
+            for (metric, histogram) in histograms.iteritems():
+                self.responses[key][metric].merge(histogram)
+        self.errors += other.errors
+        if other.start is not None:
+            self.add_time(other.start, other.end)
+
+    def get_histogram(self, metric, status=None, kind=None):
+        """Return the merged histogram of a metric for a status and class."""
+        total = None
+        for ((code, name), histograms) in self.responses.iteritems():
+            if status not in [None, code] or kind not in [None, name]:
+                continue
+            if total is None:
+                total = LogHistogram(histograms[metric].scale)
+            total.merge(histograms[metric])
+        return total
+
+    def get_row(self, kind, status, histogram, factor):
+        """Return a report line of a histogram."""
+        values = [histogram.mean()] + histogram.percentiles(
+                HTTPStats.PERCENTILES) + [histogram.max]
+        return "%-6s %6s %9d %s" % (kind, status, histogram.count,
+                " ".join(["%10.3f" % (value * factor) for value in values]))
+
+    def get_requests(self):
+        """Return the number of responses."""
+        histogram = self.get_histogram("bytes")
+        if histogram is None:
+            return 0
+        return histogram.count
+
+    def get_seconds(self):
+        """Return the seconds from the first connect to the last response."""
+        if self.start is None:
+            return 0.0
+        return self.end - self.start
+
+    def report(self):
+        """Return the statistics as text."""
+        sformat = "%30s: %s"
+        seconds = max(self.get_seconds(), 1e-6)
+        requests = self.get_requests()
+        size = self.get_histogram("bytes")
+        size = size is not None and size.total or 0
+        lines = ["[THROUGHPUT]",
+                sformat % ("responses", requests),
+                sformat % ("errors", self.errors),
+                sformat % ("connections", self.connect.count),
+                sformat % ("seconds", "%.3f" % self.get_seconds()),
+                sformat % ("requests/s", "%.1f" % (requests / seconds)),
+                sformat % ("MB/s", "%.3f" % (size / seconds / 1024 / 1024))]
+        header = "%-6s %6s %9s %s" % ("class", "status", "count",
+                " ".join(["%10s" % name for name in ["mean"] + [
+                    "p%g" % percent for percent in HTTPStats.PERCENTILES] +
+                    ["max"]]))
+        if self.connect.count:
+            lines += ["", "[CONNECT TIME (ms)]", header,
+                    self.get_row("all", "all", self.connect, 1e3)]
+        if not requests:
+            return "\n".join(lines)
+        for (metric, scale, title, unit, factor) in HTTPStats.METRICS:
+            lines += ["", "[%s (%s)]" % (title, unit), header,
+                    self.get_row("all", "all", self.get_histogram(metric),
+                        factor)]
+            for kind in HTTPStats.CLASSES:
+                # a class with a single status is reported by its status
+                if len([name for (status, name) in self.responses
+                    if name == kind]) > 1:
+                    lines.append(self.get_row(kind, "all",
+                        self.get_histogram(metric, kind=kind), factor))
+            for (status, kind) in sorted(self.responses):
+                lines.append(self.get_row(kind, status,
+                    self.responses[(status, kind)][metric], factor))
+        return "\n".join(lines)
+
+    def write(self, output):
+        """Write the statistics to output."""
+        output.write(self.report() + "\n")
+
+
+class ConnectionPool(object):
+    """
+    Queued paths and open connections of a HTTPCrawler. A client takes
+    the next path as soon as its response is complete and waits idle on
+    its connection, if no path is queued. Closed clients are kept until
+    the crawler checked them.
+
+    """
+
+    def __init__(self):
+        """Create an empty pool."""
+        self._paths = collections.deque()
+        self.clients = set()
+        self.idle = set()
+        self.closed = []
+
+    def __len__(self):
+        """Return the number of queued paths."""
+        return len(self._paths)
+
+    def put(self, path):
+        """Queue a path."""
+        self._paths.append(path)
+
+    def retry(self, path):
+        """Queue a path of a closed connection in front of all others."""
+        self._paths.appendleft(path)
+
+    def poll(self):
+        """Return whether a path is queued."""
+        return len(self._paths) > 0
+
+    def recv(self):
+        """Return the next path."""
+        return self._paths.popleft()
+
+    def add(self, client):
+        """Add a new client."""
+        self.clients.add(client)
+
+    def set_idle(self, client):
+        """Mark a client as idle."""
+        self.idle.add(client)
+
+    def remove(self, client):
+        """Remove a closed client."""
+        if client in self.clients:
+            self.clients.discard(client)
+            self.idle.discard(client)
+            self.closed.append(client)
+
+    def pop_closed(self):
+        """Return and forget the closed clients."""
+        closed = self.closed
+        self.closed = []
+        return closed
+
+    def close(self):
+        """Close all connections."""
+        for client in list(self.clients):
+            client.close()
 
 
 class HTTPCrawler(PipeReader):
     """
     HTTP crawler that uses HTTPAsyncClient instances for asynchronous
-    HTTP requests.
+    HTTP requests. The connections are kept in a ConnectionPool for the
+    whole crawl, every connection requests the next path as soon as it is
+    free and a closed connection is replaced while paths are queued.
 
     """
 
-    def __init__(self, host, port=80, async=100, retry=7, timeout=None):
+    # paths read ahead per connection
+    READ_AHEAD = 4
+
+    # maximal seconds to wait for responses before the pipe is read
+    WAIT = 0.01
+
+    # maximal seconds to wait for paths, if all connections are idle
+    IDLE_WAIT = 1.0
+
+    # open files besides the connections and their files
+    SPARE_FILES = 64
+
+    def __init__(self, host, port=80, async=100, retry=7, timeout=None,
+            batch=1, results=None, pipeline=1):
         """
         Create a new crawler.
 
@@ -184,34 +586,39 @@ class HTTPCrawler(PipeReader):
         async       : amount of asychronous connections
         retry       : number of connection attempts
         timeout     : timeout for pipe consumption
+        batch       : maximal number of items per batch send to the pipe
+        results     : pipe to send the HTTPStats at the end (None = log the
+                      statistics)
+        pipeline    : maximal number of requests sent ahead on a connection
+                      (1 = no pipelining)
 
         """
-        PipeReader.__init__(self, timeout)
+        PipeReader.__init__(self, timeout, batch=batch)
         self._host = host
         self._port = port
         self._async = async
         self._retry = retry
-        self._clients = []
+        self._results = results
+        self._pipeline = pipeline
         self._done = False
         self._channels = dict()
+        self._pool = ConnectionPool()
+        # created in the crawling process
+        self._loop = None
+        self.stats = HTTPStats()
         self._log.debug("HTTPCrawler created for %s:%d with %d clients",
                 self._host, self._port, self._async)
 
     def create_client(self):
         """Return a new client."""
-        return HTTPAsyncClient(self._host, self._pipe, self._port,
-                self._channels)
+        return HTTPAsyncClient(self._host, self._pool, self._port,
+                self._channels, self.stats, self._pool, self._pipeline)
 
-    def postprocess(self):
-        """Check all clients after all connections are closed."""
-        for client in self._clients:
-            path = client.get_path()
-            if path is None:
-                self._done = True
-                self._log.debug("Done message found")
-                break
-            elif path:
-                self.pipe.send(path)
+    def postprocess(self, clients):
+        """Check closed clients and queue their unfinished paths again."""
+        for client in clients:
+            for path in reversed(client.get_paths()):
+                self._pool.retry(path)
 
     def test_connection(self):
         """Attempt to connect to server on given port."""
@@ -234,34 +641,99 @@ class HTTPCrawler(PipeReader):
                 sock.close()
         return False
 
+    def read(self, timeout=0):
+        """Queue paths of the pipe, wait at most timeout seconds for them."""
+        pool = self._pool
+        limit = self._async * self._pipeline * HTTPCrawler.READ_AHEAD
+        while not self._done and len(pool) < limit and (
+                self._pipe.poll(timeout)):
+            timeout = 0
+            data = self._pipe.recv()
+            if data is None:
+                self._log.debug("Received done message")
+                self._done = True
+            elif type(data) is list:
+                for path in data:
+                    pool.put(path)
+            else:
+                pool.put(data)
+            self._received = time.time()
+
+    def dispatch(self):
+        """Send queued paths on idle connections and open new ones."""
+        pool = self._pool
+        while pool.poll() and pool.idle:
+            client = pool.idle.pop()
+            client.send_request()
+            self._loop.changed(client)
+        while pool.poll() and len(pool.clients) < self._async:
+            pool.add(self.create_client())
+
+    def raise_file_limit(self):
+        """Raise the limit of open files for all connections."""
+        files = 2 * self._async + HTTPCrawler.SPARE_FILES
+        limit = raise_file_limit(files)
+        if limit < files:
+            self._log.warning("Only %d open files allowed for %d connections",
+                    limit, self._async)
+
+    def crawl(self):
+        """Request all paths of the pipe on the pooled connections."""
+        pool = self._pool
+        self.raise_file_limit()
+        self._loop = EventLoop(self._channels)
+        self._received = time.time()
+        while True:
+            self.read()
+            self.dispatch()
+            if len(pool.clients) > len(pool.idle):
+                self._loop.poll(HTTPCrawler.WAIT)
+                self.postprocess(pool.pop_closed())
+            elif self._done:
+                break
+            elif time.time() - self._received > self._timeout:
+                self._log.error("Poll timeout (close pipe)")
+                break
+            else:
+                # all connections are idle, wait for paths
+                self.read(HTTPCrawler.IDLE_WAIT)
+        pool.close()
+        self._loop.close()
+        self.postprocess(pool.pop_closed())
+        self._channels.clear()
+
     def run(self):
         """Process run method."""
         if self.test_connection():
-            while not self._done:
-                while self._pipe.poll(self._timeout):
-                    self._channels.clear()
-                    del self._clients[:]
-                    while self._pipe.poll() and (
-                            len(self._clients) < self._async):
-                        self._clients.append(self.create_client())
-
-                    asyncore.loop(map=self._channels)
-                    self.postprocess()
-                    if self._done:
-                        break
-                else:
-                    self._log.error("Poll timeout (close pipe)")
-                    self._done = True
-                    break
+            self.crawl()
         else:
             self._log.error("Unable to connect to %s:%d", self._host,
                     self._port)
+        self.report()
+
+    def report(self):
+        """Log the statistics or send them to the results pipe."""
+        if self._results is None:
+            self._log.info("HTTPCrawler for %s:%d finished\n%s", self._host,
+                    self._port, self.stats.report())
+            return
+        self._log.debug("HTTPCrawler for %s:%d finished (%d responses)",
+                self._host, self._port, self.stats.get_requests())
+        self._results.send(self.stats)
+        self._results.close()
 
 
 class FileClient(HTTPAsyncClient):
-    """Client to send HTTP1.1 requests and save the response a file."""
+    """
+    Client to send HTTP1.1 requests and save the response a file. The body
+    is written to a temporary file as it arrives, which is renamed to the
+    file, when the response is complete. So the memory does not grow with
+    the size of the files and no incomplete file is left behind.
 
-    def __init__(self, host, pipe, directory, port=80, channels=None):
+    """
+
+    def __init__(self, host, pipe, directory, port=80, channels=None,
+            stats=None, pool=None, pipeline=1):
         """
         Create a new client.
 
@@ -270,34 +742,101 @@ class FileClient(HTTPAsyncClient):
         directory   : directory to save reponse files
         port        : port to connect
         channels    : map of file descriptors 
+        stats       : HTTPStats to record the timings (None = no stats)
+        pool        : ConnectionPool, which keeps the connection idle if no
+                      path is available (None = close the connection)
+        pipeline    : maximal number of requests sent ahead on the
+                      connection (1 = no pipelining)
 
         """
-        HTTPAsyncClient.__init__(self, host, pipe, port, channels)
         self._dir = directory
+        self._output = None
+        self._file_path = None
+        self._temp_path = None
         self.error = set()
+        HTTPAsyncClient.__init__(self, host, pipe, port, channels, stats,
+                pool, pipeline)
+
+    def reset(self):
+        """Reset the state of the last request."""
+        HTTPAsyncClient.reset(self)
+        self._failed = False
+
+    def get_file_path(self):
+        """Return the local file of the requested path."""
+        file_path = re.sub(r'^/[\w-]+/[\w-]+/', '/', self._path)
+        file_path = self._dir + urllib.unquote(file_path)
+        return os.path.abspath(file_path)
+
+    def open_file(self):
+        """Open a temporary file next to the local file of the response."""
+        self._file_path = self.get_file_path()
+        directory = os.path.split(self._file_path)[0]
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+                self._log.debug(self.logmsg("Create directory %s",
+                    directory))
+            except OSError:
+                # created by another client in the meantime
+                if not os.path.isdir(directory):
+                    raise
+        self._temp_path = "%s.%d-%d.part" % (self._file_path, os.getpid(),
+                self.fileno())
+        self._output = open(self._temp_path, "wb")
+
+    def discard(self):
+        """Close and remove an incomplete temporary file."""
+        if self._output is not None:
+            self._output.close()
+            self._output = None
+        if self._temp_path is not None:
+            try:
+                if os.path.exists(self._temp_path):
+                    os.remove(self._temp_path)
+            except OSError, err:
+                self._log.error(self.logmsg(err))
+            self._temp_path = None
+
+    def collect_body(self, data):
+        """Write a part of the response body to the temporary file."""
+        if self._status != 200 or self._failed:
+            return
+        try:
+            if self._output is None:
+                self.open_file()
+            self._output.write(data)
+        except Exception, err:
+            self._log.error(self.logmsg(err))
+            self._failed = True
+            self.discard()
 
     def process_response(self):
         """Process response body."""
         HTTPAsyncClient.process_response(self)
         if self._status == 200:
-            file_path = re.sub(r'^/[\w-]+/[\w-]+/', '/', self._path)
-            file_path = self._dir + urllib.unquote(file_path)
-            file_path = os.path.abspath(file_path)
-            directory = os.path.split(file_path)[0]
+            if self._failed:
+                return
             try:
-                if not os.path.isdir(directory):
-                    os.makedirs(directory)
-                    self._log.debug(self.logmsg("Create directory %s",
-                        directory))
-                with open(file_path, "wb") as output:
-                    output.write(self._data)
+                if self._output is None:
+                    self.open_file()
+                self._output.close()
+                self._output = None
+                os.rename(self._temp_path, self._file_path)
+                self._temp_path = None
                 self._log.debug(self.logmsg("Write %s to %s", self._path,
-                    file_path))
+                    self._file_path))
             except Exception, err:
                 self._log.error(self.logmsg(err))
+                self.discard()
         else:
             self.error.add(self._host + self._path)
 
+    def close(self):
+        """Remove an incomplete file and close the connection."""
+        self.discard()
+        HTTPAsyncClient.close(self)
+
 
 class FileCrawler(HTTPCrawler):
     """
@@ -307,7 +846,7 @@ class FileCrawler(HTTPCrawler):
     """
 
     def __init__(self, host, directory, port=80, async=25, retry=7,
-            timeout=None):
+            timeout=None, results=None, pipeline=1):
         """
         Create a new crawler.
 
@@ -317,27 +856,313 @@ class FileCrawler(HTTPCrawler):
         async       : amount of asychronous connections
         retry       : number of connection attempts
         timeout     : timeout for pipe consumption
+        results     : pipe to send the missing files and the HTTPStats at
+                      the end (None = log them)
+        pipeline    : maximal number of requests sent ahead on a connection
+                      (1 = no pipelining)
 
         """
-        HTTPCrawler.__init__(self, host, port, async, retry, timeout)
+        HTTPCrawler.__init__(self, host, port, async, retry, timeout,
+                results=results, pipeline=pipeline)
         self._dir = os.path.abspath(directory)
         self._error = set()
 
     def create_client(self):
         """Return a new client."""
-        return FileClient(self._host, self._pipe, self._dir, self._port,
-                self._channels)
+        return FileClient(self._host, self._pool, self._dir, self._port,
+                self._channels, self.stats, self._pool, self._pipeline)
 
-    def postprocess(self):
-        """Check all clients after all connections are closed."""
-        for client in self._clients:
+    def postprocess(self, clients):
+        """Check closed clients and collect their errors."""
+        for client in clients:
             self._error.update(client.error)
-        HTTPCrawler.postprocess(self)
+        HTTPCrawler.postprocess(self, clients)
 
-    def run(self):
-        """Process run method."""
-        HTTPCrawler.run(self)
-        if self._error:
+    def report(self):
+        """
+        Log the missing files or send them to the results pipe before the
+        statistics.
+
+        """
+        if self._results is not None:
+            self._results.send(sorted(self._error))
+        elif self._error:
             self._log.info("Unable to find files:\n%s", "\n".join(self._error))
         else:
             self._log.info("All files found")
+        HTTPCrawler.report(self)
+
+
+class ReplayClient(HTTPAsyncClient):
+    """
+    Client of a HTTPReplayer, which sends the due requests of the replayer
+    and waits idle on its connection, if no request is due.
+
+    """
+
+    def __init__(self, host, replayer, port=80, channels=None):
+        """
+        Create a new client.
+
+        host        : host to connect
+        replayer    : HTTPReplayer of the client
+        port        : port to connect
+        channels    : map of file descriptors
+
+        """
+        self._replayer = replayer
+        self._due = 0
+        HTTPAsyncClient.__init__(self, host, None, port, channels,
+                replayer.stats)
+
+    def send_request(self):
+        """Sends the next due request or marks the client as idle."""
+        request = self._replayer.next_request()
+        if request is None:
+            self._replayer.set_idle(self)
+            return
+        (self._due, path) = request
+        self.push_request(path)
+        self._replayer.replay.add_sent(self._time - self._due)
+
+    def process_response(self):
+        """Nothing to do, the response is counted in the HTTPStats."""
+        pass
+
+    def handle_error(self):
+        """Log the error and close the connection."""
+        (kind, err) = sys.exc_info()[:2]
+        self._log.debug("Replay connection failed (%s)", err)
+        if self._path:
+            self._replayer.stats.add_error()
+            self._path = ""
+        self.close()
+
+    def handle_close(self):
+        """Count a request without response and close the connection."""
+        if self._path and self._state != HTTPAsyncClient.STATE_UNTIL_CLOSE:
+            self._replayer.stats.add_error()
+            self._path = ""
+        HTTPAsyncClient.handle_close(self)
+
+    def close(self):
+        """Close the connection and remove the client from the replayer."""
+        HTTPAsyncClient.close(self)
+        self._replayer.remove_client(self)
+
+
+class ReplayStats(object):
+    """Schedule lag of a replay."""
+
+    # schedule lags reported as share of late requests (seconds)
+    LAGS = [0.001, 0.01, 0.1, 1.0]
+
+    def __init__(self):
+        """Create new statistics."""
+        self.sent = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.late = [0] * len(ReplayStats.LAGS)
+
+    def add_sent(self, lag):
+        """Count a sent request and its lag behind the schedule."""
+        self.sent += 1
+        self.lag += lag
+        if lag > self.max_lag:
+            self.max_lag = lag
+        for (pos, limit) in enumerate(ReplayStats.LAGS):
+            if lag <= limit:
+                break
+            self.late[pos] += 1
+
+    def get_late(self, limit):
+        """Return the share of requests sent later than limit seconds."""
+        return self.late[ReplayStats.LAGS.index(limit)] / float(
+                max(self.sent, 1))
+
+    def write(self, output):
+        """Write the statistics to output."""
+        sformat = "%30s: %s\n"
+        output.write("[SCHEDULE]\n")
+        output.write(sformat % ("requests", self.sent))
+        output.write(sformat % ("mean lag", "%.6f s" % (self.lag /
+            max(self.sent, 1))))
+        output.write(sformat % ("max lag", "%.6f s" % self.max_lag))
+        for limit in ReplayStats.LAGS:
+            output.write(sformat % ("later than %g s" % limit, "%.2f%%" %
+                (100 * self.get_late(limit))))
+
+
+class HTTPReplayer(HTTPCrawler):
+    """
+    Replay the lines of a trace at their relative timestamps, scaled by a
+    speed-up factor. The replay is open loop: a due request is sent on an
+    idle connection or on a new connection, no matter how many responses
+    are outstanding. Requests are only delayed, if all connections are
+    busy, this schedule lag is reported to detect a saturated replayer.
+
+    """
+
+    DEFAULT_CONNECTIONS = 1000
+
+    # lines read ahead of the schedule
+    READ_AHEAD = 10000
+
+    # maximal seconds to wait for due requests or responses
+    WAIT = 0.01
+
+    # seconds between two progress messages
+    PROGRESS = 10
+
+    def __init__(self, host, port=80, speedup=1.0, connections=None,
+            filename=None, retry=7, timeout=None):
+        """
+        Create a new replayer.
+
+        host        : host to connect
+        port        : port to connect
+        speedup     : factor to speed up the trace (2 = twice as fast)
+        connections : maximal number of connections
+        filename    : file to write the statistics (None = log only)
+        retry       : number of connection attempts
+        timeout     : timeout for pipe consumption
+
+        """
+        if connections is None:
+            connections = HTTPReplayer.DEFAULT_CONNECTIONS
+        HTTPCrawler.__init__(self, host, port, connections, retry, timeout,
+                batch=None)
+        self._speedup = float(speedup)
+        self._filename = filename
+        self._clients = set()
+        self._idle = set()
+        self._schedule = collections.deque()
+        # first timestamp of the trace and its time of replay
+        self._origin = None
+        self.replay = ReplayStats()
+
+    def create_client(self):
+        """Return a new client."""
+        return ReplayClient(self._host, self, self._port, self._channels)
+
+    def next_request(self):
+        """Return the next due request (due, path) or None."""
+        if self._schedule and self._schedule[0][0] <= time.time():
+            return self._schedule.popleft()
+        return None
+
+    def set_idle(self, client):
+        """Mark a client as idle."""
+        self._idle.add(client)
+
+    def remove_client(self, client):
+        """Remove a closed client."""
+        self._clients.discard(client)
+        self._idle.discard(client)
+
+    def schedule(self, line):
+        """Add a line of the trace to the schedule."""
+        try:
+            (nbr, timestamp, url, method) = line.split(" ")
+            timestamp = float(timestamp)
+            split = urlparse.urlsplit(url)
+        except ValueError:
+            self._log.warning("Unable to parse line %s", line)
+            return
+        path = split.path or "/"
+        if split.query:
+            path += "?" + split.query
+        if self._origin is None:
+            self._origin = (timestamp, time.time())
+        due = self._origin[1] + (timestamp - self._origin[0]) / self._speedup
+        self._schedule.append((due, path))
+
+    def read(self):
+        """Read lines until READ_AHEAD lines are scheduled."""
+        while not self._done and len(self._schedule) < (
+                HTTPReplayer.READ_AHEAD) and self._pipe.poll():
+            data = self._pipe.recv()
+            if data is None:
+                self._log.debug("Received done message")
+                self._done = True
+            elif type(data) is list:
+                for line in data:
+                    self.schedule(line)
+            else:
+                self.schedule(data)
+            self._received = time.time()
+
+    def dispatch(self):
+        """Send the due requests on idle or new connections."""
+        now = time.time()
+        while self._schedule and self._schedule[0][0] <= now:
+            if self._idle:
+                client = self._idle.pop()
+                client.send_request()
+                self._loop.changed(client)
+            elif len(self._clients) < self._async:
+                self._clients.add(self.create_client())
+            else:
+                break
+
+    def progress(self, last):
+        """Log the requests and the schedule lag since the last message."""
+        stats = self.replay
+        elapsed = max(time.time() - last[0], 1e-6)
+        sent = stats.sent - last[1]
+        self._log.info("Replay: %.0f requests/s, lag %.3f s (max %.3f s, "
+                "%.1f%% > 0.1 s), %d connections (%d idle), %d errors",
+                sent / elapsed, (stats.lag - last[2]) / max(sent, 1),
+                stats.max_lag, 100 * stats.get_late(0.1),
+                len(self._clients), len(self._idle), self.stats.errors)
+        if stats.late[ReplayStats.LAGS.index(1.0)] > last[3]:
+            self._log.warning("Replay is more than 1 s behind the "
+                    "schedule, the replayer is saturated")
+        return (time.time(), stats.sent, stats.lag,
+                stats.late[ReplayStats.LAGS.index(1.0)])
+
+    def run(self):
+        """Process run method."""
+        self._log.info("HTTPReplayer for %s:%d started (speed-up %g)",
+                self._host, self._port, self._speedup)
+        if not self.test_connection():
+            self._log.error("Unable to connect to %s:%d", self._host,
+                    self._port)
+            return
+        self.raise_file_limit()
+        self._loop = EventLoop(self._channels)
+        self._received = time.time()
+        last = (time.time(), 0, 0.0, 0)
+        while True:
+            self.read()
+            self.dispatch()
+            if self._done and not self._schedule and (
+                    len(self._idle) == len(self._clients)):
+                break
+            if not self._done and not self._schedule and (
+                    time.time() - self._received > self._timeout):
+                self._log.error("Poll timeout (close pipe)")
+                break
+            wait = HTTPReplayer.WAIT
+            if self._schedule:
+                wait = min(max(self._schedule[0][0] - time.time(), 0), wait)
+            if self._channels:
+                self._loop.poll(wait)
+            else:
+                time.sleep(wait)
+            if time.time() - last[0] >= HTTPReplayer.PROGRESS:
+                last = self.progress(last)
+        self.progress(last)
+        for client in list(self._clients):
+            client.close()
+        self._loop.close()
+        self._pipe.close()
+
+        if self._filename is not None:
+            with open(self._filename, "w") as output:
+                self.replay.write(output)
+                output.write("\n")
+                self.stats.write(output)
+        self._log.info("HTTPReplayer for %s:%d finished (%d requests)\n%s",
+                self._host, self._port, self.replay.sent,
+                self.stats.report())
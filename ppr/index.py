@@ -0,0 +1,346 @@
+'''
+File: index.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Sidecar indices for random access to trace files.
+'''
+
+import os
+import gzip
+import zlib
+import bisect
+
+
+class GzipIndex(object):
+    """
+    Access index for gzip compressed traces. Every checkpoint is the start
+    of an independent gzip member at a line boundary, so decompression can
+    start at every checkpoint. A trace without such members is never
+    changed, the index refers to a copy of it with the same content as
+    independent members (the data file of the index).
+
+    """
+
+    DEFAULT_SPAN = 16 * 1024 * 1024
+    HEADER = "# gzip index"
+    CHUNK = 1024 * 1024
+
+    def __init__(self, filename):
+        """
+        Load the index of a gzip file.
+
+        filename    : gzip compressed file
+
+        """
+        self._filename = filename
+        self._datafile = filename
+        self._uoffsets = []
+        self._coffsets = []
+        with open(GzipIndex.get_index_file(filename), "r") as finput:
+            for line in finput:
+                if line.startswith("#"):
+                    for field in line[len(GzipIndex.HEADER):].split():
+                        if field.startswith("file="):
+                            self._datafile = os.path.join(
+                                    os.path.dirname(filename),
+                                    field[len("file="):])
+                    continue
+                (uoffset, coffset) = line.split()
+                self._uoffsets.append(int(uoffset))
+                self._coffsets.append(int(coffset))
+
+    @staticmethod
+    def get_index_file(filename):
+        """Return filename of the index."""
+        return filename + ".idx"
+
+    @staticmethod
+    def get_members_file(filename):
+        """Return filename of the copy as independent gzip members."""
+        return filename + ".members.gz"
+
+    @staticmethod
+    def exists(filename):
+        """Check if an up to date index and its data file exist."""
+        index = GzipIndex.get_index_file(filename)
+        if not (os.path.isfile(index) and
+                os.path.getmtime(index) >= os.path.getmtime(filename)):
+            return False
+        return os.path.isfile(GzipIndex(filename).get_data_file())
+
+    @staticmethod
+    def scan(filename):
+        """
+        Return a list of (uncompressed offset, compressed offset, line
+        aligned) tuples for every gzip member and the total sizes.
+
+        """
+        members = [(0, 0, True)]
+        usize = 0
+        csize = 0
+        last = "\n"
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        fed = 0
+        with open(filename, "rb") as finput:
+            data = finput.read(GzipIndex.CHUNK)
+            while data:
+                fed += len(data)
+                output = decompressor.decompress(data)
+                if output:
+                    usize += len(output)
+                    last = output[-1]
+                data = decompressor.unused_data
+                if data:
+                    # member finished, the rest belongs to the next member
+                    csize += fed - len(data)
+                    fed = 0
+                    if data.lstrip("\x00"):
+                        members.append((usize, csize, last == "\n"))
+                    else:
+                        data = ""
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                else:
+                    data = finput.read(GzipIndex.CHUNK)
+            output = decompressor.flush()
+            if output:
+                usize += len(output)
+                last = output[-1]
+        csize += fed
+        return members, usize, csize
+
+    @staticmethod
+    def rewrite(filename, target, span):
+        """
+        Write the content of a gzip file to another file as independent
+        members of span bytes.
+
+        """
+        tmpfile = target + ".tmp"
+        finput = gzip.open(filename, "rb")
+        try:
+            with open(tmpfile, "wb") as output:
+                data = finput.read(span)
+                while data:
+                    if not data.endswith("\n"):
+                        data += finput.readline()
+                    compressor = zlib.compressobj(6, zlib.DEFLATED,
+                            16 + zlib.MAX_WBITS)
+                    output.write(compressor.compress(data))
+                    output.write(compressor.flush())
+                    data = finput.read(span)
+            os.rename(tmpfile, target)
+        except:
+            if os.path.isfile(tmpfile):
+                os.remove(tmpfile)
+            raise
+        finally:
+            finput.close()
+
+    @staticmethod
+    def build(filename, span=None, log=None):
+        """
+        Build the index of a gzip file. If the members of the file are not
+        line aligned or larger than twice the span, a copy with the same
+        content as independent members of span bytes is written next to
+        the file and indexed instead, the file itself is never modified.
+        Raises IOError or OSError, if the index or the copy can not be
+        written.
+
+        filename    : gzip compressed file
+        span        : uncompressed bytes between checkpoints
+        log         : logger instance
+
+        """
+        if span is None:
+            span = GzipIndex.DEFAULT_SPAN
+        datafile = filename
+        (members, usize, csize) = GzipIndex.scan(filename)
+        ends = [member[0] for member in members[1:]] + [usize]
+        if [member for member, end in zip(members, ends)
+                if not member[2] or end - member[0] > 2 * span]:
+            datafile = GzipIndex.get_members_file(filename)
+            if log is not None:
+                log.info("Write %s as gzip members of %d bytes to %s",
+                        filename, span, datafile)
+            GzipIndex.rewrite(filename, datafile, span)
+            (members, usize, csize) = GzipIndex.scan(datafile)
+
+        with open(GzipIndex.get_index_file(filename), "w") as output:
+            output.write("%s span=%d file=%s\n" % (GzipIndex.HEADER, span,
+                os.path.basename(datafile)))
+            last = -span
+            for (uoffset, coffset, aligned) in members:
+                if uoffset - last >= span:
+                    output.write("%d %d\n" % (uoffset, coffset))
+                    last = uoffset
+            output.write("%d %d\n" % (usize, csize))
+        if log is not None:
+            log.info("Index for %s created (%d members)", filename,
+                    len(members))
+        return GzipIndex(filename)
+
+    def get_data_file(self):
+        """Return the gzip file the offsets of the index refer to."""
+        return self._datafile
+
+    def size(self):
+        """Return the uncompressed size of the file."""
+        return self._uoffsets[-1]
+
+    def offsets(self):
+        """Return the uncompressed offsets of all checkpoints."""
+        return self._uoffsets[:-1]
+
+    def checkpoint(self, offset):
+        """Return the last checkpoint at or before an uncompressed offset."""
+        pos = max(bisect.bisect_right(self._uoffsets, offset) - 1, 0)
+        return self._uoffsets[pos], self._coffsets[pos]
+
+    def open(self, offset):
+        """
+        Open the file at the last checkpoint before an uncompressed offset.
+        Return the file and the uncompressed offset of the checkpoint.
+
+        """
+        (uoffset, coffset) = self.checkpoint(offset)
+        raw = open(self._datafile, "rb")
+        raw.seek(coffset)
+        finput = gzip.GzipFile(fileobj=raw, mode="rb")
+        # let the gzip file close the underlying file
+        finput.myfileobj = raw
+        return finput, uoffset
+
+    def split(self, parts):
+        """Split the file in byte ranges starting at checkpoints."""
+        size = self.size()
+        offsets = [0]
+        for part in xrange(1, parts):
+            offset = self.checkpoint(size * part // parts)[0]
+            if offset > offsets[-1]:
+                offsets.append(offset)
+        return zip(offsets, offsets[1:] + [None])
+
+
+class TimestampIndex(object):
+    """
+    Sparse index of the timestamps in a trace. The trace is divided into
+    blocks and the smallest and largest timestamp of every block is saved,
+    so the blocks containing a time interval can be found without reading
+    the trace.
+
+    """
+
+    DEFAULT_SPAN = 4 * 1024 * 1024
+    HEADER = "# timestamp index"
+
+    def __init__(self, filename):
+        """
+        Load the timestamp index of a trace.
+
+        filename    : trace file
+
+        """
+        self._filename = filename
+        self._offsets = []
+        self._blocks = []
+        with open(TimestampIndex.get_index_file(filename), "r") as finput:
+            for line in finput:
+                if line.startswith("#"):
+                    continue
+                values = line.split()
+                self._offsets.append(int(values[0]))
+                if len(values) == 3:
+                    self._blocks.append((float(values[1]),
+                        float(values[2])))
+                elif len(values) == 2:
+                    self._blocks.append(None)
+
+    @staticmethod
+    def get_index_file(filename):
+        """Return filename of the index."""
+        return filename + ".tsidx"
+
+    @staticmethod
+    def exists(filename):
+        """Check if an up to date index exists for a trace."""
+        index = TimestampIndex.get_index_file(filename)
+        return (os.path.isfile(index) and
+                os.path.getmtime(index) >= os.path.getmtime(filename))
+
+    @staticmethod
+    def build(filename, openfunc=open, span=None, gzindex=None, log=None):
+        """
+        Build the timestamp index of a trace. Blocks of compressed traces
+        start at the checkpoints of their gzip index.
+
+        filename    : trace file
+        openfunc    : function to open file
+        span        : bytes per block of uncompressed traces
+        gzindex     : GzipIndex of a compressed trace
+        log         : logger instance
+
+        """
+        if span is None:
+            span = TimestampIndex.DEFAULT_SPAN
+        if gzindex is not None:
+            boundaries = gzindex.offsets()[1:]
+        else:
+            boundaries = []
+        boundaries.reverse()
+
+        with open(TimestampIndex.get_index_file(filename), "w") as output:
+            output.write("%s\n" % TimestampIndex.HEADER)
+            finput = openfunc(filename, "r")
+            try:
+                offset = 0
+                block = 0
+                (mintime, maxtime) = (None, None)
+                for line in finput:
+                    if boundaries:
+                        split = offset >= boundaries[-1]
+                        if split:
+                            boundaries.pop()
+                    else:
+                        split = gzindex is None and offset - block >= span
+                    if split:
+                        TimestampIndex.write_block(output, block, mintime,
+                                maxtime)
+                        block = offset
+                        (mintime, maxtime) = (None, None)
+                    offset += len(line)
+                    try:
+                        timestamp = float(line.split(" ", 2)[1])
+                    except (IndexError, ValueError):
+                        continue
+                    if mintime is None or timestamp < mintime:
+                        mintime = timestamp
+                    if maxtime is None or timestamp > maxtime:
+                        maxtime = timestamp
+                TimestampIndex.write_block(output, block, mintime, maxtime)
+                output.write("%d\n" % offset)
+            finally:
+                finput.close()
+        if log is not None:
+            log.info("Timestamp index for %s created", filename)
+        return TimestampIndex(filename)
+
+    @staticmethod
+    def write_block(output, offset, mintime, maxtime):
+        """Write a block entry to the index."""
+        if mintime is None:
+            output.write("%d -\n" % offset)
+        else:
+            output.write("%d %r %r\n" % (offset, mintime, maxtime))
+
+    def lookup(self, interval):
+        """
+        Return the byte range (start, end) containing all lines with
+        timestamps in the interval [start, end + 1).
+
+        """
+        blocks = [pos for pos, block in enumerate(self._blocks)
+                if block is not None and block[1] >= interval[0] and
+                block[0] < interval[1] + 1]
+        if not blocks:
+            return 0, 0
+        return self._offsets[blocks[0]], self._offsets[blocks[-1] + 1]
@@ -0,0 +1,370 @@
+'''
+File: metrics.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Throughput and queue metrics of the pipeline processes.
+'''
+
+import os
+import time
+import json
+import ctypes
+import threading
+import multiprocessing
+import BaseHTTPServer
+
+
+def current_metrics():
+    """Return the MetricsSlot of the current process or None."""
+    return getattr(multiprocessing.current_process(), "_metrics", None)
+
+
+class MetricsBoard(object):
+    """
+    Counters of all processes in shared memory. Every process gets a slot
+    of counters when it is created, the counters of a slot are only
+    written by the process itself, except the number of queued items,
+    which is written by the producer of its pipe.
+
+    """
+
+    DEFAULT_SLOTS = 256
+    NAME_SIZE = 64
+
+    # counters of a slot
+    FIELDS = ["lines", "bytes", "queued", "recv_wait", "send_wait", "cpu",
+            "state", "started"]
+    LINES = 0
+    BYTES = 1
+    QUEUED = 2
+    RECV_WAIT = 3
+    SEND_WAIT = 4
+    CPU = 5
+    STATE = 6
+    STARTED = 7
+
+    # states of a process
+    STATES = ["created", "running", "finished"]
+    CREATED = 0
+    RUNNING = 1
+    FINISHED = 2
+
+    def __init__(self, slots=None):
+        """
+        Create a new board. Has to be created before the processes are
+        started.
+
+        slots       : maximal number of processes
+
+        """
+        if slots is None:
+            slots = MetricsBoard.DEFAULT_SLOTS
+        self._slots = slots
+        self._values = multiprocessing.Array(ctypes.c_double,
+                slots * len(MetricsBoard.FIELDS), lock=False)
+        self._names = multiprocessing.Array(ctypes.c_char,
+                slots * MetricsBoard.NAME_SIZE, lock=False)
+        self._count = multiprocessing.Value(ctypes.c_int, 0)
+
+    def register(self):
+        """Return a new slot or None, if all slots are used."""
+        with self._count.get_lock():
+            slot = self._count.value
+            if slot == self._slots:
+                return None
+            self._count.value += 1
+        return MetricsSlot(self, slot)
+
+    def set_name(self, slot, name):
+        """Set the name of the process of a slot."""
+        start = slot * MetricsBoard.NAME_SIZE
+        name = name[:MetricsBoard.NAME_SIZE - 1]
+        self._names[start:start + len(name) + 1] = name + "\x00"
+
+    def get_name(self, slot):
+        """Return the name of the process of a slot."""
+        start = slot * MetricsBoard.NAME_SIZE
+        return self._names[start:start +
+                MetricsBoard.NAME_SIZE].split("\x00", 1)[0]
+
+    def snapshot(self):
+        """Return the counters of all named processes by name."""
+        fields = len(MetricsBoard.FIELDS)
+        processes = dict()
+        for slot in xrange(self._count.value):
+            name = self.get_name(slot)
+            if not name:
+                continue
+            values = self._values[slot * fields:(slot + 1) * fields]
+            counters = dict(zip(MetricsBoard.FIELDS, values))
+            counters["state"] = MetricsBoard.STATES[int(counters["state"])]
+            counters["pending"] = max(counters["queued"] -
+                    counters["lines"], 0)
+            processes[name] = counters
+        return processes
+
+
+class MetricsSlot(object):
+    """Counters of a single process in a MetricsBoard."""
+
+    # seconds between two updates of the cpu time by received data
+    CPU_INTERVAL = 1.0
+
+    def __init__(self, board, slot):
+        """
+        Create a new slot.
+
+        board       : MetricsBoard of the slot
+        slot        : number of the slot
+
+        """
+        self._board = board
+        self._slot = slot
+        self._values = board._values
+        self._base = slot * len(MetricsBoard.FIELDS)
+        self._cpu_update = 0.0
+
+    def start(self, name):
+        """Mark the process as running."""
+        self._board.set_name(self._slot, name)
+        self._values[self._base + MetricsBoard.STATE] = MetricsBoard.RUNNING
+        self._values[self._base + MetricsBoard.STARTED] = time.time()
+
+    def finish(self):
+        """Mark the process as finished."""
+        self.update_cpu()
+        self._values[self._base + MetricsBoard.STATE] = MetricsBoard.FINISHED
+
+    def update_cpu(self):
+        """Save the cpu time of the process."""
+        times = os.times()
+        self._values[self._base + MetricsBoard.CPU] = times[0] + times[1]
+        self._cpu_update = time.time() + MetricsSlot.CPU_INTERVAL
+
+    def set_progress(self, lines, size):
+        """Set the number of lines and bytes processed."""
+        self._values[self._base + MetricsBoard.LINES] = lines
+        self._values[self._base + MetricsBoard.BYTES] = size
+
+    def received(self, data, wait):
+        """Count received data and the time waited for it."""
+        values = self._values
+        base = self._base
+        values[base + MetricsBoard.RECV_WAIT] += wait
+        if type(data) is str:
+            values[base + MetricsBoard.LINES] += 1
+            values[base + MetricsBoard.BYTES] += len(data)
+        elif type(data) is list:
+            values[base + MetricsBoard.LINES] += len(data)
+            values[base + MetricsBoard.BYTES] += sum([len(item)
+                for item in data])
+        # os.times is a system call, too expensive for every item
+        if time.time() >= self._cpu_update:
+            self.update_cpu()
+
+    def sent(self, wait):
+        """Count the time waited to send data."""
+        self._values[self._base + MetricsBoard.SEND_WAIT] += wait
+
+    def queue(self, items):
+        """Count items sent to the pipe of the process."""
+        self._values[self._base + MetricsBoard.QUEUED] += items
+
+
+class MeteredPipe(object):
+    """Receiving end of a pipe, which counts the received data."""
+
+    def __init__(self, pipe, metrics):
+        """
+        Create a new pipe.
+
+        pipe        : receiving end of a pipe or channel
+        metrics     : MetricsSlot of the receiving process
+
+        """
+        self._pipe = pipe
+        self._metrics = metrics
+        self._wait = 0.0
+
+    def poll(self, timeout=0):
+        """Return whether data is available, wait at most timeout seconds."""
+        start = time.time()
+        try:
+            return self._pipe.poll(timeout)
+        finally:
+            self._wait += time.time() - start
+
+    def recv(self):
+        """Receive data and count it."""
+        start = time.time()
+        data = self._pipe.recv()
+        self._metrics.received(data, self._wait + time.time() - start)
+        self._wait = 0.0
+        return data
+
+    def close(self):
+        """Close the pipe."""
+        self._pipe.close()
+
+
+class MetricsMonitor(threading.Thread):
+    """
+    Thread of the main process, which logs the throughput of all running
+    processes periodically, serves the counters to Prometheus and saves
+    them as time series in a JSON file.
+
+    """
+
+    def __init__(self, board, interval, log, port=None, filename=None):
+        """
+        Create a new monitor.
+
+        board       : MetricsBoard of the processes
+        interval    : seconds between two samples
+        log         : logger instance
+        port        : local port of the HTTP endpoint (None = no endpoint)
+        filename    : JSON file to save all samples at the end (None = no
+                      file)
+
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._board = board
+        self._interval = interval
+        self._log = log
+        self._port = port
+        self._filename = filename
+        self._finished = threading.Event()
+        self._samples = []
+        self._last = None
+        self._server = None
+
+    @staticmethod
+    def format_rate(value):
+        """Return a short string of a rate."""
+        for (limit, unit) in [(1e9, "G"), (1e6, "M"), (1e3, "k")]:
+            if value >= limit:
+                return "%.1f%s" % (value / limit, unit)
+        return "%.0f" % value
+
+    def sample(self):
+        """Take a sample of the counters and compute the rates."""
+        now = time.time()
+        processes = self._board.snapshot()
+        for (name, counters) in processes.iteritems():
+            previous = None
+            if self._last is not None:
+                previous = self._last["processes"].get(name)
+            if previous is None:
+                elapsed = max(now - counters["started"], 1e-6)
+                previous = dict(lines=0, bytes=0, recv_wait=0, send_wait=0,
+                        cpu=0)
+            else:
+                elapsed = max(now - self._last["time"], 1e-6)
+            for field in ["lines", "bytes"]:
+                counters[field + "_per_sec"] = (counters[field] -
+                        previous[field]) / elapsed
+            for field in ["recv_wait", "send_wait", "cpu"]:
+                counters[field + "_share"] = min((counters[field] -
+                    previous[field]) / elapsed, 1.0)
+        self._last = dict(time=now, processes=processes)
+        if self._filename is not None:
+            self._samples.append(self._last)
+        return self._last
+
+    def progress(self, sample):
+        """Log a progress line of all running processes."""
+        parts = []
+        for (name, counters) in sorted(sample["processes"].items()):
+            if counters["state"] != "running":
+                continue
+            part = "%s %s/s %sB/s cpu %d%%" % (name,
+                    MetricsMonitor.format_rate(counters["lines_per_sec"]),
+                    MetricsMonitor.format_rate(counters["bytes_per_sec"]),
+                    100 * counters["cpu_share"])
+            if counters["pending"]:
+                part += " pending %s" % MetricsMonitor.format_rate(
+                        counters["pending"])
+            if counters["recv_wait_share"] >= 0.01:
+                part += " recv %d%%" % (100 * counters["recv_wait_share"])
+            if counters["send_wait_share"] >= 0.01:
+                part += " send %d%%" % (100 * counters["send_wait_share"])
+            parts.append(part)
+        if parts:
+            self._log.info("Progress: %s", " | ".join(parts))
+
+    def prometheus(self):
+        """Return the latest sample in the Prometheus text format."""
+        if self._last is None:
+            return ""
+        lines = []
+        metrics = [("lines", "counter", "lines_total"),
+                ("bytes", "counter", "bytes_total"),
+                ("pending", "gauge", "pending_lines"),
+                ("recv_wait", "counter", "recv_wait_seconds_total"),
+                ("send_wait", "counter", "send_wait_seconds_total"),
+                ("cpu", "counter", "cpu_seconds_total"),
+                ("lines_per_sec", "gauge", "lines_per_second"),
+                ("bytes_per_sec", "gauge", "bytes_per_second")]
+        for (field, kind, metric) in metrics:
+            lines.append("# TYPE ppr_%s %s" % (metric, kind))
+            for (name, counters) in sorted(self._last["processes"].items()):
+                lines.append('ppr_%s{process="%s",state="%s"} %r' % (metric,
+                    name, counters["state"], float(counters[field])))
+        return "\n".join(lines) + "\n"
+
+    def serve(self):
+        """Start the HTTP endpoint in a thread."""
+        monitor = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            """Handler of requests to the metrics endpoint."""
+
+            def do_GET(self):
+                """Send the latest sample."""
+                if self.path.split("?")[0] not in ["/", "/metrics"]:
+                    self.send_error(404)
+                    return
+                body = monitor.prometheus()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                """Do not log requests."""
+                pass
+
+        self._server = BaseHTTPServer.HTTPServer(("127.0.0.1", self._port),
+                Handler)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self._log.info("Metrics endpoint at http://127.0.0.1:%d/metrics",
+                self._port)
+
+    def run(self):
+        """Thread run method."""
+        while not self._finished.is_set():
+            self._finished.wait(self._interval)
+            self.progress(self.sample())
+
+    def start(self):
+        """Start the thread and the HTTP endpoint."""
+        if self._port:
+            self.serve()
+        threading.Thread.start(self)
+
+    def stop(self):
+        """Stop the thread and save all samples."""
+        self._finished.set()
+        self.join()
+        if self._server is not None:
+            self._server.shutdown()
+        if self._filename is not None:
+            with open(self._filename, "w") as output:
+                json.dump(dict(interval=self._interval,
+                    samples=self._samples), output, indent=1,
+                    sort_keys=True)
+            self._log.info("Metrics saved to %s", self._filename)
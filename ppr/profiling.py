@@ -0,0 +1,96 @@
+'''
+File: profiling.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: CPU and memory profiles of single processes.
+'''
+
+import os
+import sys
+import gc
+import cProfile
+import resource
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+class StageProfiler(object):
+    """
+    Run a function with cProfile and save the profile (name.prof) and the
+    largest memory allocations (name.mem). The allocations are traced with
+    tracemalloc, if it is available, otherwise the objects tracked by the
+    garbage collector are counted by type at the end.
+
+    """
+
+    DEFAULT_TOP = 30
+
+    def __init__(self, directory, name, top=None):
+        """
+        Create a new profiler.
+
+        directory   : directory to save the profiles
+        name        : name of the profiled process
+        top         : number of reported allocations
+
+        """
+        if top is None:
+            top = StageProfiler.DEFAULT_TOP
+        self._path = os.path.join(directory, name)
+        self._top = top
+
+    @staticmethod
+    def is_profiled(cls, names):
+        """Check if a class or one of its base classes is in names."""
+        return any([base.__name__ in names for base in cls.__mro__])
+
+    def runcall(self, func, *args):
+        """Run a function, save the profiles and return its result."""
+        directory = os.path.dirname(self._path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        if tracemalloc is not None:
+            tracemalloc.start()
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, *args)
+        finally:
+            profiler.dump_stats(self._path + ".prof")
+            with open(self._path + ".mem", "w") as output:
+                self.write_memory(output)
+            if tracemalloc is not None:
+                tracemalloc.stop()
+
+    def write_memory(self, output):
+        """Write the peak memory and the largest allocations to output."""
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        output.write("%30s: %d KB\n" % ("max resident size",
+            usage.ru_maxrss))
+        if tracemalloc is not None:
+            (current, peak) = tracemalloc.get_traced_memory()
+            output.write("%30s: %d KB\n" % ("traced memory", current // 1024))
+            output.write("%30s: %d KB\n" % ("traced peak", peak // 1024))
+            output.write("\n[TOP ALLOCATIONS]\n")
+            statistics = tracemalloc.take_snapshot().statistics("lineno")
+            for stat in statistics[:self._top]:
+                output.write("%s\n" % stat)
+            return
+
+        # count the objects tracked by the garbage collector
+        sizes = dict()
+        for obj in gc.get_objects():
+            name = type(obj).__name__
+            (count, size) = sizes.get(name, (0, 0))
+            sizes[name] = (count + 1, size + sys.getsizeof(obj, 0))
+        output.write("\n[TOP OBJECTS]\n")
+        output.write("%30s  %10s %12s\n" % ("type", "objects", "bytes"))
+        for (name, (count, size)) in sorted(sizes.items(),
+                key=lambda item: -item[1][1])[:self._top]:
+            output.write("%30s: %10d %12d\n" % (name, count, size))
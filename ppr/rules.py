@@ -0,0 +1,179 @@
+'''
+File: rules.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Compiled rules to filter and rewrite urls.
+'''
+
+import re
+
+
+def split_alternatives(regex):
+    """Split a regex at its top level alternations."""
+    parts = []
+    depth = 0
+    charset = False
+    escape = False
+    start = 0
+    for pos, char in enumerate(regex):
+        if escape:
+            escape = False
+        elif char == "\\":
+            escape = True
+        elif charset:
+            if char == "]":
+                charset = False
+        elif char == "[":
+            charset = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            parts.append(regex[start:pos])
+            start = pos + 1
+    parts.append(regex[start:])
+    return parts
+
+
+def literal_prefix(regex):
+    """Return the literal text every match of a regex has to start with."""
+    if regex.startswith("^"):
+        regex = regex[1:]
+    prefix = []
+    pos = 0
+    while pos < len(regex):
+        char = regex[pos]
+        if char == "\\":
+            if pos + 1 < len(regex) and not regex[pos + 1].isalnum():
+                prefix.append(regex[pos + 1])
+                pos += 2
+                continue
+            break
+        if char in UrlRules.METACHARS:
+            # a quantified character is optional
+            if char in "*?{" and prefix:
+                prefix.pop()
+            break
+        prefix.append(char)
+        pos += 1
+    return "".join(prefix)
+
+
+class UrlRules(object):
+    """
+    Filter and rewrite urls with a dispatch table. The table maps the
+    first characters of an url to a compiled regex containing only the
+    rules which can match urls with these characters. Rules without a
+    literal prefix are part of every regex.
+
+    """
+
+    METACHARS = ".^$*+?{}[]|()"
+    PATTERN_BACKREFERENCE = re.compile(r'\\[0-9]|\(\?P=|\(\?\(')
+
+    def __init__(self, regex, rewrite):
+        """
+        Create new rules.
+
+        regex       : regex to match accepted urls
+        rewrite     : list of (regex, replacement) tuples, applied to an url
+                      in order like re.sub
+
+        """
+        self._rules = [(re.compile(pattern), replacement)
+                for pattern, replacement in rewrite]
+
+        # accept rules
+        alternatives = split_alternatives(regex)
+        if UrlRules.PATTERN_BACKREFERENCE.search(regex):
+            alternatives = [regex]
+        accept = [(literal_prefix(alt), alt) for alt in alternatives]
+
+        # rewrite rules, must be anchored and replaced by a literal string
+        self._sequential = False
+        for (pattern, replacement) in rewrite:
+            if (not pattern.startswith("^") or "\\" in replacement or
+                    len(split_alternatives(pattern)) > 1 or
+                    UrlRules.PATTERN_BACKREFERENCE.search(pattern)):
+                self._sequential = True
+        prefixes = [prefix for prefix, alt in accept if prefix]
+        if not self._sequential:
+            self._prefixes = [literal_prefix(pattern)
+                    for pattern, replacement in rewrite]
+            prefixes.extend([prefix for prefix in self._prefixes if prefix])
+        if prefixes:
+            self._keylen = min([len(prefix) for prefix in prefixes])
+        else:
+            self._keylen = 0
+
+        # dispatch table for accept rules
+        self._accept = dict()
+        keys = set([prefix[:self._keylen] for prefix in prefixes])
+        for key in keys:
+            self._accept[key] = UrlRules.compile_accept(key, accept)
+        self._accept_default = UrlRules.compile_accept(None, accept)
+
+        # dispatch table for rewrite rules, filled on demand
+        self._keys = keys
+        self._rewrite = dict()
+
+    @staticmethod
+    def compile_accept(key, accept):
+        """Return regex of accept rules for a key (None = no prefix)."""
+        alternatives = [alt for prefix, alt in accept if not prefix or (
+            key is not None and prefix.startswith(key))]
+        if alternatives:
+            return re.compile("|".join(["(?:%s)" % alt
+                for alt in alternatives]))
+        return None
+
+    def compile_rewrite(self, key, start):
+        """
+        Return regex of the rewrite rules starting at index start for a key
+        (None = no prefix) and the replacements by group name.
+
+        """
+        alternatives = []
+        replacements = dict()
+        for index in xrange(start, len(self._rules)):
+            prefix = self._prefixes[index]
+            if not prefix or (key is not None and prefix.startswith(key)):
+                name = "_rule%d" % index
+                pattern = self._rules[index][0].pattern[1:]
+                alternatives.append("(?P<%s>%s)" % (name, pattern))
+                replacements[name] = (index, self._rules[index][1])
+        if alternatives:
+            return re.compile("|".join(alternatives)), replacements
+        return None, replacements
+
+    def accept(self, url):
+        """Check if an url is accepted."""
+        regex = self._accept.get(url[:self._keylen], self._accept_default)
+        return regex is not None and regex.match(url) is not None
+
+    def rewrite(self, url):
+        """Rewrite an url."""
+        if self._sequential:
+            for (regex, replacement) in self._rules:
+                url = regex.sub(replacement, url)
+            return url
+
+        start = 0
+        while start < len(self._rules):
+            key = url[:self._keylen]
+            if key not in self._keys:
+                key = None
+            entry = (key, start)
+            if entry not in self._rewrite:
+                self._rewrite[entry] = self.compile_rewrite(key, start)
+            (regex, replacements) = self._rewrite[entry]
+            if regex is None:
+                break
+            match = regex.match(url)
+            if match is None:
+                break
+            (index, replacement) = replacements[match.lastgroup]
+            url = replacement + url[match.end():]
+            start = index + 1
+        return url
@@ -5,21 +5,33 @@ E-Mail: sebastian.menski@googlemail.com'
 Description: Basic classes for trace handling.
 '''
 
-from basic import PipeReader, FileWriter
-from http import FileCrawler
+from basic import FileReader, PipeReader, FileWriter
+from http import FileCrawler, HTTPStats
+from rules import UrlRules
+from counter import CounterBudget, DistinctCounter, TopCounter, hash_key
+from cache import StackDistance
 import sys
+import math
+import bisect
 import subprocess
+import cPickle
 import re
 import time
 import os.path
-from operator import itemgetter
 import urlparse
 import urllib
 import shutil
+import multiprocessing
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 def gnuplot(title, data, filename, ylabel=None, xlabel=None, using=None,
-        styles=["points"]):
+        styles=["points"], logscale=None):
     """Use gnuplot to plot given data. Optional save plot in a file."""
     with open("%s.log" % filename, "w") as output:
         # create process
@@ -40,6 +52,10 @@ def gnuplot(title, data, filename, ylabel=None, xlabel=None, using=None,
         if ylabel is not None:
             stdin.write('set ylabel "%s"\n' % ylabel)
 
+        # set logscale
+        if logscale is not None:
+            stdin.write('set logscale %s\n' % logscale)
+
         # set xtics
         #stdin.write('set xtics 5\n')
 
@@ -72,11 +88,15 @@ def gnuplot(title, data, filename, ylabel=None, xlabel=None, using=None,
 class TraceAnalyser(PipeReader):
     """Analyse a trace and output some statitics."""
 
-    def __init__(self, filename, plot=True, timeout=None):
-        PipeReader.__init__(self, timeout)
+    def __init__(self, filename, plot=True, timeout=None, channel=None,
+            columns=None):
+        PipeReader.__init__(self, timeout, channel=channel)
         self._filename = filename
         self._plot = plot
         self._gnuplot = gnuplot
+        self._columns = columns
+        if columns is not None:
+            self._records = (0, len(columns))
         self.init()
         self._log.debug("TraceAnalyser for %s created", filename)
 
@@ -88,6 +108,11 @@ class TraceAnalyser(PipeReader):
         """Analyse a trace line."""
         pass
 
+    def consume_columns(self, columns, start, end):
+        """Analyse the lines of a column trace in the range [start, end)."""
+        for pos in xrange(start, end):
+            self.consume(columns.get_line(pos))
+
     def stats(self):
         """Write statistics."""
         pass
@@ -96,20 +121,126 @@ class TraceAnalyser(PipeReader):
         """Plot statistics."""
         pass
 
+    def get_checkpoint_name(self):
+        """Return the unique name of the analyser in a CheckpointStore."""
+        return "%s:%s" % (self.__class__.__name__,
+                os.path.basename(self._filename))
+
     def run(self):
         """Run analyse process."""
         self._log.info("TraceAnalyser for %s started", self._filename)
-        PipeReader.run(self)
+        if self._columns is None:
+            self.restore()
+            PipeReader.run(self)
+        else:
+            self.consume_columns(self._columns, *self._records)
         self.stats()
         if self._plot:
             self.plot()
         self._log.info("TraceAnalyser for %s finished", self._filename)
 
 
+class WikiStats(object):
+    """Mergeable statistics of a wiki trace."""
+
+    def __init__(self):
+        """Create empty statistics."""
+        self.lines = 0
+        self.requests = 0
+        self.errors = []
+        self.starttime = time.time()
+        self.endtime = 0
+        self.hosts = dict()
+        self.uploads = dict()
+        self.budget = CounterBudget(DistinctCounter.DEFAULT_MEMORY)
+        self.images_files = DistinctCounter(self.budget)
+        self.images_host = dict()
+        self.images_upload_files = dict()
+        self.thumbs_files = DistinctCounter(self.budget)
+        self.thumbs_host = dict()
+        self.thumbs_upload_files = dict()
+        self.pages_files = DistinctCounter(self.budget)
+        self.top_pages = TopCounter()
+        self.top_images = TopCounter()
+        self.top_thumbs = TopCounter()
+        self.methods = dict()
+        self.rps = dict()
+
+    @staticmethod
+    def merge_dict(dictonary, other):
+        """Add the values of another dictonary."""
+        for key, value in other.iteritems():
+            if key in dictonary:
+                dictonary[key] += value
+            else:
+                dictonary[key] = value
+
+    def merge_files(self, counters, other):
+        """Add the distinct files of another dictonary of counters."""
+        for key, counter in other.iteritems():
+            if key not in counters:
+                counters[key] = DistinctCounter(self.budget)
+            counters[key].merge(counter)
+
+    def add_file(self, thumb, upload, url):
+        """Count an image or thumb file of an upload."""
+        if thumb:
+            (files, uploads) = (self.thumbs_files, self.thumbs_upload_files)
+        else:
+            (files, uploads) = (self.images_files, self.images_upload_files)
+        value = hash_key(url)
+        files.add_hash(value)
+        if upload not in uploads:
+            uploads[upload] = DistinctCounter(self.budget)
+        uploads[upload].add_hash(value)
+
+    def merge(self, other):
+        """Merge statistics of the following part of the trace."""
+        self.lines += other.lines
+        self.requests += other.requests
+        self.errors.extend(other.errors)
+        self.starttime = min(self.starttime, other.starttime)
+        self.endtime = max(self.endtime, other.endtime)
+        WikiStats.merge_dict(self.hosts, other.hosts)
+        WikiStats.merge_dict(self.uploads, other.uploads)
+        self.images_files.merge(other.images_files)
+        WikiStats.merge_dict(self.images_host, other.images_host)
+        self.merge_files(self.images_upload_files, other.images_upload_files)
+        self.thumbs_files.merge(other.thumbs_files)
+        WikiStats.merge_dict(self.thumbs_host, other.thumbs_host)
+        self.merge_files(self.thumbs_upload_files, other.thumbs_upload_files)
+        self.pages_files.merge(other.pages_files)
+        self.top_pages.merge(other.top_pages)
+        self.top_images.merge(other.top_images)
+        self.top_thumbs.merge(other.top_thumbs)
+        WikiStats.merge_dict(self.methods, other.methods)
+        WikiStats.merge_dict(self.rps, other.rps)
+
+
 class WikiAnalyser(TraceAnalyser):
     """Analyse a wiki trace from wikibench.eu"""
 
-    def __init__(self, filename, openfunc=open, plot=True, timeout=None):
+    UPLOAD_HOST = "upload.wikimedia.org"
+
+    # kinds of urls in column traces
+    KIND_PAGE = 0
+    KIND_IMAGE = 1
+    KIND_THUMB = 2
+
+    # backend to analyse column traces (python or numpy)
+    DEFAULT_BACKEND = "python"
+
+    # lines per array operation of the numpy backend
+    NUMPY_CHUNK = 64 * 1024
+
+    # number of reported most frequent urls
+    DEFAULT_TOP = 20
+
+    # fractions of the most frequent urls for the traffic share curve
+    SHARES = [0.001, 0.01, 0.1, 0.2, 0.5]
+
+    def __init__(self, filename, openfunc=open, plot=True, timeout=None,
+            channel=None, columns=None):
         """
         Create a new analyser.
 
@@ -117,26 +248,25 @@ class WikiAnalyser(TraceAnalyser):
         openfunc    : function to open file
         plot        : plot requests per seconds
         timeout     : pipe poll timeout
+        channel     : shared channel to read lines instead of a pipe
+        columns     : ColumnTrace of the file to read instead of a pipe
 
         """
-        TraceAnalyser.__init__(self, filename, plot, timeout)
+        TraceAnalyser.__init__(self, filename, plot, timeout, channel,
+                columns)
         self._openfunc = openfunc
 
     def init(self):
         """Initialize the analyser."""
-        self._lines = 0
-        self._requests = 0
-        self._errors = []
-        self._starttime = time.time()
-        self._endtime = 0
-        self._hosts = dict()
-        self._uploads = dict()
-        self._images_set = set()
-        self._images_host = dict()
-        self._thumbs_set = set()
-        self._thumbs_host = dict()
-        self._methods = dict()
-        self._rps = dict()
+        self._stats = WikiStats()
+
+    def get_state(self):
+        """Return the statistics to save at a checkpoint."""
+        return self._stats
+
+    def set_state(self, state):
+        """Set the statistics saved at a checkpoint."""
+        self._stats = state
 
     def inc_dict(self, dictonary, key):
         """Create or increment a value in an dictonary"""
@@ -150,8 +280,8 @@ class WikiAnalyser(TraceAnalyser):
         sformat = "%30s: %8d\n"
         total = 0
         count = 0
-        for key, value in sorted(dictonary.items(), key=itemgetter(1),
-            reverse=True):
+        for key, value in sorted(dictonary.items(),
+            key=lambda item: (-item[1], item[0])):
             total += value
             count += 1
             output.write(sformat % (key, value))
@@ -159,9 +289,44 @@ class WikiAnalyser(TraceAnalyser):
         output.write(sformat % ("total", total))
         output.write(sformat % ("count", count))
 
+    def print_files(self, counter, output):
+        """Print the number of distinct files to output."""
+        if counter.is_exact():
+            output.write("%30s: %8d\n" % ("files", counter.count()))
+        else:
+            output.write("%30s: %8d\n" % ("files (estimated)",
+                counter.count()))
+
+    def print_top(self, top, files, output):
+        """
+        Print the most frequent urls with their estimated number of requests
+        and the share of all requests of the most frequent urls. A share is
+        printed as range of its guaranteed bounds, unless it is exact, and
+        left out if it needs more urls than counted.
+
+        """
+        output.write("%8s %8s  %s\n" % ("requests", "error", "url"))
+        for (url, count, error) in top.top(WikiAnalyser.DEFAULT_TOP):
+            output.write("%8d %8d  %s\n" % (count, error, url))
+        output.write("%40s\n" % "----------")
+        for fraction in WikiAnalyser.SHARES:
+            number = int(math.ceil(fraction * files.count()))
+            bounds = top.share(number)
+            if bounds is None:
+                value = "unknown, top_capacity too small"
+            else:
+                (lower, upper) = ["%.2f%%" % (100 * share)
+                        for share in bounds]
+                value = lower
+                if lower != upper:
+                    value = "%s - %s" % (lower, upper)
+            output.write("%30s: %s (%d urls)\n" % ("top %g%%" %
+                (100 * fraction), value, number))
+
     def consume(self, line):
         """Analyse a trace line."""
-        self._lines += 1
+        stats = self._stats
+        stats.lines += 1
 
         # split line
         try:
@@ -176,92 +341,380 @@ class WikiAnalyser(TraceAnalyser):
         timestamp = float(timestamp)
 
         # test timestamp
-        if timestamp < self._starttime:
-            self._starttime = timestamp
-        if timestamp > self._endtime:
-            self._endtime = timestamp
+        if timestamp < stats.starttime:
+            stats.starttime = timestamp
+        if timestamp > stats.endtime:
+            stats.endtime = timestamp
 
         # check host
         if host:
-            self._requests += 1
-            self.inc_dict(self._hosts, host)
+            stats.requests += 1
+            self.inc_dict(stats.hosts, host)
 
             # test if it is an upload
-            if host == "upload.wikimedia.org":
-                upload = path.split("/", 2)[1]
-                if upload.lower() == "wikipedia":
-                    lang = ""
-                    try:
-                        lang = path.split("/", 3)[2]
-                    except:
-                        pass
-                    upload = "/".join([upload.lower(), lang.lower()])
-                self.inc_dict(self._uploads, upload)
+            if host == WikiAnalyser.UPLOAD_HOST:
+                upload = WikiAnalyser.get_upload(path)
+                self.inc_dict(stats.uploads, upload)
                 if "thumb" in path.split("/"):
-                    self.inc_dict(self._thumbs_host, upload)
+                    self.inc_dict(stats.thumbs_host, upload)
                     self._thumbs.send(url)
-                    self._thumbs_set.add(url)
+                    stats.add_file(True, upload, url)
+                    stats.top_thumbs.add(url)
                 else:
-                    self.inc_dict(self._images_host, upload)
+                    self.inc_dict(stats.images_host, upload)
                     self._images.send(url)
-                    self._images_set.add(url)
+                    stats.add_file(False, upload, url)
+                    stats.top_images.add(url)
             else:
                 self._pages.send(url)
+                stats.pages_files.add(url)
+                stats.top_pages.add(url)
 
             # increase method counter
-            self.inc_dict(self._methods, method)
+            self.inc_dict(stats.methods, method)
 
             # increase request per seconds counter
-            self.inc_dict(self._rps, str(int(timestamp)))
+            self.inc_dict(stats.rps, str(int(timestamp)))
 
         else:
-            self._errors.append(line)
+            stats.errors.append(line)
+
+    @staticmethod
+    def get_upload(path):
+        """Return the upload of a path on the upload host."""
+        upload = path.split("/", 2)[1]
+        if upload.lower() == "wikipedia":
+            lang = ""
+            try:
+                lang = path.split("/", 3)[2]
+            except:
+                pass
+            upload = "/".join([upload.lower(), lang.lower()])
+        return upload
+
+    def consume_columns(self, columns, start, end):
+        """
+        Analyse the lines of a column trace in the range [start, end). The
+        lines are counted by host, method and url codes, which are resolved
+        once at the end, urls are classified once per url.
+
+        """
+        if WikiAnalyser.DEFAULT_BACKEND == "numpy" and numpy is not None:
+            return self.consume_columns_numpy(columns, start, end)
+        stats = self._stats
+        timestamps = columns.timestamp
+        urls = columns.url
+        methods = columns.method
+        url_host = columns.url_host
+        hosts = [0] * len(columns.hosts)
+        method_counts = [0] * len(columns.methods)
+        rps = dict()
+
+        # url kinds and upload codes, computed on first use
+        kinds = array("b", [-1]) * columns.urls()
+        url_upload = array("i", [-1]) * columns.urls()
+        upload_codes = dict()
+        uploads = []
+        upload_host = -1
+        if WikiAnalyser.UPLOAD_HOST in columns.hosts:
+            upload_host = columns.hosts.index(WikiAnalyser.UPLOAD_HOST)
+        # most frequent urls by kind, counted in trace order like consume
+        tops = [stats.top_pages, stats.top_images, stats.top_thumbs]
+
+        starttime = stats.starttime
+        endtime = stats.endtime
+        requests = 0
+        for pos in xrange(start, end):
+            # the NaN of error rows never changes the times
+            timestamp = timestamps[pos]
+            if timestamp < starttime:
+                starttime = timestamp
+            if timestamp > endtime:
+                endtime = timestamp
+
+            url = urls[pos]
+            host = url_host[url]
+            if host < 0:
+                stats.errors.append(columns.get_line(pos))
+                continue
+            requests += 1
+            hosts[host] += 1
+
+            kind = kinds[url]
+            if kind < 0:
+                kind = WikiAnalyser.KIND_PAGE
+                if host == upload_host:
+                    path = urlparse.urlsplit(columns.get_url(url)).path
+                    upload = WikiAnalyser.get_upload(path)
+                    if upload not in upload_codes:
+                        upload_codes[upload] = len(uploads)
+                        uploads.append([0, 0, 0])
+                    url_upload[url] = upload_codes[upload]
+                    if "thumb" in path.split("/"):
+                        kind = WikiAnalyser.KIND_THUMB
+                    else:
+                        kind = WikiAnalyser.KIND_IMAGE
+                    stats.add_file(kind == WikiAnalyser.KIND_THUMB, upload,
+                            columns.get_url(url))
+                else:
+                    stats.pages_files.add(columns.get_url(url))
+                kinds[url] = kind
+
+            name = columns.get_url(url)
+            tops[kind].add(name)
+            if kind == WikiAnalyser.KIND_PAGE:
+                self._pages.send(name)
+            else:
+                counts = uploads[url_upload[url]]
+                counts[0] += 1
+                counts[kind] += 1
+                if kind == WikiAnalyser.KIND_THUMB:
+                    self._thumbs.send(name)
+                else:
+                    self._images.send(name)
+
+            method_counts[methods[pos]] += 1
+            second = int(timestamp)
+            if second in rps:
+                rps[second] += 1
+            else:
+                rps[second] = 1
+
+        # resolve codes
+        stats.lines += end - start
+        stats.requests += requests
+        stats.starttime = starttime
+        stats.endtime = endtime
+        WikiStats.merge_dict(stats.hosts, dict([(name, count)
+            for name, count in zip(columns.hosts, hosts) if count]))
+        WikiStats.merge_dict(stats.methods, dict([(name, count)
+            for name, count in zip(columns.methods, method_counts) if count]))
+        WikiStats.merge_dict(stats.rps, dict([(str(second), count)
+            for second, count in rps.iteritems()]))
+        for (upload, code) in upload_codes.iteritems():
+            (total, images_host, thumbs_host) = uploads[code]
+            WikiStats.merge_dict(stats.uploads, {upload: total})
+            if images_host:
+                WikiStats.merge_dict(stats.images_host, {upload: images_host})
+            if thumbs_host:
+                WikiStats.merge_dict(stats.thumbs_host, {upload: thumbs_host})
+
+    @staticmethod
+    def bincount(values, length):
+        """Return the number of occurrences of the codes 0 .. length-1."""
+        return numpy.bincount(values, minlength=max(length, 1))[:length]
+
+    @staticmethod
+    def join_urls(columns, urls):
+        """Return the urls of url ids separated by newlines."""
+        offsets = numpy.ctypeslib.as_array(columns.url_offsets)
+        data = numpy.frombuffer(columns.url_data, numpy.uint8)
+        starts = offsets[urls]
+        lengths = offsets[urls + 1] - starts + 1
+        ends = numpy.cumsum(lengths)
+        # position in data of every output byte, a separator follows every
+        # url, the position jumps at the first byte of every url
+        steps = numpy.ones(ends[-1], numpy.int64)
+        steps[0] = starts[0]
+        steps[ends[:-1]] = starts[1:] - starts[:-1] - lengths[:-1] + 1
+        index = numpy.cumsum(steps)
+        index[ends - 1] = 0
+        output = data[index]
+        output[ends - 1] = ord("\n")
+        return output[:-1].tostring()
+
+    def classify_urls(self, columns, urls, kinds, url_upload, upload_codes):
+        """
+        Set kind and upload code of new urls of a column trace and count
+        the new files.
+
+        """
+        upload_host = -1
+        if WikiAnalyser.UPLOAD_HOST in columns.hosts:
+            upload_host = columns.hosts.index(WikiAnalyser.UPLOAD_HOST)
+        for url in numpy.unique(urls[kinds[urls] < 0]).tolist():
+            kind = WikiAnalyser.KIND_PAGE
+            if columns.url_host[url] == upload_host:
+                path = urlparse.urlsplit(columns.get_url(url)).path
+                upload = WikiAnalyser.get_upload(path)
+                if upload not in upload_codes:
+                    upload_codes[upload] = len(upload_codes)
+                url_upload[url] = upload_codes[upload]
+                if "thumb" in path.split("/"):
+                    kind = WikiAnalyser.KIND_THUMB
+                else:
+                    kind = WikiAnalyser.KIND_IMAGE
+                self._stats.add_file(kind == WikiAnalyser.KIND_THUMB, upload,
+                        columns.get_url(url))
+            else:
+                self._stats.pages_files.add(columns.get_url(url))
+            kinds[url] = kind
+
+    def consume_columns_numpy(self, columns, start, end):
+        """
+        Analyse the lines of a column trace in the range [start, end) with
+        array operations on chunks of lines.
+
+        """
+        stats = self._stats
+        stats.lines += end - start
+        if end <= start:
+            return
+        as_array = numpy.ctypeslib.as_array
+        timestamps = as_array(columns.timestamp)
+        urls = as_array(columns.url)
+        methods = as_array(columns.method)
+        url_host = as_array(columns.url_host)
+
+        hosts = numpy.zeros(len(columns.hosts), numpy.int64)
+        method_counts = numpy.zeros(len(columns.methods), numpy.int64)
+        rps = dict()
+        kinds = numpy.empty(columns.urls(), numpy.int8)
+        kinds.fill(-1)
+        url_upload = numpy.zeros(columns.urls(), numpy.int32)
+        upload_codes = dict()
+        # requests, images and thumbs by upload code
+        uploads = numpy.zeros((3, 0), numpy.int64)
+        # most frequent urls by kind, counted in trace order like consume
+        tops = [stats.top_pages, stats.top_images, stats.top_thumbs]
+
+        for chunk in xrange(start, end, WikiAnalyser.NUMPY_CHUNK):
+            stop = min(chunk + WikiAnalyser.NUMPY_CHUNK, end)
+            timestamp = timestamps[chunk:stop]
+            # error rows of the columns have no timestamp
+            known = timestamp[~numpy.isnan(timestamp)]
+            if len(known):
+                stats.starttime = min(stats.starttime, float(known.min()))
+                stats.endtime = max(stats.endtime, float(known.max()))
+
+            url = urls[chunk:stop]
+            host = url_host[url]
+            valid = host >= 0
+            for pos in numpy.flatnonzero(~valid).tolist():
+                stats.errors.append(columns.get_line(chunk + pos))
+            url = url[valid]
+            host = host[valid]
+            timestamp = timestamp[valid]
+            if not len(url):
+                continue
+            stats.requests += len(url)
+            hosts += WikiAnalyser.bincount(host, len(hosts))
+            method_counts += WikiAnalyser.bincount(methods[chunk:stop][valid],
+                    len(method_counts))
+
+            # counted by unique seconds, a bincount would allocate the whole
+            # time span of the chunk for a single wrong timestamp
+            (seconds, counts) = numpy.unique(timestamp.astype(numpy.int64),
+                    return_counts=True)
+            for (key, count) in zip(seconds.tolist(), counts.tolist()):
+                rps[key] = rps.get(key, 0) + count
+
+            # urls in trace order by kind
+            self.classify_urls(columns, url, kinds, url_upload, upload_codes)
+            kind = kinds[url]
+            for (value, pipe) in [(WikiAnalyser.KIND_PAGE, self._pages),
+                    (WikiAnalyser.KIND_IMAGE, self._images),
+                    (WikiAnalyser.KIND_THUMB, self._thumbs)]:
+                selected = url[kind == value]
+                if len(selected):
+                    pipe.send(WikiAnalyser.join_urls(columns, selected))
+                    # Space-Saving depends on the order of the updates
+                    names = dict([(item, columns.get_url(item))
+                        for item in numpy.unique(selected).tolist()])
+                    add = tops[value].add
+                    for item in selected.tolist():
+                        add(names[item])
+
+            # uploads
+            if len(upload_codes) > uploads.shape[1]:
+                uploads = numpy.hstack([uploads, numpy.zeros((3,
+                    len(upload_codes) - uploads.shape[1]), numpy.int64)])
+            upload = kind != WikiAnalyser.KIND_PAGE
+            codes = url_upload[url[upload]]
+            uploads[0] += WikiAnalyser.bincount(codes, uploads.shape[1])
+            for value in [WikiAnalyser.KIND_IMAGE, WikiAnalyser.KIND_THUMB]:
+                uploads[value] += WikiAnalyser.bincount(
+                        codes[kind[upload] == value], uploads.shape[1])
+
+        # resolve codes
+        WikiStats.merge_dict(stats.hosts, dict([(name, int(count))
+            for name, count in zip(columns.hosts, hosts) if count]))
+        WikiStats.merge_dict(stats.methods, dict([(name, int(count))
+            for name, count in zip(columns.methods, method_counts) if count]))
+        WikiStats.merge_dict(stats.rps, dict([(str(second), count)
+            for second, count in rps.iteritems()]))
+        for (upload, code) in upload_codes.iteritems():
+            (total, images_host, thumbs_host) = uploads[:, code].tolist()
+            WikiStats.merge_dict(stats.uploads, {upload: total})
+            if images_host:
+                WikiStats.merge_dict(stats.images_host, {upload: images_host})
+            if thumbs_host:
+                WikiStats.merge_dict(stats.thumbs_host, {upload: thumbs_host})
 
     def stats(self):
         """Write statistics."""
+        stats = self._stats
         with open(self._filename + ".stats", "w") as output:
             sformat = "%30s: %s\n"
             output.write("[GENERAL]\n")
             output.write(sformat % ("tracefile", self._filename))
             output.write(sformat % ("start time",
                 time.strftime("%a, %d %b %Y %H:%M:%S +0000",
-                time.gmtime(self._starttime))))
+                time.gmtime(stats.starttime))))
             output.write(sformat % ("end time",
                 time.strftime("%a, %d %b %Y %H:%M:%S +0000",
-                time.gmtime(self._endtime))))
+                time.gmtime(stats.endtime))))
             output.write("%30s: %.3f sec\n" % ("duration",
-                self._endtime - self._starttime))
-            output.write(sformat % ("lines", str(self._lines)))
-            output.write(sformat % ("requests", str(self._requests)))
-            output.write(sformat % ("errors", str(len(self._errors))))
+                stats.endtime - stats.starttime))
+            output.write(sformat % ("lines", str(stats.lines)))
+            output.write(sformat % ("requests", str(stats.requests)))
+            output.write(sformat % ("errors", str(len(stats.errors))))
 
             sformat = "%30s: %8d\n"
 
             output.write("\n[HOSTS]\n")
-            self.print_dict(self._hosts, output)
+            self.print_dict(stats.hosts, output)
 
             output.write("\n[UPLOADS]\n")
-            self.print_dict(self._uploads, output)
+            self.print_dict(stats.uploads, output)
 
             output.write("\n[IMAGES]\n")
-            self.print_dict(self._images_host, output)
-            output.write(sformat % ("files", len(self._images_set)))
+            self.print_dict(stats.images_host, output)
+            self.print_files(stats.images_files, output)
 
             output.write("\n[THUMBS]\n")
-            self.print_dict(self._thumbs_host, output)
-            output.write(sformat % ("files", len(self._thumbs_set)))
+            self.print_dict(stats.thumbs_host, output)
+            self.print_files(stats.thumbs_files, output)
+
+            output.write("\n[IMAGE FILES]\n")
+            self.print_dict(dict([(upload, counter.count()) for upload,
+                counter in stats.images_upload_files.iteritems()]), output)
+
+            output.write("\n[THUMB FILES]\n")
+            self.print_dict(dict([(upload, counter.count()) for upload,
+                counter in stats.thumbs_upload_files.iteritems()]), output)
+
+            output.write("\n[TOP PAGES]\n")
+            self.print_top(stats.top_pages, stats.pages_files, output)
+
+            output.write("\n[TOP IMAGES]\n")
+            self.print_top(stats.top_images, stats.images_files, output)
+
+            output.write("\n[TOP THUMBS]\n")
+            self.print_top(stats.top_thumbs, stats.thumbs_files, output)
 
             output.write("\n[METHODS]\n")
-            self.print_dict(self._methods, output)
+            self.print_dict(stats.methods, output)
 
             output.write("\n[ERRORS]\n")
-            for error in self._errors:
+            for error in stats.errors:
                 output.write(error + "\n")
 
     def plot(self):
         """Plot statistics."""
-        data = ["%d %d" % (int(second) - int(self._starttime), count)
-                for second, count in sorted(self._rps.items())]
+        stats = self._stats
+        data = ["%d %d" % (int(second) - int(stats.starttime), count)
+                for second, count in sorted(stats.rps.items())]
         title = os.path.splitext(os.path.basename(self._filename))[0]
         gnuplot(title=title, data=data, filename=self._filename,
                 ylabel="requests", xlabel="second", using="1:2",
@@ -273,11 +726,15 @@ class WikiAnalyser(TraceAnalyser):
         (path, ext) = os.path.splitext(filename)
         return ("." + special).join([path, ext])
 
+    def get_output_file(self, special):
+        """Return filename of a special file written by this analyser."""
+        return WikiAnalyser.get_special_file(self._filename, special)
+
     def run(self):
         """Process run method."""
-        pagefile = WikiAnalyser.get_special_file(self._filename, "page")
-        imagefile = WikiAnalyser.get_special_file(self._filename, "image")
-        thumbfile = WikiAnalyser.get_special_file(self._filename, "thumb")
+        pagefile = self.get_output_file("page")
+        imagefile = self.get_output_file("image")
+        thumbfile = self.get_output_file("thumb")
 
         pfr = FileWriter(pagefile, openfunc=self._openfunc,
                 timeout=self._timeout)
@@ -291,6 +748,7 @@ class WikiAnalyser(TraceAnalyser):
                 timeout=self._timeout)
         self._thumbs = tfr.pipe
         tfr.start()
+        self._consumers = [pfr, ifr, tfr]
         TraceAnalyser.run(self)
         self._pages.send(None)
         self._pages.close()
@@ -306,10 +764,271 @@ class WikiAnalyser(TraceAnalyser):
         tfr.join()
 
 
+class WikiAnalyserWorker(WikiAnalyser):
+    """Analyse a part of a wiki trace and save the partial statistics."""
+
+    def __init__(self, filename, part, openfunc=open, timeout=None,
+            columns=None, records=None):
+        """
+        Create a new worker.
+
+        filename    : file to analyse
+        part        : number of the analysed part
+        openfunc    : function to open file
+        timeout     : pipe poll timeout
+        columns     : ColumnTrace of the file to read instead of a pipe
+        records     : range (start, end) of the lines to read from columns
+
+        """
+        WikiAnalyser.__init__(self, filename, openfunc, False, timeout,
+                columns=columns)
+        self._part = part
+        if records is not None:
+            self._records = records
+
+    def get_output_file(self, special):
+        """Return filename of a special file written by this worker."""
+        return "%s.%d" % (WikiAnalyser.get_output_file(self, special),
+                self._part)
+
+    def get_stats_file(self):
+        """Return filename of the partial statistics."""
+        return "%s.stats.%d" % (self._filename, self._part)
+
+    def stats(self):
+        """Save partial statistics."""
+        with open(self.get_stats_file(), "wb") as output:
+            cPickle.dump(self._stats, output, cPickle.HIGHEST_PROTOCOL)
+
+    def load_stats(self):
+        """Load and remove partial statistics."""
+        with open(self.get_stats_file(), "rb") as finput:
+            stats = cPickle.load(finput)
+        os.remove(self.get_stats_file())
+        return stats
+
+
+class ParallelWikiAnalyser(WikiAnalyser):
+    """
+    Analyse a wiki trace with several worker processes, which read
+    different byte ranges of the trace.
+
+    """
+
+    def __init__(self, filename, openfunc=open, plot=True, timeout=None,
+            workers=2, index=None, columns=None):
+        """
+        Create a new analyser.
+
+        filename    : file to analyse
+        openfunc    : function to open file
+        plot        : plot requests per seconds
+        timeout     : pipe poll timeout
+        workers     : number of worker processes
+        index       : GzipIndex of a compressed trace
+        columns     : ColumnTrace of the file, workers read line ranges
+
+        """
+        WikiAnalyser.__init__(self, filename, openfunc, plot, timeout,
+                columns=columns)
+        self._workers = workers
+        self._index = index
+
+    def split(self):
+        """Return byte or line ranges of the trace for the workers."""
+        if self._columns is not None:
+            return self._columns.split(self._workers)
+        if self._index is not None:
+            return self._index.split(self._workers)
+        if self._openfunc is open:
+            return FileReader.split(self._filename, self._workers)
+        self._log.warning("Unable to split compressed trace %s without "
+                "index", self._filename)
+        return [(0, None)]
+
+    def run(self):
+        """Process run method."""
+        self._log.info("ParallelWikiAnalyser for %s started", self._filename)
+        workers = []
+        readers = []
+        for part, (start, end) in enumerate(self.split()):
+            if self._columns is not None:
+                worker = WikiAnalyserWorker(self._filename, part,
+                        self._openfunc, self._timeout, self._columns,
+                        (start, end))
+                worker.start()
+                workers.append(worker)
+                continue
+            worker = WikiAnalyserWorker(self._filename, part, self._openfunc,
+                    self._timeout)
+            worker.start()
+            workers.append(worker)
+            reader = FileReader(self._filename, self._openfunc, [worker.pipe],
+                    start, end, self._index)
+            reader.start()
+            readers.append(reader)
+        self._log.debug("Started %d workers", len(workers))
+
+        for reader in readers:
+            reader.join()
+        for worker in workers:
+            worker.join()
+
+        # merge statistics and output files in trace order
+        for worker in workers:
+            self._stats.merge(worker.load_stats())
+        for special in ["page", "image", "thumb"]:
+            filename = self.get_output_file(special)
+            with open(filename, "wb") as output:
+                for worker in workers:
+                    part = worker.get_output_file(special)
+                    with open(part, "rb") as finput:
+                        shutil.copyfileobj(finput, output)
+                    os.remove(part)
+            self._log.debug("Merged %d parts of %s", len(workers), filename)
+
+        self.stats()
+        if self._plot:
+            self.plot()
+        self._log.info("ParallelWikiAnalyser for %s finished",
+                self._filename)
+
+
+class CacheAnalyser(TraceAnalyser):
+    """
+    Simulate LRU caches of all sizes for the pages, images and thumbs of a
+    wiki trace. The hit ratios are computed from the stack distances of
+    the requests for cache sizes in objects and, if the files were
+    downloaded before, in bytes.
+
+    """
+
+    KINDS = ["page", "image", "thumb"]
+
+    def __init__(self, filename, plot=True, timeout=None, channel=None,
+            columns=None, download_dir=None, regex=None):
+        """
+        Create a new analyser.
+
+        filename        : file to analyse
+        plot            : plot hit ratios
+        timeout         : pipe poll timeout
+        channel         : shared channel to read lines instead of a pipe
+        columns         : ColumnTrace of the file to read instead of a pipe
+        download_dir    : directory with downloaded images and thumbs
+        regex           : regex to remove from urls for local filenames
+
+        """
+        self._download_dir = download_dir
+        if regex is None:
+            regex = WikiFilter.DEFAULT_REGEX
+        self._regex = regex
+        TraceAnalyser.__init__(self, filename, plot, timeout, channel,
+                columns)
+
+    def init(self):
+        """Initialize the analyser."""
+        self._objects = dict([(kind, StackDistance())
+            for kind in CacheAnalyser.KINDS])
+        self._bytes = dict([(kind, StackDistance())
+            for kind in CacheAnalyser.KINDS])
+        # url -> file size, None if unknown
+        self._sizes = dict()
+
+    def get_state(self):
+        """Return the stacks to save at a checkpoint."""
+        return (self._objects, self._bytes, self._sizes)
+
+    def set_state(self, state):
+        """Set the stacks saved at a checkpoint."""
+        (self._objects, self._bytes, self._sizes) = state
+
+    def get_size(self, url):
+        """Return the size of the downloaded file of an url."""
+        if url not in self._sizes:
+            filename = FileCollector.get_local_file(self._download_dir,
+                    self._regex, urllib.unquote(url))
+            try:
+                self._sizes[url] = os.path.getsize(filename)
+            except OSError:
+                self._sizes[url] = None
+        return self._sizes[url]
+
+    def consume(self, line):
+        """Analyse a trace line."""
+        try:
+            (nbr, timestamp, url, method) = line.split(" ")
+            split = urlparse.urlsplit(url)
+            host = split.hostname
+        except Exception, err:
+            self._log.critical("ERROR: Unable to parse line %s (%s)", line,
+                    err)
+            sys.exit(3)
+        if not host:
+            return
+
+        if host != WikiAnalyser.UPLOAD_HOST:
+            kind = "page"
+        elif "thumb" in split.path.split("/"):
+            kind = "thumb"
+        else:
+            kind = "image"
+        self._objects[kind].access(url)
+
+        if self._download_dir is not None and kind != "page":
+            size = self.get_size(url)
+            if size is not None:
+                self._bytes[kind].access(url, size)
+
+    def get_output_file(self):
+        """Return filename of the hit ratios."""
+        return self._filename + ".cache"
+
+    def print_ratios(self, stack, unit, output):
+        """Print the hit ratios of a stack to output."""
+        sformat = "%30s: %s\n"
+        output.write(sformat % ("requests", stack.requests))
+        output.write(sformat % ("objects", len(stack)))
+        output.write(sformat % ("cold misses", stack.cold))
+        output.write("%30s  %s\n" % ("cache size (%s)" % unit, "hit ratio"))
+        for (size, ratio) in stack.hit_ratios():
+            output.write("%30d: %.4f\n" % (size, ratio))
+
+    def stats(self):
+        """Write hit ratios."""
+        with open(self.get_output_file(), "w") as output:
+            output.write("[GENERAL]\n")
+            output.write("%30s: %s\n" % ("tracefile", self._filename))
+            for kind in CacheAnalyser.KINDS:
+                output.write("\n[%sS]\n" % kind.upper())
+                self.print_ratios(self._objects[kind], "objects", output)
+                if self._bytes[kind].requests:
+                    output.write("\n[%s BYTES]\n" % kind.upper())
+                    self.print_ratios(self._bytes[kind], "bytes", output)
+
+    def plot(self):
+        """Plot hit ratios."""
+        title = os.path.splitext(os.path.basename(self._filename))[0]
+        for kind in CacheAnalyser.KINDS:
+            for (stack, unit) in [(self._objects[kind], "objects"),
+                    (self._bytes[kind], "bytes")]:
+                if not stack.buckets:
+                    continue
+                data = ["%d %f" % ratio for ratio in stack.hit_ratios()]
+                filename = "%s.%s" % (self.get_output_file(), kind)
+                if unit == "bytes":
+                    filename += ".bytes"
+                gnuplot(title="%s %ss" % (title, kind), data=data,
+                        filename=filename, ylabel="hit ratio",
+                        xlabel="cache size (%s)" % unit, using="1:2",
+                        styles=["linespoints"], logscale="x")
+
+
 class TraceFilter(PipeReader):
     """A filter for traces."""
 
-    def __init__(self, filename, regex, analyse=False, timeout=None):
+    def __init__(self, filename, regex, analyse=False, timeout=None,
+            channel=None, columns=None):
         """
         Create a new filter.
 
@@ -317,12 +1036,15 @@ class TraceFilter(PipeReader):
         regex       : filter regex for urls
         analyse     : trigger analyse of fitlered trace
         timeout     : pipe poll timeout
+        channel     : shared channel to read lines instead of a pipe
+        columns     : ColumnTrace of the file to read instead of a pipe
 
         """
-        PipeReader.__init__(self, timeout)
+        PipeReader.__init__(self, timeout, channel=channel)
         self._filename = filename
         self._regex = re.compile(regex)
         self._analyse = analyse
+        self._columns = columns
         self._log.debug("Tracefilter for %s created", filename)
 
     def consume(self, line):
@@ -330,10 +1052,26 @@ class TraceFilter(PipeReader):
         if self._regex.search(line):
             self.process(line)
 
+    def consume_columns(self, columns):
+        """Filter the lines of a column trace."""
+        for pos in xrange(len(columns)):
+            self.consume(columns.get_line(pos))
+            if self._finished:
+                break
+
+    def get_checkpoint_name(self):
+        """Return the unique name of the filter in a CheckpointStore."""
+        return "%s:%s" % (self.__class__.__name__,
+                os.path.basename(self._filename))
+
     def run(self):
         """Run filter process."""
         self._log.info("Tracefilter started")
-        PipeReader.run(self)
+        if self._columns is None:
+            self.restore()
+            PipeReader.run(self)
+        else:
+            self.consume_columns(self._columns)
         self._log.info("Tracefilter finished")
 
     def process(self, line):
@@ -348,8 +1086,17 @@ class WikiFilter(TraceFilter):
     r'http://upload.wikimedia.org/wikipedia/commons/',
     r'http://upload.wikimedia.org/wikipedia/en/'])
 
+    # rewrite rules as (regex, path) tuples, applied in order
+    DEFAULT_REWRITE = [(r'^http://en.wikipedia.org/wiki/', '/wiki/'),
+    (r'^http://en.wikipedia.org/w/', '/w/'),
+    (r'^http://en.wikipedia.org/', '/w/'),
+    (r'^http://upload.wikimedia.org/wikipedia/[a-z]+/', '/w/images/')]
+
+    DEFAULT_SLACK = 60
+
     def __init__(self, filename, host, interval, regex=None, analyse=False,
-            openfunc=open, plot=False, timeout=None):
+            openfunc=open, plot=False, timeout=None, channel=None,
+            slack=None, rewrite=None, columns=None):
         """
         Create a new filter.
 
@@ -361,17 +1108,33 @@ class WikiFilter(TraceFilter):
         openfunc    : function to open files to write
         plot        : trigger creation of a request per seconds plot
         timeout     : pipe poll timeout
+        channel     : shared channel to read lines instead of a pipe
+        slack       : seconds after the interval to stop reading the trace,
+                      which has to be sorted by time (negative = never stop)
+        rewrite     : list of (regex, path) tuples to rewrite urls to host
+        columns     : ColumnTrace of the file to read instead of a pipe
 
         """
+        if slack is None:
+            slack = WikiFilter.DEFAULT_SLACK
         self._host = "http://" + host
         self._interval = interval
+        if slack < 0:
+            self._stop = float("inf")
+        else:
+            self._stop = interval[1] + 1 + slack
         self._filterfile = WikiFilter.get_filterfile(filename, interval)
         self._rewritefile = WikiFilter.get_rewritefile(filename, interval)
         self._openfunc = openfunc
         self._plot = plot
         if regex is None:
             regex = WikiFilter.DEFAULT_REGEX
-        TraceFilter.__init__(self, filename, regex, analyse, timeout)
+        if rewrite is None:
+            rewrite = WikiFilter.DEFAULT_REWRITE
+        self._rules = UrlRules(regex, [(pattern, self._host + path)
+            for pattern, path in rewrite])
+        TraceFilter.__init__(self, filename, regex, analyse, timeout,
+                channel, columns)
 
     @staticmethod
     def get_filterfile(filename, interval):
@@ -387,16 +1150,44 @@ class WikiFilter(TraceFilter):
 
     def consume(self, line):
         """Filter line from tracefile."""
-        (nbr, timestamp, url, method) = line.split(" ")
-        timestamp = float(timestamp)
+        fields = line.split(" ")
+        timestamp = float(fields[1])
         if (timestamp >= self._interval[0] and
             timestamp < self._interval[1] + 1 and
-            self._regex.match(url)):
-            self.process(line)
+            self._rules.accept(fields[2])):
+            self.process(line, fields)
+        elif timestamp >= self._stop:
+            self._log.info("Interval passed at timestamp %f", timestamp)
+            self.finish()
 
-    def process(self, line):
+    def consume_columns(self, columns):
+        """
+        Filter the lines of a column trace. Only the timestamps are read for
+        lines outside the interval, urls are checked once per url.
+
+        """
+        timestamps = columns.timestamp
+        urls = columns.url
+        accepted = array("b", [-1]) * columns.urls()
+        (start, end) = (self._interval[0], self._interval[1] + 1)
+        for pos in xrange(len(columns)):
+            timestamp = timestamps[pos]
+            if timestamp >= start and timestamp < end:
+                url = urls[pos]
+                if accepted[url] < 0:
+                    accepted[url] = self._rules.accept(columns.get_url(url))
+                if accepted[url]:
+                    fields = columns.get_fields(pos)
+                    self.process(" ".join(fields), fields)
+            elif timestamp >= self._stop:
+                self._log.info("Interval passed at timestamp %f", timestamp)
+                break
+
+    def process(self, line, fields=None):
         """Process filter line from tracefile."""
-        (nbr, timestamp, url, method) = line.split(" ")
+        if fields is None:
+            fields = line.split(" ")
+        (nbr, timestamp, url, method) = fields
 
         # accept only gets
         if method != "-":
@@ -407,12 +1198,7 @@ class WikiFilter(TraceFilter):
             self._analyser.send(line)
 
         # write line in filtered tracefile
-        url = re.sub("^http://en.wikipedia.org/wiki/", self._host + "/wiki/",
-                url)
-        url = re.sub("^http://en.wikipedia.org/w/", self._host + "/w/", url)
-        url = re.sub("^http://en.wikipedia.org/", self._host + "/w/", url)
-        url = re.sub("^http://upload.wikimedia.org/wikipedia/[a-z]+/",
-                self._host + "/w/images/", url)
+        url = self._rules.rewrite(url)
 
         line = " ".join([nbr, timestamp, url, method])
 
@@ -428,12 +1214,14 @@ class WikiFilter(TraceFilter):
                 timeout=self._timeout)
         self._rewrite = rewritefw.pipe
         rewritefw.start()
+        self._consumers = [filterfw, rewritefw]
 
         if self._analyse:
             analyser = WikiAnalyser(self._filterfile, self._openfunc,
                     self._plot, self._timeout)
             self._analyser = analyser.pipe
             analyser.start()
+            self._consumers.append(analyser)
 
         TraceFilter.run(self)
 
@@ -454,11 +1242,51 @@ class WikiFilter(TraceFilter):
         rewritefw.join()
 
 
+class HashRing(object):
+    """
+    Consistent hashing of keys to a number of workers. Every worker has
+    several points on a ring of hashes and a key belongs to the worker of
+    the next point, so a key is always mapped to the same worker and only
+    few keys move, if the number of workers changes.
+
+    """
+
+    # points of a worker on the ring
+    REPLICAS = 160
+
+    def __init__(self, workers, replicas=None):
+        """
+        Create a new ring.
+
+        workers     : number of workers
+        replicas    : points of a worker on the ring
+
+        """
+        if replicas is None:
+            replicas = HashRing.REPLICAS
+        points = sorted([(hash_key("%d-%d" % (worker, replica)), worker)
+                for worker in xrange(workers)
+                for replica in xrange(replicas)])
+        self._hashes = [point[0] for point in points]
+        self._workers = [point[1] for point in points]
+
+    def get(self, key):
+        """Return the worker of a key."""
+        index = bisect.bisect(self._hashes, hash_key(key))
+        return self._workers[index % len(self._workers)]
+
+
 class FileCollector(PipeReader):
-    """A collector to download files by HTTP requests and save them."""
+    """
+    A collector to download files by HTTP requests and save them. The
+    files of a host are downloaded by workers FileCrawler processes, its
+    paths are spread across them by a HashRing, so a file is never
+    requested by two crawlers.
+
+    """
 
     def __init__(self, download_dir, copy_dir, regex=None, port=80, async=25,
-            retry=7, timeout=None):
+            retry=7, timeout=None, pipeline=1, workers=1):
         """
         Create a new collector.
 
@@ -466,9 +1294,14 @@ class FileCollector(PipeReader):
         copy_dir        : directory to copy files
         regex           : regex to filter urls
         port            : port to connect
-        async           : amount of asychronous connections
+        async           : amount of asychronous connections per host, shared
+                          by its crawlers
         retry           : number of connection attempts
         timeout         : timeout for pipe consumption
+        pipeline        : maximal number of requests sent ahead on a
+                          connection (1 = no pipelining)
+        workers         : number of crawler processes per host (at most
+                          async)
 
         """
         PipeReader.__init__(self, timeout)
@@ -481,12 +1314,30 @@ class FileCollector(PipeReader):
         self._port = port
         self._async = async
         self._retry = retry
+        self._pipeline = pipeline
+        # every crawler needs at least one of the connections of the host
+        if workers > async:
+            self._log.warning("Only %d crawlers per host for %d connections",
+                    async, async)
+            workers = async
+        self._workers = workers
+        self._ring = HashRing(workers)
+        # crawlers and their result pipes by host
         self._crawler = dict()
+        self._results = dict()
+        self._error = dict()
+        self.stats = HTTPStats()
+
+    @staticmethod
+    def get_local_file(download_dir, regex, url):
+        """Return local filename for a given url in a download directory."""
+        path = re.sub(regex, "", url)
+        return os.path.join(download_dir, path)
 
     def get_filename(self, url):
         """Return local filename for a given url."""
-        path = re.sub(self._regex, "", url)
-        return os.path.join(self._download_dir, path)
+        return FileCollector.get_local_file(self._download_dir, self._regex,
+                url)
 
     def copy_file(self, filename):
         """Copy file on the local system."""
@@ -512,21 +1363,59 @@ class FileCollector(PipeReader):
             host = split.hostname
             path = split.path
             if host not in self._crawler:
-                self._crawler[host] = FileCrawler(host, self._download_dir,
-                        self._port, self._async, self._retry, self._timeout)
-                self._crawler[host].start()
-            self._log.debug("Send %s path to FileCrawler for host %s", path,
-                    host)
-            self._crawler[host].pipe.send(path)
+                self.start_crawlers(host)
+            worker = self._ring.get(path)
+            self._log.debug("Send %s path to FileCrawler %d for host %s",
+                    path, worker, host)
+            self._crawler[host][worker].pipe.send(path)
             self._downloads.append(filename)
 
+    def start_crawlers(self, host):
+        """Start the crawlers of a host, which share its connections."""
+        self._crawler[host] = []
+        self._results[host] = []
+        for worker in xrange(self._workers):
+            async = self._async // self._workers
+            if worker < self._async % self._workers:
+                async += 1
+            (receiver, sender) = multiprocessing.Pipe(duplex=False)
+            crawler = FileCrawler(host, self._download_dir, self._port, async,
+                    self._retry, self._timeout, sender, self._pipeline)
+            crawler.start()
+            sender.close()
+            self._crawler[host].append(crawler)
+            self._results[host].append(receiver)
+        self._error[host] = set()
+
     def run(self):
         """Process run method."""
         PipeReader.run(self)
-        for crawler in self._crawler.values():
-            crawler.pipe.send(None)
-        for crawler in self._crawler.values():
-            crawler.join()
+        for crawlers in self._crawler.values():
+            for crawler in crawlers:
+                crawler.pipe.send(None)
+        # receive the missing files and the statistics before the join, a
+        # crawler exits only after they are sent
+        for (host, receivers) in self._results.iteritems():
+            for receiver in receivers:
+                try:
+                    self._error[host].update(receiver.recv())
+                    self.stats.merge(receiver.recv())
+                except EOFError:
+                    self._log.error("No statistics of the crawler for %s",
+                            host)
+                receiver.close()
+        for crawlers in self._crawler.values():
+            for crawler in crawlers:
+                crawler.join()
+        for host in sorted(self._error):
+            if self._error[host]:
+                self._log.info("Unable to find files on %s:\n%s", host,
+                        "\n".join(sorted(self._error[host])))
+            else:
+                self._log.info("All files on %s found", host)
+        if self._crawler:
+            self._log.info("FileCollector downloads from %s finished\n%s",
+                    ", ".join(sorted(self._crawler)), self.stats.report())
         for filename in self._downloads:
             if os.path.isfile(filename):
                 self.copy_file(filename)
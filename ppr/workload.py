@@ -0,0 +1,430 @@
+'''
+File: workload.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Synthetic wiki traces for capacity tests.
+'''
+
+import os
+import math
+import gzip
+import shutil
+from basic import Process
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Workload(object):
+    """
+    Shape of a synthetic wiki trace. The requests of every second are
+    Poisson distributed with the target rate, which follows a diurnal
+    curve and is multiplied with a Gamma distributed burst factor (mean 1,
+    variance burstiness). The requested pages, images and thumbs are
+    chosen by a Zipf distribution of their popularity.
+
+    The trace is generated in slices of SLICE seconds with their own
+    random streams, so every slice can be generated on its own and the
+    trace does not depend on the number of processes generating it. The
+    memory required is proportional to the number of objects, not to the
+    length of the trace.
+
+    """
+
+    KINDS = ["page", "image", "thumb"]
+
+    # seconds per slice and lines per rendered block
+    SLICE = 3600
+    BLOCK = 65536
+
+    # widths of the thumbs of an image
+    WIDTHS = [120, 180, 200, 220, 250, 300, 400, 800]
+
+    # parts of the lines of all kinds, fields are given by name
+    URLS = {"page": ["http://en.wikipedia.org/wiki/Page_", "id"],
+            "image": ["http://upload.wikimedia.org/wikipedia/commons/",
+                "dir", "/Image_", "id", ".jpg"],
+            "thumb": ["http://upload.wikimedia.org/wikipedia/commons/thumb/",
+                "dir", "/Image_", "id", ".jpg/", "width", "px-Image_", "id",
+                ".jpg"]}
+
+    DEFAULT_START = 1194892100
+    DEFAULT_MIX = (0.5, 0.3, 0.2)
+    DEFAULT_OBJECTS = (1000000, 500000, 1000000)
+    DEFAULT_ZIPF = 0.8
+    DEFAULT_PEAK = 15
+
+    def __init__(self, rps, duration, start=None, mix=None, objects=None,
+            zipf=None, diurnal=0.0, peak=None, burstiness=0.0, saves=0.0,
+            seed=0):
+        """
+        Create a new workload.
+
+        rps         : mean requests per second
+        duration    : length of the trace (seconds)
+        start       : timestamp of the first second (unix time)
+        mix         : shares of the (page, image, thumb) requests
+        objects     : number of (pages, images, thumbs), a thumb is one
+                      of the WIDTHS of an image
+        zipf        : exponent of the Zipf distribution of the popularity
+        diurnal     : amplitude of the diurnal curve relative to rps
+                      (0 = constant rate, 1 = no requests at night)
+        peak        : hour of the day with the highest rate (UTC)
+        burstiness  : variance of the burst factor of a second (0 = no
+                      bursts)
+        saves       : share of requests with the save method
+        seed        : seed of the random streams
+
+        """
+        if numpy is None:
+            raise ImportError("numpy is required to generate traces")
+        if start is None:
+            start = Workload.DEFAULT_START
+        if mix is None:
+            mix = Workload.DEFAULT_MIX
+        if objects is None:
+            objects = Workload.DEFAULT_OBJECTS
+        if zipf is None:
+            zipf = Workload.DEFAULT_ZIPF
+        if peak is None:
+            peak = Workload.DEFAULT_PEAK
+        self.rps = rps
+        self.duration = int(duration)
+        self.start = int(start)
+        self.mix = numpy.cumsum(mix, dtype=numpy.float64) / float(sum(mix))
+        self.mix[-1] = 1.0
+        self.objects = [max(int(count), 1) for count in objects]
+        self.zipf = zipf
+        self.diurnal = diurnal
+        self.peak = peak
+        self.burstiness = burstiness
+        self.saves = saves
+        self.seed = seed
+        # created on first use in the generating process
+        self._cdfs = None
+        self._templates = None
+
+    def slices(self):
+        """Return the number of slices."""
+        return int(math.ceil(self.duration / float(Workload.SLICE)))
+
+    def get_rates(self, number):
+        """Return the rates of the seconds of a slice."""
+        first = number * Workload.SLICE
+        last = min(first + Workload.SLICE, self.duration)
+        hours = (self.start + numpy.arange(first, last)) / 3600.0
+        return self.rps * (1 + self.diurnal * numpy.cos(2 * math.pi *
+            (hours - self.peak) / 24))
+
+    def get_counts(self, number):
+        """Return the number of requests of the seconds of a slice."""
+        rng = numpy.random.RandomState([self.seed, number, 0])
+        rates = self.get_rates(number)
+        if self.burstiness > 0:
+            rates *= rng.gamma(1.0 / self.burstiness, self.burstiness,
+                    len(rates))
+        return rng.poisson(rates)
+
+    def count(self, number):
+        """Return the number of lines of a slice."""
+        return int(self.get_counts(number).sum())
+
+    def get_cdfs(self):
+        """Return the cumulative popularity of the objects of all kinds."""
+        if self._cdfs is None:
+            self._cdfs = []
+            for count in self.objects:
+                cdf = numpy.cumsum(numpy.arange(1, count + 1,
+                    dtype=numpy.float64) ** -self.zipf)
+                cdf /= cdf[-1]
+                cdf[-1] = 1.0
+                self._cdfs.append(cdf)
+        return self._cdfs
+
+    def get_slots(self, field):
+        """Return the number of 4 byte slots of a field."""
+        if field in ["nbr", "sec"]:
+            return 3
+        if field == "id":
+            return (len(str(max(self.objects))) + 3) // 4
+        return 1
+
+    def compile(self):
+        """
+        Create the template lines of all kinds. Every field is written to
+        a slot of 4 byte words, numbers are right aligned in their slots,
+        all unused bytes are 0 and removed after a block is rendered.
+
+        """
+        if self._templates is not None:
+            return
+        layouts = []
+        for kind in Workload.KINDS:
+            parts = ["nbr", " ", "sec", "ms", " "] + Workload.URLS[kind] + [
+                    " ", "method", "\n"]
+            data = ""
+            fields = []
+            for part in parts:
+                if part.isalpha():
+                    data += "\x00" * (-len(data) % 4)
+                    fields.append((part, len(data) // 4,
+                        self.get_slots(part)))
+                    data += "\x00" * (4 * self.get_slots(part))
+                else:
+                    data += part
+            layouts.append((data, fields))
+        width = max([len(data) for (data, fields) in layouts])
+        width += -width % 4
+        self._templates = numpy.zeros((len(layouts), width), numpy.uint8)
+        self._fields = []
+        for (kind, (data, fields)) in enumerate(layouts):
+            self._templates[kind, :len(data)] = numpy.frombuffer(data,
+                    numpy.uint8)
+        # fields at the same words in all kinds are written at once
+        self._common = [field for field in layouts[0][1]
+                if all([field in fields for (data, fields) in layouts])]
+        for (data, fields) in layouts:
+            self._fields.append([field for field in fields
+                if field not in self._common])
+
+        # words of the numbers 0-9999 with and without leading zeros, of
+        # the milliseconds, image directories, thumb widths and methods
+        numbers = ["%04d" % value for value in xrange(10000)] + [
+                ("%d" % value).rjust(4, "\x00") for value in xrange(10000)]
+        numbers[10000] = "\x00" * 4
+        self._numbers = Workload.get_words(numbers)
+        self._zero = Workload.get_words(["\x00\x00\x000"])[0]
+        self._words = dict(
+                ms=Workload.get_words([".%03d" % value
+                    for value in xrange(1000)]),
+                dir=Workload.get_words(["%x/%02x" % (value >> 4, value)
+                    for value in xrange(256)]),
+                width=Workload.get_words([("%d" % value).rjust(4, "\x00")
+                    for value in Workload.WIDTHS]),
+                method=Workload.get_words(["\x00\x00\x00-", "save"]))
+
+    @staticmethod
+    def get_words(strings):
+        """Return strings of 4 bytes as an array of words."""
+        return numpy.frombuffer("".join(strings), numpy.uint32).copy()
+
+    def get_digits(self, values, slots):
+        """Return the words of numbers in slots, most significant first."""
+        words = []
+        zero = values == 0
+        for slot in xrange(slots):
+            part = values % 10000
+            values = values // 10000
+            words.append(self._numbers[part + 10000 * (values == 0)])
+        words.reverse()
+        words[-1][zero] = self._zero
+        return words
+
+    def render(self, nbr, seconds, millis, kinds, ids, saves):
+        """Return the lines of a block of requests as string."""
+        self.compile()
+        rows = self._templates.take(kinds, axis=0)
+        words = rows.view(numpy.uint32)
+        widths = len(Workload.WIDTHS)
+        thumbs = kinds == Workload.KINDS.index("thumb")
+        images = numpy.where(thumbs, ids // widths, ids)
+        values = dict(nbr=numpy.arange(nbr, nbr + len(kinds),
+            dtype=numpy.int64), sec=seconds, ms=millis, id=images,
+            dir=images % 256, width=ids % widths, method=saves)
+        self.fill(words, slice(None), self._common, values)
+        for (kind, fields) in enumerate(self._fields):
+            index = numpy.flatnonzero(kinds == kind)
+            if len(index):
+                self.fill(words, index, fields, dict([(field,
+                    values[field][index]) for (field, word, slots) in
+                    fields]))
+        return rows[rows != 0].tostring()
+
+    def fill(self, words, index, fields, values):
+        """Write the values of fields to the words of the rows in index."""
+        for (field, word, slots) in fields:
+            if field in self._words:
+                words[index, word] = self._words[field][values[field]]
+                continue
+            for (slot, column) in enumerate(self.get_digits(values[field],
+                    slots)):
+                words[index, word + slot] = column
+
+    def choose(self, rng, cdf, count):
+        """
+        Return random objects by their cumulative popularity. The random
+        values are drawn in sorted order from exponential spacings, which
+        makes the binary searches cache friendly, and shuffled afterwards.
+
+        """
+        spacings = numpy.cumsum(rng.standard_exponential(count + 1))
+        ids = numpy.searchsorted(cdf, spacings[:-1] / spacings[-1],
+                side="right")
+        rng.shuffle(ids)
+        return ids
+
+    def render_block(self, rng, second, counts, nbr):
+        """Return the lines of the requests of consecutive seconds."""
+        lines = int(counts.sum())
+        times = numpy.repeat(numpy.arange(len(counts), dtype=numpy.int64) *
+                1000, counts) + rng.randint(0, 1000, lines)
+        times.sort()
+        kinds = numpy.searchsorted(self.mix, rng.random_sample(lines),
+                side="right")
+        ids = numpy.empty(lines, numpy.int64)
+        for (kind, cdf) in enumerate(self.get_cdfs()):
+            index = numpy.flatnonzero(kinds == kind)
+            ids[index] = self.choose(rng, cdf, len(index))
+        if self.saves > 0:
+            saves = (rng.random_sample(lines) < self.saves).astype(numpy.int8)
+        else:
+            saves = numpy.zeros(lines, numpy.int8)
+        return self.render(nbr, times // 1000 + self.start + second,
+                times % 1000, kinds, ids, saves)
+
+    def blocks(self, number, nbr):
+        """
+        Yield the rendered blocks of lines of a slice.
+
+        number      : number of the slice
+        nbr         : number of the first line of the slice
+
+        """
+        counts = self.get_counts(number)
+        ends = numpy.cumsum(counts)
+        rng = numpy.random.RandomState([self.seed, number, 1])
+        first = number * Workload.SLICE
+        start = 0
+        while start < len(counts):
+            # whole seconds with at most BLOCK lines (or a single second)
+            before = ends[start] - counts[start]
+            end = max(int(numpy.searchsorted(ends, before + Workload.BLOCK,
+                side="right")), start + 1)
+            if ends[end - 1] > before:
+                yield self.render_block(rng, first + start,
+                        counts[start:end], nbr)
+                nbr += int(ends[end - 1] - before)
+            start = end
+
+
+class WorkloadWorker(Process):
+    """Write consecutive slices of a synthetic trace to a file."""
+
+    def __init__(self, workload, filename, first, last, nbr,
+            compresslevel=None):
+        """
+        Create a new worker.
+
+        workload        : Workload of the trace
+        filename        : file to write
+        first           : number of the first slice
+        last            : number of the slice after the last slice
+        nbr             : number of the first line
+        compresslevel   : gzip compression level (None = plain file)
+
+        """
+        Process.__init__(self)
+        self._workload = workload
+        self._filename = filename
+        self._first = first
+        self._last = last
+        self._nbr = nbr
+        self._compresslevel = compresslevel
+
+    def get_label(self):
+        """Return a readable name of the worker with its file."""
+        return "%s:%s" % (self.name, os.path.basename(self._filename))
+
+    def open(self):
+        """Open the file to write."""
+        if self._compresslevel is None:
+            return open(self._filename, "wb")
+        return gzip.GzipFile(self._filename, "wb", self._compresslevel)
+
+    def run(self):
+        """Process run method."""
+        self._log.debug("WorkloadWorker for %s started (slices %d-%d)",
+                self._filename, self._first, self._last)
+        nbr = self._nbr
+        output = self.open()
+        try:
+            for number in xrange(self._first, self._last):
+                for block in self._workload.blocks(number, nbr):
+                    output.write(block)
+                nbr += self._workload.count(number)
+        finally:
+            output.close()
+        self._log.debug("WorkloadWorker for %s finished", self._filename)
+
+
+class WorkloadGenerator(Process):
+    """
+    Generate a synthetic trace with several worker processes, which write
+    consecutive slices of the trace to parts, which are joined afterwards.
+    The parts of a compressed trace are joined as gzip members.
+
+    """
+
+    DEFAULT_COMPRESSLEVEL = 1
+
+    def __init__(self, filename, workload, compress=False,
+            compresslevel=None, workers=1):
+        """
+        Create a new generator.
+
+        filename        : trace file to write
+        workload        : Workload of the trace
+        compress        : write a gzip trace
+        compresslevel   : gzip compression level
+        workers         : number of worker processes
+
+        """
+        Process.__init__(self)
+        if compresslevel is None:
+            compresslevel = WorkloadGenerator.DEFAULT_COMPRESSLEVEL
+        if not compress:
+            compresslevel = None
+        self._filename = filename
+        self._workload = workload
+        self._compresslevel = compresslevel
+        self._workers = max(workers, 1)
+
+    def split(self):
+        """Return the ranges of slices (first, last) of the workers."""
+        slices = self._workload.slices()
+        parts = min(self._workers, slices) or 1
+        bounds = [slices * part // parts for part in xrange(parts + 1)]
+        return zip(bounds[:-1], bounds[1:])
+
+    def run(self):
+        """Process run method."""
+        self._log.info("WorkloadGenerator for %s started", self._filename)
+        ranges = self.split()
+        workers = []
+        nbr = 0
+        for (part, (first, last)) in enumerate(ranges):
+            filename = self._filename
+            if len(ranges) > 1:
+                filename = "%s.%d" % (self._filename, part)
+            worker = WorkloadWorker(self._workload, filename, first, last,
+                    nbr, self._compresslevel)
+            worker.start()
+            workers.append(worker)
+            for number in xrange(first, last):
+                nbr += self._workload.count(number)
+        for worker in workers:
+            worker.join()
+
+        if len(ranges) > 1:
+            with open(self._filename, "wb") as output:
+                for part in xrange(len(ranges)):
+                    filename = "%s.%d" % (self._filename, part)
+                    with open(filename, "rb") as finput:
+                        shutil.copyfileobj(finput, output, 1024 * 1024)
+                    os.remove(filename)
+            self._log.debug("Joined %d parts of %s", len(ranges),
+                    self._filename)
+        self._log.info("WorkloadGenerator for %s finished (%d lines)",
+                self._filename, nbr)
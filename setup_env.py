@@ -17,8 +17,19 @@ import gzip
 import logging
 import multiprocessing
 import tarfile
-from ppr.basic import Process, FileReader, SyncClient
-from ppr.trace import WikiAnalyser, WikiFilter, FileCollector
+from ppr.basic import Process, BatchPipe, FileReader, PipeReader, \
+        SyncClient
+from ppr.channel import RingBuffer
+from ppr.index import GzipIndex, TimestampIndex
+from ppr.columns import ColumnTrace
+from ppr.checkpoint import CheckpointStore
+from ppr.metrics import MetricsBoard, MetricsMonitor
+from ppr.counter import DistinctCounter, TopCounter
+from ppr.trace import WikiAnalyser, ParallelWikiAnalyser, CacheAnalyser, \
+        WikiFilter, FileCollector, numpy
+from ppr.workload import Workload, WorkloadGenerator
+from ppr.eventloop import EventLoop
+from ppr.http import HTTPReplayer
 from ppr.server import execute, stop_service, start_service
 
 
@@ -60,6 +71,12 @@ def get_config_int(config, section, option, hint="", default=None):
             default)
 
 
+def get_config_float(config, section, option, hint="", default=None):
+    """Return a float from configuration file."""
+    return get_config(config, config.getfloat, section, option, hint,
+            default)
+
+
 def get_config_path(config, section, option, hint="", default=None):
     """Return a path from configuration file."""
     return os.path.realpath(get_config(config, config.get, section, option,
@@ -96,10 +113,84 @@ def read_config(filename):
     config["install"] = get_config_bool(config_file, "general", "install",
             "Pack images and database and install them on other server")
 
+    config["generate"] = get_config_bool(config_file, "general", "generate",
+            default=False)
+    config["replay"] = get_config_bool(config_file, "general", "replay",
+            default=False)
+
     config["logging"] = get_config_str(config_file, "general", "logging",
             default=logging.DEBUG).upper()
     config["plot"] = get_config_bool(config_file, "general", "plot",
             default=False)
+    config["cache"] = get_config_bool(config_file, "general", "cache",
+            default=False)
+    if config["cache"]:
+        # file sizes of images and thumbs downloaded before
+        cache_dir = get_config_str(config_file, "download", "download_dir",
+                default="")
+        if cache_dir:
+            config["cache_dir"] = os.path.realpath(cache_dir)
+        else:
+            config["cache_dir"] = None
+    config["batch"] = get_config_int(config_file, "general", "batch",
+            default=1024)
+    config["batch_size"] = get_config_int(config_file, "general",
+            "batch_size", default=0)
+    config["channel"] = get_config_str(config_file, "general", "channel",
+            default="pipe").lower()
+    if config["channel"] not in ["pipe", "ring"]:
+        print_error("Unknown channel '%s' in 'general' section" %
+                config["channel"], "Hint: Use pipe or ring")
+    config["ring_size"] = get_config_int(config_file, "general",
+            "ring_size", default=64)
+    config["workers"] = get_config_int(config_file, "general", "workers",
+            default=1)
+    config["backend"] = get_config_str(config_file, "general", "backend",
+            default="python").lower()
+    if config["backend"] not in ["python", "numpy"]:
+        print_error("Unknown backend '%s' in 'general' section" %
+                config["backend"], "Hint: Use python or numpy")
+    if config["backend"] == "numpy" and numpy is None:
+        print_error("Unable to import numpy for numpy backend",
+                "Hint: Install numpy or use python backend")
+    config["http_engine"] = get_config_str(config_file, "general",
+            "http_engine", default=EventLoop.DEFAULT_ENGINE).lower()
+    if config["http_engine"] not in EventLoop.get_engines():
+        print_error("Unknown or unavailable http_engine '%s' in 'general' "
+                "section" % config["http_engine"], "Hint: Use %s" %
+                " or ".join(EventLoop.get_engines()))
+    config["counter"] = get_config_str(config_file, "general", "counter",
+            default="exact").lower()
+    if config["counter"] not in ["exact", "hll"]:
+        print_error("Unknown counter '%s' in 'general' section" %
+                config["counter"], "Hint: Use exact or hll")
+    config["counter_error"] = get_config_float(config_file, "general",
+            "counter_error", default=0.01)
+    if not 0 < config["counter_error"] < 1:
+        print_error("Invalid counter_error in 'general' section",
+                "Hint: Use a relative error between 0 and 1")
+    config["counter_memory"] = get_config_int(config_file, "general",
+            "counter_memory", default=64)
+    config["top"] = get_config_int(config_file, "general", "top",
+            default=WikiAnalyser.DEFAULT_TOP)
+    config["top_capacity"] = get_config_int(config_file, "general",
+            "top_capacity", default=TopCounter.DEFAULT_CAPACITY)
+    config["metrics"] = get_config_float(config_file, "general", "metrics",
+            default=0.0)
+    if config["metrics"] < 0:
+        print_error("Invalid metrics in 'general' section",
+                "Hint: Use seconds between two progress lines or 0")
+    config["metrics_port"] = get_config_int(config_file, "general",
+            "metrics_port", default=0)
+    config["metrics_json"] = get_config_bool(config_file, "general",
+            "metrics_json", default=False)
+    config["profile"] = [name.strip() for name in get_config_str(
+        config_file, "general", "profile", default="").split(",")
+        if name.strip()]
+    if "all" in config["profile"]:
+        config["profile"] = ["Process"]
+    config["profile_dir"] = get_config_path(config_file, "general",
+            "profile_dir", default="profile")
 
     # trace
     config["trace_file"] = get_config_path(config_file, "trace", "file",
@@ -112,6 +203,75 @@ def read_config(filename):
     else:
         config["trace_openfunc"] = open
 
+    config["trace_index"] = get_config_bool(config_file, "trace", "index",
+            default=False)
+    config["trace_index_span"] = get_config_int(config_file, "trace",
+            "index_span", default=16)
+    config["trace_format"] = get_config_str(config_file, "trace", "format",
+            default="text").lower()
+    if config["trace_format"] not in ["text", "columns"]:
+        print_error("Unknown format '%s' in 'trace' section" %
+                config["trace_format"], "Hint: Use text or columns")
+    config["trace_checkpoint"] = get_config_int(config_file, "trace",
+            "checkpoint", default=0)
+    if config["trace_checkpoint"] < 0:
+        print_error("Invalid checkpoint in 'trace' section",
+                "Hint: Use a number of lines or 0")
+    config["trace_resume"] = get_config_bool(config_file, "trace", "resume",
+            default=False)
+
+    if config["generate"]:
+        # workload
+        if numpy is None:
+            print_error("Unable to import numpy to generate a trace",
+                    "Hint: Install numpy or set generate to false")
+        config["workload_rps"] = get_config_float(config_file, "workload",
+                "rps", "Mean requests per second of the generated trace")
+        config["workload_duration"] = get_config_int(config_file, "workload",
+                "duration", "Length of the generated trace in seconds")
+        config["workload_start"] = get_config_int(config_file, "workload",
+                "start", default=Workload.DEFAULT_START)
+        mix = get_config_str(config_file, "workload", "mix",
+                default=",".join(map(str, Workload.DEFAULT_MIX)))
+        try:
+            mix = tuple([float(share) for share in mix.split(",")])
+        except ValueError:
+            mix = ()
+        if len(mix) != 3 or min(mix) < 0 or not sum(mix):
+            print_error("Invalid mix in 'workload' section",
+                    "Hint: Use shares of pages, images and thumbs "
+                    "(e.g. 0.5,0.3,0.2)")
+        config["workload_mix"] = mix
+        config["workload_objects"] = tuple([get_config_int(config_file,
+            "workload", option, default=default) for (option, default) in
+            zip(["pages", "images", "thumbs"], Workload.DEFAULT_OBJECTS)])
+        config["workload_zipf"] = get_config_float(config_file, "workload",
+                "zipf", default=Workload.DEFAULT_ZIPF)
+        config["workload_diurnal"] = get_config_float(config_file,
+                "workload", "diurnal", default=0.0)
+        if not 0 <= config["workload_diurnal"] <= 1:
+            print_error("Invalid diurnal in 'workload' section",
+                    "Hint: Use an amplitude between 0 and 1")
+        config["workload_peak"] = get_config_float(config_file, "workload",
+                "peak", default=Workload.DEFAULT_PEAK)
+        config["workload_burstiness"] = get_config_float(config_file,
+                "workload", "burstiness", default=0.0)
+        if config["workload_burstiness"] < 0:
+            print_error("Invalid burstiness in 'workload' section",
+                    "Hint: Use a variance or 0")
+        config["workload_saves"] = get_config_float(config_file, "workload",
+                "saves", default=0.0)
+        config["workload_seed"] = get_config_int(config_file, "workload",
+                "seed", default=0)
+        config["workload_workers"] = get_config_int(config_file, "workload",
+                "workers", default=1)
+        config["workload_compresslevel"] = get_config_int(config_file,
+                "workload", "compresslevel",
+                default=WorkloadGenerator.DEFAULT_COMPRESSLEVEL)
+        if not 1 <= config["workload_compresslevel"] <= 9:
+            print_error("Invalid compresslevel in 'workload' section",
+                    "Hint: Use a level between 1 and 9")
+
     if config["filter"] or config["download"]:
         # filter
         start, end = get_config_str(config_file, "filter", "interval",
@@ -129,6 +289,20 @@ def read_config(filename):
         config["filter_regex"] = get_config_str(config_file, "filter", "regex",
                 default=WikiFilter.DEFAULT_REGEX)
 
+        config["filter_slack"] = get_config_int(config_file, "filter",
+                "slack", default=WikiFilter.DEFAULT_SLACK)
+
+        rewrite = [line.split() for line in get_config_str(config_file,
+            "filter", "rewrite", default="").splitlines() if line.strip()]
+        for rule in rewrite:
+            if len(rule) != 2:
+                print_error("Invalid rewrite rule '%s'" % " ".join(rule),
+                        "Hint: Use one 'regex path' rule per line")
+        if rewrite:
+            config["filter_rewrite"] = [tuple(rule) for rule in rewrite]
+        else:
+            config["filter_rewrite"] = None
+
         config["filter_gzip"] = get_config_bool(config_file, "filter", "gzip",
                 False)
         if config["filter_gzip"]:
@@ -136,6 +310,34 @@ def read_config(filename):
         else:
             config["filter_openfunc"] = open
 
+    if config["replay"]:
+        # replay
+        rewritefile = None
+        if "filter_interval" in config:
+            rewritefile = WikiFilter.get_rewritefile(config["trace_file"],
+                    config["filter_interval"])
+        config["replay_file"] = get_config_path(config_file, "replay",
+                "file", "Path of the trace to replay (default: rewritten "
+                "trace of the filter)", default=rewritefile)
+        config["replay_gzip"] = get_config_bool(config_file, "replay", "gzip",
+                default=config.get("filter_gzip", False))
+        if config["replay_gzip"]:
+            config["replay_openfunc"] = gzip.open
+        else:
+            config["replay_openfunc"] = open
+        config["replay_host"] = get_config_str(config_file, "replay", "host",
+                "Host to replay the trace (default: host of the filter)",
+                default=config.get("filter_host"))
+        config["replay_port"] = get_config_int(config_file, "replay", "port",
+                default=80)
+        config["replay_speedup"] = get_config_float(config_file, "replay",
+                "speedup", default=1.0)
+        if config["replay_speedup"] <= 0:
+            print_error("Invalid speedup in 'replay' section",
+                    "Hint: Use a factor greater than 0")
+        config["replay_connections"] = get_config_int(config_file, "replay",
+                "connections", default=HTTPReplayer.DEFAULT_CONNECTIONS)
+
     if config["download"] or config["install"]:
         # download
         config["download_dir"] = get_config_path(config_file, "download",
@@ -148,6 +350,18 @@ def read_config(filename):
         config["download_async"] = get_config_int(config_file, "download",
                 "async", default=25)
 
+        config["download_pipeline"] = get_config_int(config_file,
+                "download", "pipeline", default=1)
+        if config["download_pipeline"] < 1:
+            print_error("Invalid pipeline in 'download' section",
+                    "Hint: Use 1 to send one request at a time")
+
+        config["download_workers"] = get_config_int(config_file, "download",
+                "workers", default=1)
+        if config["download_workers"] < 1:
+            print_error("Invalid workers in 'download' section",
+                    "Hint: Use 1 to download a host by one process")
+
         config["download_wiki_dir"] = get_config_path(config_file, "download",
                 "wiki_dir", "Mediawiki root directory")
 
@@ -234,9 +448,48 @@ def main(config):
     log = multiprocessing.get_logger()
 
     Process.DEFAULT_LOGLEVEL = logging.getLevelName(config["logging"])
+    BatchPipe.DEFAULT_BATCH = config["batch"]
+    BatchPipe.DEFAULT_BATCH_SIZE = config["batch_size"]
+    WikiAnalyser.DEFAULT_BACKEND = config["backend"]
+    EventLoop.DEFAULT_ENGINE = config["http_engine"]
+    DistinctCounter.DEFAULT_MODE = config["counter"]
+    DistinctCounter.DEFAULT_ERROR = config["counter_error"]
+    DistinctCounter.DEFAULT_MEMORY = config["counter_memory"] * 1024 * 1024
+    WikiAnalyser.DEFAULT_TOP = config["top"]
+    TopCounter.DEFAULT_CAPACITY = config["top_capacity"]
+    Process.DEFAULT_PROFILE = config["profile"]
+    Process.DEFAULT_PROFILE_DIR = config["profile_dir"]
+
+    # metrics of all processes
+    monitor = None
+    if config["metrics"]:
+        metrics_file = None
+        if config["metrics_json"]:
+            metrics_file = config["trace_file"] + ".metrics.json"
+        board = MetricsBoard()
+        Process.DEFAULT_METRICS = board
+        monitor = MetricsMonitor(board, config["metrics"], log,
+                config["metrics_port"] or None, metrics_file)
+        monitor.start()
+
+    # generate trace
+    if config["generate"]:
+        log.info("Generate trace %s", config["trace_file"])
+        workload = Workload(config["workload_rps"],
+                config["workload_duration"], config["workload_start"],
+                config["workload_mix"], config["workload_objects"],
+                config["workload_zipf"], config["workload_diurnal"],
+                config["workload_peak"], config["workload_burstiness"],
+                config["workload_saves"], config["workload_seed"])
+        generator = WorkloadGenerator(config["trace_file"], workload,
+                config["trace_gzip"], config["workload_compresslevel"],
+                config["workload_workers"])
+        generator.start()
+        generator.join()
 
     # test required values
-    if config["analyse"] or config["filter"] or config["download"]:
+    if (config["analyse"] or config["filter"] or config["download"] or
+            config["cache"]):
         trace_file = config["trace_file"]
         if not os.path.isfile(trace_file):
             print_error("Unable to find tracefile " + trace_file)
@@ -284,31 +537,138 @@ def main(config):
                 print_error("Unable to find mysql clean archive " +
                         config["download_mysql_archive"])
 
+    # columns
+    columns = None
+    if config["trace_format"] == "columns" and (config["analyse"] or
+            config["filter"] or config["cache"]):
+        try:
+            if ColumnTrace.exists(trace_file):
+                columns = ColumnTrace(trace_file)
+            else:
+                log.info("Convert %s to columns", trace_file)
+                columns = ColumnTrace.convert(trace_file,
+                        config["trace_openfunc"], log)
+        except (IOError, OSError, ValueError), err:
+            print_error("Unable to read %s as columns (%s)" % (trace_file,
+                err), "Hint: Remove %s or use format=text" %
+                ColumnTrace.get_directory(trace_file))
+
+    # index
+    index = None
+    if config["trace_gzip"] and config["trace_index"] and columns is None and (
+            config["analyse"] or config["filter"]):
+        if GzipIndex.exists(trace_file):
+            index = GzipIndex(trace_file)
+        else:
+            log.info("Build gzip index for %s", trace_file)
+            try:
+                index = GzipIndex.build(trace_file,
+                        config["trace_index_span"] * 1024 * 1024, log)
+            except (IOError, OSError), err:
+                print_error("Unable to build gzip index for %s (%s)" %
+                        (trace_file, err), "Hint: Re-pack the trace as gzip "
+                        "members of index_span MB in a writable directory "
+                        "or use index=false")
+
+    # the filter reads only the part of the trace with its interval
+    filter_interval = None
+    if config["filter"] and config["trace_index"] and columns is None:
+        if not TimestampIndex.exists(trace_file):
+            log.info("Build timestamp index for %s", trace_file)
+            TimestampIndex.build(trace_file, config["trace_openfunc"],
+                    config["trace_index_span"] * 1024 * 1024, index, log)
+        filter_interval = config["filter_interval"]
+
     # analyse and filter
+    parallel = config["analyse"] and config["workers"] > 1
+    channel = None
+    consumers = [config["analyse"] and not parallel,
+            config["filter"] and filter_interval is None,
+            config["cache"]].count(True)
+    if config["channel"] == "ring" and consumers and columns is None:
+        channel = RingBuffer(config["ring_size"] * 1024 * 1024, consumers)
+
+    # checkpoints of the processes reading the whole trace
+    checkpoints = None
+    if config["trace_checkpoint"] and consumers and columns is None:
+        checkpoints = CheckpointStore(CheckpointStore.get_directory(
+            trace_file), config["trace_checkpoint"])
+        if config["trace_resume"]:
+            checkpoints.resume = checkpoints.latest()
+        if checkpoints.resume is None:
+            if config["trace_resume"]:
+                log.warning("No complete checkpoint found for %s, start at "
+                        "the beginning", trace_file)
+            checkpoints.clear()
+            checkpoints.register(FileReader.CHECKPOINT_NAME)
+        else:
+            log.info("Resume %s at checkpoint %d", trace_file,
+                    checkpoints.resume)
+        PipeReader.DEFAULT_CHECKPOINTS = checkpoints
+
     reader_pipes = []
-    if config["analyse"]:
+    if parallel:
+        analyser = ParallelWikiAnalyser(trace_file, config["trace_openfunc"],
+                config["plot"], workers=config["workers"], index=index,
+                columns=columns)
+        analyser.start()
+    elif config["analyse"]:
         analyser = WikiAnalyser(trace_file, config["trace_openfunc"],
-                config["plot"])
+                config["plot"], channel=channel, columns=columns)
         analyser.start()
-        reader_pipes.append(analyser.pipe)
-
-    if config["filter"]:
+        if columns is None:
+            reader_pipes.append(analyser.pipe)
+            if checkpoints is not None:
+                checkpoints.register(analyser.get_checkpoint_name())
+
+    if config["cache"]:
+        cache = CacheAnalyser(trace_file, config["plot"], channel=channel,
+                columns=columns, download_dir=config["cache_dir"],
+                regex=config.get("filter_regex"))
+        cache.start()
+        if columns is None and cache.pipe not in reader_pipes:
+            reader_pipes.append(cache.pipe)
+        if columns is None and checkpoints is not None:
+            checkpoints.register(cache.get_checkpoint_name())
+
+    if config["filter"] and filter_interval is not None:
         wfilter = WikiFilter(trace_file, config["filter_host"],
                 config["filter_interval"], config["filter_regex"],
-                True, config["filter_openfunc"], config["plot"])
+                True, config["filter_openfunc"], config["plot"],
+                slack=config["filter_slack"],
+                rewrite=config["filter_rewrite"])
         wfilter.start()
-        reader_pipes.append(wfilter.pipe)
+        filter_reader = FileReader(trace_file, config["trace_openfunc"],
+                [wfilter.pipe], index=index, interval=filter_interval)
+        filter_reader.start()
+    elif config["filter"]:
+        wfilter = WikiFilter(trace_file, config["filter_host"],
+                config["filter_interval"], config["filter_regex"],
+                True, config["filter_openfunc"], config["plot"],
+                channel=channel, slack=config["filter_slack"],
+                rewrite=config["filter_rewrite"], columns=columns)
+        wfilter.start()
+        if columns is None and wfilter.pipe not in reader_pipes:
+            reader_pipes.append(wfilter.pipe)
+        if columns is None and checkpoints is not None:
+            checkpoints.register(wfilter.get_checkpoint_name())
 
     if reader_pipes:
         reader = FileReader(trace_file, config["trace_openfunc"],
-                reader_pipes)
+                reader_pipes, index=index, checkpoints=checkpoints)
         reader.start()
         reader.join()
+    if filter_interval is not None:
+        filter_reader.join()
 
     if config["analyse"]:
         analyser.join()
+    if config["cache"]:
+        cache.join()
     if config["filter"]:
         wfilter.join()
+    if checkpoints is not None:
+        checkpoints.clear()
 
     # download
     if config["download"]:
@@ -320,7 +680,8 @@ def main(config):
 
         image_collector = FileCollector(config["download_dir"], wiki_images,
                 config["filter_regex"], config["download_port"],
-                config["download_async"])
+                config["download_async"], pipeline=config["download_pipeline"],
+                workers=config["download_workers"])
         image_reader = FileReader(imagefile, config["filter_openfunc"],
                 pipes=[image_collector.pipe])
         image_reader.start()
@@ -328,7 +689,8 @@ def main(config):
 
         thumb_collector = FileCollector(config["download_dir"], wiki_images,
                 config["filter_regex"], config["download_port"],
-                config["download_async"])
+                config["download_async"], pipeline=config["download_pipeline"],
+                workers=config["download_workers"])
         thumb_reader = FileReader(thumbfile, config["filter_openfunc"],
                 pipes=[thumb_collector.pipe])
         thumb_reader.start()
@@ -389,6 +751,26 @@ def main(config):
         for sclient in sync:
             sclient.join()
 
+    # replay
+    if config["replay"]:
+        replay_file = config["replay_file"]
+        if not os.path.isfile(replay_file):
+            print_error("Unable to find trace to replay " + replay_file)
+        log.info("Replay %s on %s:%d", replay_file, config["replay_host"],
+                config["replay_port"])
+        replayer = HTTPReplayer(config["replay_host"], config["replay_port"],
+                config["replay_speedup"], config["replay_connections"],
+                replay_file + ".replay")
+        replayer.start()
+        replay_reader = FileReader(replay_file, config["replay_openfunc"],
+                [replayer.pipe])
+        replay_reader.start()
+        replay_reader.join()
+        replayer.join()
+
+    if monitor is not None:
+        monitor.stop()
+
 
 if __name__ == '__main__':
     if len(sys.argv) != 2:
@@ -0,0 +1,82 @@
+#!/usr/bin/env python2.6
+'''
+File: test_columns.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Tests of the conversion of traces to columns.
+
+Usage:
+    python2.6 tests/test_columns.py
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+from ppr.columns import ColumnTrace
+
+
+class ColumnTraceTest(unittest.TestCase):
+    """Conversion of a trace to columns and back to lines."""
+
+    def setUp(self):
+        """Create the trace directory."""
+        self.directory = tempfile.mkdtemp(prefix="ppr-test-")
+        self.trace = os.path.join(self.directory, "trace.log")
+
+    def tearDown(self):
+        """Remove the trace and its columns."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def convert(self, lines):
+        """Write and convert a trace."""
+        with open(self.trace, "w") as output:
+            for line in lines:
+                output.write(line + "\n")
+        return ColumnTrace.convert(self.trace)
+
+    def test_lines(self):
+        """Every line is restored exactly."""
+        lines = ["%d %.3f http://en.wikipedia.org/wiki/Page_%d -" %
+                (nbr, 1194892100 + nbr / 7.0, nbr % 5) for nbr in xrange(100)]
+        lines.append("100 1194892115 http://upload.wikimedia.org/a.jpg save")
+        columns = self.convert(lines)
+        self.assertEqual(len(columns), len(lines))
+        self.assertEqual(columns.urls(), 6)
+        self.assertEqual([columns.get_line(pos) for pos in xrange(
+            len(columns))], lines)
+        self.assertEqual(columns.methods, ["-", "save"])
+
+    def test_error_rows(self):
+        """Lines, which cannot be stored exactly, are kept as error rows."""
+        lines = ["1 1194892100.1 http://en.wikipedia.org/wiki/A -",
+                "unparsable",
+                "007 1194892100.2 http://en.wikipedia.org/wiki/A -",
+                "3 1194892100.3e0 http://en.wikipedia.org/wiki/A -",
+                "4 1194892100.4 /wiki/A -",
+                "http://en.wikipedia.org/wiki/A"]
+        lines.extend(["%d 1194892101 http://en.wikipedia.org/wiki/A m%d" %
+            (nbr, nbr) for nbr in xrange(5, 261)])
+        columns = self.convert(lines)
+        self.assertEqual([columns.get_line(pos) for pos in xrange(
+            len(columns))], lines)
+        errors = [pos for pos in xrange(len(columns))
+                if columns.decimals[pos] == ColumnTrace.ERROR_ROW]
+        # the 257th method is the first one, which cannot be stored
+        self.assertEqual(errors, [1, 2, 3, 5, 261])
+        for pos in errors:
+            self.assertEqual(columns.url_host[columns.url[pos]], -1)
+            self.assertTrue(columns.timestamp[pos] !=
+                    columns.timestamp[pos])
+        # url without host, but stored exactly
+        self.assertEqual(columns.decimals[4], 1)
+        self.assertEqual(columns.url_host[columns.url[4]], -1)
+        self.assertEqual(columns.url[0], columns.url[6])
+
+
+if __name__ == "__main__":
+    unittest.main()
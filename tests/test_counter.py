@@ -0,0 +1,237 @@
+#!/usr/bin/env python2.6
+'''
+File: test_counter.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Tests of the memory bounded counters for trace statistics.
+
+Usage:
+    python2.6 tests/test_counter.py
+'''
+
+import os
+import sys
+import random
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+from ppr.counter import CounterBudget, HashSet, HyperLogLog, \
+        DistinctCounter, TopCounter, hash_key
+
+
+def get_keys(count, prefix="key"):
+    """Return distinct keys."""
+    return ["%s-%d" % (prefix, index) for index in xrange(count)]
+
+
+def get_stream(keys, length, exponent=1.0, seed=0):
+    """Return a stream of keys with a Zipf distribution of their counts."""
+    rand = random.Random(seed)
+    weights = [1.0 / (rank + 1) ** exponent for rank in xrange(len(keys))]
+    total = sum(weights)
+    cdf = []
+    for weight in weights:
+        cdf.append((cdf[-1] if cdf else 0.0) + weight / total)
+    stream = []
+    for index in xrange(length):
+        value = rand.random()
+        low, high = 0, len(cdf) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if cdf[middle] < value:
+                low = middle + 1
+            else:
+                high = middle
+        stream.append(keys[low])
+    return stream
+
+
+def get_counts(stream):
+    """Return the exact count of every key of a stream."""
+    counts = dict()
+    for key in stream:
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+class HashSetTest(unittest.TestCase):
+    """Set of hashes with open addressing."""
+
+    def test_add(self):
+        """Duplicates are counted once."""
+        hashes = HashSet()
+        for key in get_keys(20) * 3:
+            hashes.add(hash_key(key))
+        self.assertEqual(len(hashes), 20)
+        self.assertEqual(sorted(hashes), sorted([hash_key(key)
+            for key in get_keys(20)]))
+
+    def test_resize(self):
+        """A resized set keeps all hashes and finds them again."""
+        hashes = HashSet()
+        values = [hash_key(key) for key in get_keys(1000)]
+        for value in values:
+            if hashes.full():
+                hashes.resize(2 * hashes.capacity())
+            hashes.add(value)
+        self.assertEqual(len(hashes), 1000)
+        self.assertEqual(hashes.capacity(), 2048)
+        self.assertEqual(sorted(hashes), sorted(values))
+        for value in values:
+            hashes.add(value)
+        self.assertEqual(len(hashes), 1000)
+
+
+class HyperLogLogTest(unittest.TestCase):
+    """Estimation of the number of distinct hashes."""
+
+    def test_count(self):
+        """Estimates are within three standard errors."""
+        for count in [10, 1000, 50000]:
+            hll = HyperLogLog(0.02)
+            for key in get_keys(count):
+                hll.add(hash_key(key))
+            self.assertTrue(abs(hll.count() - count) <= 0.06 * count,
+                    (hll.count(), count))
+
+    def test_merge(self):
+        """A merged estimator counts the union of the hashes."""
+        first = HyperLogLog(0.02)
+        second = HyperLogLog(0.02)
+        for key in get_keys(20000):
+            first.add(hash_key(key))
+        for key in get_keys(20000, "other") + get_keys(10000):
+            second.add(hash_key(key))
+        first.merge(second)
+        self.assertTrue(abs(first.count() - 40000) <= 0.06 * 40000)
+        self.assertRaises(ValueError, first.merge, HyperLogLog(0.1))
+
+
+class DistinctCounterTest(unittest.TestCase):
+    """Distinct counts within a memory budget."""
+
+    def test_exact(self):
+        """The count is exact within the budget."""
+        counter = DistinctCounter(CounterBudget(1 << 20))
+        counter.update(get_keys(3000) + get_keys(1000))
+        self.assertTrue(counter.is_exact())
+        self.assertEqual(counter.count(), 3000)
+
+    def test_budget(self):
+        """Counters switch to HyperLogLog when the budget is exhausted."""
+        budget = CounterBudget(4096)
+        counter = DistinctCounter(budget, error=0.02)
+        keys = get_keys(255)
+        counter.update(keys)
+        self.assertTrue(counter.is_exact())
+        self.assertEqual(counter.count(), 255)
+        self.assertEqual(budget.used, 4096)
+        counter.update(get_keys(5000))
+        self.assertFalse(counter.is_exact())
+        self.assertTrue(abs(counter.count() - 5000) <= 0.06 * 5000)
+        # the table is released, the registers are used
+        self.assertEqual(budget.used, HyperLogLog(0.02).memory())
+        # a new counter of a shared exhausted budget starts estimated
+        budget.use(budget.size)
+        self.assertFalse(DistinctCounter(budget).is_exact())
+
+    def test_merge(self):
+        """Merged counters count the union of their keys."""
+        budget = CounterBudget(1 << 20)
+        first = DistinctCounter(budget, error=0.02)
+        second = DistinctCounter(budget, error=0.02)
+        first.update(get_keys(1000))
+        second.update(get_keys(1500))
+        first.merge(second)
+        self.assertTrue(first.is_exact())
+        self.assertEqual(first.count(), 1500)
+        estimated = DistinctCounter(budget, mode="hll", error=0.02)
+        estimated.update(get_keys(3000, "other"))
+        first.merge(estimated)
+        self.assertFalse(first.is_exact())
+        self.assertTrue(abs(first.count() - 4500) <= 0.06 * 4500)
+
+
+class TopCounterTest(unittest.TestCase):
+    """Most frequent keys with the Space-Saving algorithm."""
+
+    def setUp(self):
+        """Create a stream with more keys than counted."""
+        self.stream = get_stream(get_keys(2000), 30000)
+        self.counts = get_counts(self.stream)
+
+    def get_share(self, number):
+        """Return the exact share of the number most frequent keys."""
+        counts = sorted(self.counts.values(), reverse=True)
+        return float(sum(counts[:number])) / len(self.stream)
+
+    def assertBounds(self, top):
+        """Check the bounds of all counted keys."""
+        for (key, count, error) in top.top(len(top)):
+            self.assertTrue(count - error <= self.counts.get(key, 0) <=
+                    count, (key, count, error, self.counts.get(key, 0)))
+
+    def test_exact(self):
+        """All keys are counted exactly below the capacity."""
+        top = TopCounter(len(self.counts))
+        for key in self.stream:
+            top.add(key)
+        expected = sorted(self.counts.items(),
+                key=lambda item: (-item[1], item[0]))[:10]
+        self.assertEqual(top.top(10), [(key, count, 0)
+            for (key, count) in expected])
+        for number in [1, 10, 100, len(self.counts), 5000]:
+            self.assertEqual(top.share(number), (self.get_share(number),
+                self.get_share(number)))
+
+    def test_bounds(self):
+        """Counts and errors bound the frequency of every counted key."""
+        capacity = 100
+        top = TopCounter(capacity)
+        for key in self.stream:
+            top.add(key)
+        self.assertEqual(len(top), capacity)
+        self.assertEqual(top.total, len(self.stream))
+        self.assertBounds(top)
+        # every key more frequent than total / capacity is counted
+        counted = set([key for (key, count, error) in top.top(capacity)])
+        for (key, count) in self.counts.iteritems():
+            if count > len(self.stream) / capacity:
+                self.assertTrue(key in counted, key)
+
+    def test_share(self):
+        """The share is bounded, monotonic and unknown beyond capacity."""
+        top = TopCounter(100)
+        for key in self.stream:
+            top.add(key)
+        previous = (0.0, 0.0)
+        for number in [1, 2, 5, 10, 20, 50, 100]:
+            (lower, upper) = top.share(number)
+            self.assertTrue(lower <= self.get_share(number) <= upper,
+                    (number, lower, self.get_share(number), upper))
+            self.assertTrue(previous[0] <= lower and previous[1] <= upper)
+            previous = (lower, upper)
+        self.assertEqual(top.share(101), None)
+        self.assertEqual(TopCounter().share(10), (0.0, 0.0))
+
+    def test_merge(self):
+        """Merged counters keep the bounds of the whole stream."""
+        half = len(self.stream) // 2
+        first = TopCounter(100)
+        second = TopCounter(100)
+        for key in self.stream[:half]:
+            first.add(key)
+        for key in self.stream[half:]:
+            second.add(key)
+        first.merge(second)
+        self.assertEqual(len(first), 100)
+        self.assertEqual(first.total, len(self.stream))
+        self.assertBounds(first)
+        for number in [1, 10, 100]:
+            (lower, upper) = first.share(number)
+            self.assertTrue(lower <= self.get_share(number) <= upper)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python2.6
+'''
+File: test_histogram.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Tests of the mergeable histograms with logarithmic buckets.
+
+Usage:
+    python2.6 tests/test_histogram.py
+'''
+
+import os
+import sys
+import math
+import random
+import cPickle
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+from ppr.histogram import LogHistogram
+
+
+def get_percentile(values, percent):
+    """Return the exact percentile of sorted values."""
+    rank = max(int(math.ceil(percent / 100.0 * len(values))), 1)
+    return values[rank - 1]
+
+
+class LogHistogramTest(unittest.TestCase):
+    """Buckets, percentiles and merging of a LogHistogram."""
+
+    def test_buckets(self):
+        """Every value lies in the range of its bucket."""
+        values = range(1000) + [2 ** bits + offset for bits in xrange(10, 40)
+                for offset in [-1, 0, 1]]
+        for value in values:
+            (low, high) = LogHistogram.get_range(LogHistogram.get_index(value))
+            self.assertTrue(low <= value <= high, (value, low, high))
+            if value >= LogHistogram.SUB_COUNT:
+                # at most 1/64 of the value
+                self.assertTrue(high - low < value / 64.0, (value, low,
+                    high))
+            else:
+                self.assertEqual(low, high)
+
+    def test_ranges(self):
+        """The buckets cover all values without gaps and overlaps."""
+        end = -1
+        for index in xrange(LogHistogram.get_index(1 << 20) + 1):
+            (low, high) = LogHistogram.get_range(index)
+            self.assertEqual(low, end + 1)
+            self.assertEqual(LogHistogram.get_index(low), index)
+            self.assertEqual(LogHistogram.get_index(high), index)
+            end = high
+
+    def test_percentile(self):
+        """Percentiles are the exact ones within the bucket error."""
+        rand = random.Random(0)
+        values = [rand.expovariate(20.0) for index in xrange(20000)]
+        histogram = LogHistogram(1e6)
+        for value in values:
+            histogram.add(value)
+        values.sort()
+        for percent in [1, 10, 50, 90, 99, 99.9, 100]:
+            exact = get_percentile(values, percent)
+            value = histogram.percentile(percent)
+            self.assertTrue(exact <= value <= exact * (1 + 1 / 64.0) + 1e-6,
+                    (percent, exact, value))
+        self.assertEqual(histogram.percentile(0), histogram.percentile(1e-9))
+        self.assertEqual(histogram.percentile(100), max(values))
+        self.assertEqual(len(histogram), len(values))
+        self.assertAlmostEqual(histogram.mean(), sum(values) / len(values))
+
+    def test_empty(self):
+        """An empty histogram has no percentiles."""
+        histogram = LogHistogram()
+        self.assertEqual(histogram.percentile(50), None)
+        self.assertEqual(histogram.mean(), None)
+        histogram.add(-1.0)
+        self.assertEqual(histogram.percentiles([0, 100]), [-1.0, -1.0])
+
+    def test_merge(self):
+        """A merged histogram equals the histogram of all values."""
+        rand = random.Random(1)
+        values = [rand.uniform(0, 5) for index in xrange(5000)]
+        whole = LogHistogram(1e3)
+        first = LogHistogram(1e3)
+        second = LogHistogram(1e3)
+        for (index, value) in enumerate(values):
+            whole.add(value)
+            (first, second)[index % 2].add(value)
+        first.merge(cPickle.loads(cPickle.dumps(second)))
+        self.assertEqual(first.buckets, whole.buckets)
+        self.assertEqual((first.count, first.min, first.max),
+                (whole.count, whole.min, whole.max))
+        self.assertEqual(first.percentiles([50, 99]),
+                whole.percentiles([50, 99]))
+        self.assertRaises(ValueError, first.merge, LogHistogram(1e6))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python2.6
+'''
+File: test_http.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Tests of the response handling of the HTTP clients against the
+             stand-in server of the benchmarks.
+
+Usage:
+    python2.6 tests/test_http.py
+'''
+
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import unittest
+import multiprocessing
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+from ppr.basic import Process
+from ppr.http import FileCrawler
+from standin import StandInServer, StandInHandler
+
+Process.DEFAULT_LOGLEVEL = logging.WARNING
+
+
+class TestHandler(StandInHandler):
+    """
+    Handler of the stand-in server, which answers the paths of some
+    directories with special responses:
+
+    /test/files/nocontent/  : 204 without body
+    /test/files/eof/        : body without length, read until close
+    /test/files/close/      : body with Connection: close
+
+    """
+
+    def do_GET(self):
+        """Send the response of the directory of the path."""
+        kind = self.path.split("/")[3]
+        if kind == "nocontent":
+            self.send_response(204)
+            self.end_headers()
+        elif kind == "eof":
+            self.close_connection = 1
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write("x" * self.server.get_size(self.path))
+        elif kind == "close":
+            body = "x" * self.server.get_size(self.path)
+            self.close_connection = 1
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            StandInHandler.do_GET(self)
+
+
+def get_paths(kind, count):
+    """Return paths of a directory of the stand-in server."""
+    return ["/test/files/%s/%d.bin" % (kind, index)
+            for index in xrange(count)]
+
+
+class FileCrawlerTest(unittest.TestCase):
+    """Downloads of a FileCrawler from the stand-in server."""
+
+    # seconds to wait for the end of a crawl
+    TIMEOUT = 30
+
+    def setUp(self):
+        """Create the download directory."""
+        self.directory = tempfile.mkdtemp(prefix="ppr-test-")
+        self.server = None
+
+    def tearDown(self):
+        """Stop the server and remove the downloads."""
+        if self.server is not None:
+            self.server.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def start_server(self, size, max_size=None, chunk=0):
+        """Start a stand-in server."""
+        self.server = StandInServer(size=size, max_size=max_size,
+                chunk=chunk, handler=TestHandler)
+        self.server.start()
+
+    def crawl(self, paths, async=2, pipeline=1):
+        """Download the paths, return the missing files and the stats."""
+        (receiver, sender) = multiprocessing.Pipe(duplex=False)
+        crawler = FileCrawler("127.0.0.1", self.directory, self.server.port,
+                async, timeout=FileCrawlerTest.TIMEOUT, results=sender,
+                pipeline=pipeline)
+        crawler.start()
+        sender.close()
+        for path in paths:
+            crawler.pipe.send(path)
+        crawler.pipe.send(None)
+        crawler.pipe.close()
+        if not receiver.poll(FileCrawlerTest.TIMEOUT):
+            crawler.terminate()
+            crawler.join()
+            self.fail("Crawl not finished after %d seconds" %
+                    FileCrawlerTest.TIMEOUT)
+        error = receiver.recv()
+        stats = receiver.recv()
+        receiver.close()
+        crawler.join()
+        return (error, stats)
+
+    def assertFiles(self, paths):
+        """Check the size and the content of the files of the paths."""
+        for path in paths:
+            filename = os.path.join(self.directory, path.split("/", 3)[3])
+            self.assertTrue(os.path.isfile(filename), filename)
+            with open(filename, "rb") as finput:
+                data = finput.read()
+            self.assertEqual(len(data), self.server.get_size(path))
+            self.assertEqual(data.strip("x"), "")
+
+    def assertNoPartFiles(self):
+        """Check that no temporary file is left."""
+        for (root, dirs, files) in os.walk(self.directory):
+            for filename in files:
+                self.assertFalse(filename.endswith(".part"), filename)
+
+    def test_large_bodies(self):
+        """Bodies of several MB with Content-Length."""
+        self.start_server(2 << 20, 6 << 20)
+        paths = get_paths("large", 6)
+        (error, stats) = self.crawl(paths)
+        self.assertEqual(error, [])
+        self.assertEqual(stats.get_requests(), len(paths))
+        self.assertFiles(paths)
+        self.assertNoPartFiles()
+
+    def test_chunked_1_byte(self):
+        """Chunked bodies of 1 byte chunks."""
+        self.start_server(1000, 3000, chunk=1)
+        paths = get_paths("chunked", 20)
+        self.assertEqual(self.crawl(paths)[0], [])
+        self.assertFiles(paths)
+
+    def test_chunked_7_bytes(self):
+        """Chunked bodies of 7 byte chunks, not aligned to the sizes."""
+        self.start_server(1000, 5000, chunk=7)
+        paths = get_paths("chunked", 50)
+        self.assertEqual(self.crawl(paths)[0], [])
+        self.assertFiles(paths)
+
+    def test_chunked_64_kb(self):
+        """Chunked bodies of several MB in 64 KB chunks."""
+        self.start_server(1 << 20, 4 << 20, chunk=65536)
+        paths = get_paths("chunked", 6)
+        self.assertEqual(self.crawl(paths)[0], [])
+        self.assertFiles(paths)
+
+    def test_chunked_empty(self):
+        """Chunked bodies without chunks."""
+        self.start_server(0, chunk=1)
+        paths = get_paths("chunked", 10)
+        self.assertEqual(self.crawl(paths)[0], [])
+        self.assertFiles(paths)
+
+    def test_read_until_close(self):
+        """Bodies without length, which end with the connection."""
+        self.start_server(1000, 100000)
+        paths = get_paths("eof", 20)
+        (error, stats) = self.crawl(paths)
+        self.assertEqual(error, [])
+        self.assertEqual(stats.get_requests(), len(paths))
+        self.assertFiles(paths)
+        self.assertNoPartFiles()
+
+    def test_no_content(self):
+        """204 responses between other responses on the same connection."""
+        self.start_server(1000, 5000)
+        missing = get_paths("nocontent", 10)
+        paths = get_paths("keep", 10)
+        (error, stats) = self.crawl([path for pair in zip(missing, paths)
+            for path in pair], async=1)
+        self.assertEqual(sorted(error), sorted(["127.0.0.1" + path
+            for path in missing]))
+        self.assertEqual(stats.get_requests(), len(missing) + len(paths))
+        self.assertFiles(paths)
+        for path in missing:
+            self.assertFalse(os.path.exists(os.path.join(self.directory,
+                path.split("/", 3)[3])))
+
+    def test_close_in_pipeline(self):
+        """Connection: close with further requests sent ahead."""
+        self.start_server(1000, 5000)
+        closing = get_paths("close", 10)
+        paths = get_paths("keep", 40)
+        # every fifth response closes the connection
+        order = []
+        for (index, path) in enumerate(closing):
+            order.extend(paths[4 * index:4 * index + 4])
+            order.append(path)
+        (error, stats) = self.crawl(order, async=2, pipeline=8)
+        self.assertEqual(error, [])
+        self.assertEqual(stats.get_requests(), len(order))
+        self.assertFiles(order)
+        self.assertNoPartFiles()
+
+
+if __name__ == "__main__":
+    unittest.main()
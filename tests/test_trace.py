@@ -0,0 +1,87 @@
+#!/usr/bin/env python2.6
+'''
+File: test_trace.py
+Author: Sebastian Menski
+E-Mail: sebastian.menski@googlemail.com'
+Description: Tests of the statistics of the WikiAnalyser on a synthetic
+             trace of the benchmarks.
+
+Usage:
+    python2.6 tests/test_trace.py
+'''
+
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+from ppr.basic import Process, FileReader
+from ppr.columns import ColumnTrace
+from ppr.counter import TopCounter
+from ppr.trace import WikiAnalyser, numpy
+import fixtures
+
+Process.DEFAULT_LOGLEVEL = logging.WARNING
+
+
+class WikiAnalyserTest(unittest.TestCase):
+    """Statistics of the text and the column paths of a WikiAnalyser."""
+
+    LINES = 20000
+    # far less than the urls of every class of the trace
+    CAPACITY = 50
+
+    def setUp(self):
+        """Create the trace and its columns."""
+        self.directory = tempfile.mkdtemp(prefix="ppr-test-")
+        self.trace = fixtures.get_trace(self.directory,
+                WikiAnalyserTest.LINES)
+        self.columns = ColumnTrace.convert(self.trace)
+        self.capacity = TopCounter.DEFAULT_CAPACITY
+        self.backend = WikiAnalyser.DEFAULT_BACKEND
+        TopCounter.DEFAULT_CAPACITY = WikiAnalyserTest.CAPACITY
+
+    def tearDown(self):
+        """Restore the defaults and remove the trace."""
+        TopCounter.DEFAULT_CAPACITY = self.capacity
+        WikiAnalyser.DEFAULT_BACKEND = self.backend
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def analyse(self, name, columns=None):
+        """Analyse the trace, return the lines of its statistics."""
+        filename = os.path.join(self.directory, name, "trace.log")
+        os.mkdir(os.path.dirname(filename))
+        os.symlink(self.trace, filename)
+        analyser = WikiAnalyser(filename, plot=False, columns=columns)
+        analyser.start()
+        if columns is None:
+            reader = FileReader(filename, open, [analyser.pipe])
+            reader.start()
+            reader.join()
+        analyser.join()
+        self.assertEqual(analyser.exitcode, 0)
+        with open(filename + ".stats", "r") as finput:
+            return [line for line in finput if "tracefile" not in line]
+
+    def test_python_backend(self):
+        """The python backend writes the statistics of the text path."""
+        text = self.analyse("text")
+        WikiAnalyser.DEFAULT_BACKEND = "python"
+        self.assertEqual(self.analyse("python", self.columns), text)
+
+    def test_numpy_backend(self):
+        """The numpy backend writes the statistics of the text path."""
+        if numpy is None:
+            return
+        text = self.analyse("text")
+        WikiAnalyser.DEFAULT_BACKEND = "numpy"
+        self.assertEqual(self.analyse("numpy", self.columns), text)
+
+
+if __name__ == "__main__":
+    unittest.main()